@@ -0,0 +1,465 @@
+"""
+性能基准：在 10k / 1M / 10M 行的合成数据上跑各个热点路径，
+记录吞吐 (行/秒) 和峰值内存，和保存的基线对比找出性能回退。
+耗时和峰值内存分两遍量：量内存的 tracemalloc 本身很慢，不能和计时混在一起。
+
+用法：
+    python scripts/benchmark.py                      # 默认 10k + 1m
+    python scripts/benchmark.py --sizes 10k 1m 10m   # 10m 需要几 GB 内存
+    python scripts/benchmark.py --cases cleaner recon
+    python scripts/benchmark.py --update-baseline    # 把这次结果存成基线
+    python scripts/benchmark.py --skip-memory        # 只计时 (快一倍)
+
+每次的结果 data/benchmarks/bench_*.json 不进 git；baseline.json 和机器、Python 版本有关，
+要共享基线时在项目要求的 Python (>=3.12) 上重新生成再有意提交。
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.config import DATA_DIR
+from src.core.cleaner import GenericCleaner
+from src.core.excel_injector import ExcelInjector, render_reports
+from src.core.profiling import StepProfiler
+from src.services.recon_bot import ReconBot
+
+BENCH_DIR = DATA_DIR / "benchmarks"
+BASELINE_FILE = BENCH_DIR / "baseline.json"
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+CASES = ["cleaner", "recon", "excel", "charts"]
+
+# 一个 sheet 最多 1,048,576 行 (含表头)，超过的用例直接跳过
+EXCEL_MAX_ROWS = 1_048_575
+
+
+# === 合成数据 ===
+
+
+def make_dirty_sales(n: int, seed: int = 0) -> pd.DataFrame:
+    """和 gen_dirty_data.py 同样的脏数据模式，放大到 n 行 (约 10% 重复行)"""
+    rng = np.random.default_rng(seed)
+    regions = np.array(["NORTH", " North ", "south", "West", "East", "east "])
+    people = np.array(["John", "MIKE", "sara", "Tom", "Amy", "li wei"])
+    sales = np.array(["$1,000", "200", "$3,500.50", "N/A", "500 (Pending)", "$12.5"])
+    dates = pd.date_range("2023-01-01", "2024-12-31").strftime("%Y-%m-%d").to_numpy()
+    slash = np.char.replace(dates.astype(str), "-", "/")
+
+    unique = n - n // 10
+    date_pick = rng.integers(0, len(dates), unique)
+    df = pd.DataFrame(
+        {
+            "Region": regions[rng.integers(0, len(regions), unique)],
+            "Salesperson": people[rng.integers(0, len(people), unique)],
+            "County": np.char.add("County ", rng.integers(0, 200, unique).astype(str)),
+            "Sales": sales[rng.integers(0, len(sales), unique)],
+            "Calls": np.where(
+                rng.random(unique) < 0.05, np.nan, rng.integers(0, 100, unique)
+            ),
+            "Date": np.where(
+                rng.random(unique) < 0.3, slash[date_pick], dates[date_pick]
+            ),
+        }
+    )
+    dupes = df.sample(n - unique, replace=True, random_state=seed)
+    return pd.concat([df, dupes], ignore_index=True)
+
+
+def make_ledgers(n: int, seed: int = 0):
+    """ERP n 行；银行流水约 90% 能对上 (其中 2% 金额不符)，另有 2% 不明入账"""
+    rng = np.random.default_rng(seed)
+    ids = np.char.add("ORD-", np.arange(n).astype(str))
+    amounts = rng.integers(100, 100_000, n) / 100
+    erp = pd.DataFrame(
+        {
+            "Order_ID": ids,
+            "Date": "2024-01-01",
+            "Amount_CNY": amounts,
+            "Client": np.char.add("Client ", rng.integers(0, 1000, n).astype(str)),
+        }
+    )
+    paid = rng.random(n) < 0.9
+    bank_amounts = np.where(rng.random(n) < 0.02, amounts * 0.95, amounts)[paid]
+    extra = n // 50
+    bank = pd.DataFrame(
+        {
+            "Transaction_Ref": np.concatenate(
+                [ids[paid], np.char.add("UNK-", np.arange(extra).astype(str))]
+            ),
+            "Txn_Date": "2024-01-01",
+            "In_Amount": np.concatenate([bank_amounts, rng.integers(1, 1000, extra)]),
+        }
+    )
+    return erp, bank
+
+
+# === 用例 ===
+
+
+class Bench:
+    """
+    收集用例结果。整套用例跑两遍：
+    - 计时遍 (memory=False)：只记墙钟和 CPU 时间，不开 tracemalloc (它会让分配多的用例慢好几倍)
+    - 内存遍 (memory=True)：用 StepProfiler 量峰值内存，这一遍的耗时不采用
+    """
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.profiler = StepProfiler() if memory else None
+        self.records: List[Dict] = []
+        self.skipped: List[Dict] = []
+
+    def run(
+        self,
+        name: str,
+        rows: int,
+        func: Callable,
+        frame: Optional[Callable[[], pd.DataFrame]] = None,
+    ):
+        print(f"   {'🧠' if self.memory else '⏱️'} {name} ({rows:,} rows)")
+        if self.memory:
+            self.profiler.run(name, func, frame or (lambda: None))
+            record = self.profiler.report()["steps"][-1]
+            self.records.append(
+                {"case": name, "rows": rows, "peak_mem_mb": record["peak_mem_mb"]}
+            )
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        func()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        self.records.append(
+            {
+                "case": name,
+                "rows": rows,
+                "wall_s": round(wall, 4),
+                "cpu_s": round(cpu, 4),
+                "rows_per_s": round(rows / wall) if wall else None,
+            }
+        )
+
+    def skip(self, name: str, rows: int, reason: str):
+        print(f"   ⏭️ {name} ({rows:,} rows): {reason}")
+        self.skipped.append({"case": name, "rows": rows, "skipped": reason})
+
+    def close(self):
+        if self.profiler is not None:
+            self.profiler.close()
+
+
+def merge_results(timing: Bench, memory: Optional[Bench]) -> List[Dict]:
+    """计时遍的结果 + 内存遍量到的峰值内存 (按用例名和行数对上)"""
+    peaks = {}
+    if memory is not None:
+        peaks = {(r["case"], r["rows"]): r["peak_mem_mb"] for r in memory.records}
+    out = []
+    for record in timing.records:
+        record = dict(record)
+        record["peak_mem_mb"] = peaks.get((record["case"], record["rows"]))
+        out.append(record)
+    return out + timing.skipped
+
+
+def bench_cleaner(bench: Bench, n: int, workdir: Path):
+    raw = make_dirty_sales(n)
+    csv_path = workdir / "sales.csv"
+    raw.to_csv(csv_path, index=False)
+
+    cleaner = GenericCleaner()
+    steps = [
+        ("load_file", lambda: cleaner.load_file(csv_path)),
+        (
+            "load_file[pyarrow]",
+            lambda: GenericCleaner().load_file(csv_path, engine="pyarrow"),
+        ),
+        ("normalize_headers", lambda: cleaner.normalize_headers()),
+        (
+            "clean_text_columns",
+            lambda: cleaner.clean_text_columns(["region", "salesperson", "county"]),
+        ),
+        ("extract_numbers", lambda: cleaner.extract_numbers(["sales", "calls"])),
+        (
+            "handle_missing_values[mean]",
+            lambda: cleaner.handle_missing_values(["sales"], strategy="mean"),
+        ),
+        (
+            "handle_missing_values[drop]",
+            lambda: cleaner.handle_missing_values(["calls"], strategy="drop"),
+        ),
+        ("convert_dates", lambda: cleaner.convert_dates(["date"])),
+        ("add_period_column", lambda: cleaner.add_period_column("date")),
+        ("drop_duplicates", lambda: cleaner.drop_duplicates()),
+        (
+            "select_columns",
+            lambda: cleaner.select_columns(
+                ["region", "salesperson", "sales", "calls", "date", "month"]
+            ),
+        ),
+        ("optimize_memory", lambda: cleaner.optimize_memory()),
+        ("save[parquet]", lambda: cleaner.save(workdir / "clean.parquet")),
+    ]
+    for name, func in steps:
+        bench.run(f"cleaner.{name}", n, func, lambda: cleaner.df)
+    return cleaner.df
+
+
+def bench_recon(bench: Bench, n: int, workdir: Path):
+    erp, bank = make_ledgers(n)
+    erp_path, bank_path = workdir / "ERP_Records.csv", workdir / "Bank_Statement.csv"
+    erp.to_csv(erp_path, index=False)
+    bank.to_csv(bank_path, index=False)
+
+    bot = ReconBot()
+    bot.data_dir = workdir
+    bench.run("recon.load_data", n, bot.load_data)
+    bench.run("recon.reconcile", n, bot.reconcile, lambda: bot.df_result)
+    # 同一份数据按单号哈希分区、进程池并行 (进程数 = CPU 核数)
+    bench.run(
+        "recon.reconcile[partitioned]",
+        n,
+        lambda: bot.reconcile(max_workers=os.cpu_count()),
+        lambda: bot.df_result,
+    )
+    bench.run("recon.match_residue", n, bot.match_residue, lambda: bot.df_result)
+    # 流式写 Excel，超过行数上限时全量明细自动分 sheet
+    bench.run("recon.generate_report", n, bot.generate_report)
+    bench.run(
+        "recon.generate_report[parquet]",
+        n,
+        lambda: bot.generate_report(full_data="parquet"),
+    )
+
+    # 同一份账本走 DuckDB：报表从结果表按批流式写 Excel，全量明细也可以直接 COPY 成 Parquet
+    bot = ReconBot(backend="duckdb", temp_dir=workdir)
+    bot.data_dir = workdir
+    bench.run("recon[duckdb].load_data", n, bot.load_data)
+    bench.run("recon[duckdb].reconcile", n, bot.reconcile)
+    bench.run("recon[duckdb].match_residue", n, bot.match_residue)
+    bench.run("recon[duckdb].generate_report", n, bot.generate_report)
+    bench.run(
+        "recon[duckdb].generate_report[parquet]",
+        n,
+        lambda: bot.generate_report(full_data="parquet"),
+    )
+    bot.close()
+
+
+def bench_excel(bench: Bench, n: int, workdir: Path):
+    if n > EXCEL_MAX_ROWS:
+        bench.skip("excel.inject_dataframe", n, "exceeds the Excel row limit")
+        return
+    # 和 financial_template.xlsx 一样的布局：表头在第 3 行，数据从第 4 行开始
+    template = workdir / "template.xlsx"
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Monthly_Report"
+    ws.append(["Monthly Report"])
+    ws.append([])
+    ws.append(["Region", "County", "Revenue", "Growth"])
+    wb.save(template)
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "Region": np.array(["North", "South", "East", "West"])[
+                rng.integers(0, 4, n)
+            ],
+            "County": np.char.add("County ", rng.integers(0, 200, n).astype(str)),
+            "Revenue": rng.integers(1000, 50_000, n),
+            "Growth": rng.normal(0.05, 0.1, n).round(4),
+        }
+    )
+    # 模板加载：每次解析 xlsx vs 模板缓存里的副本 (第一次调用之后)
+    bench.run(
+        "excel.load_template[parse]",
+        n,
+        lambda: ExcelInjector(template, use_cache=False, verbose=False),
+    )
+    ExcelInjector(template, verbose=False)
+    bench.run(
+        "excel.load_template[cached]", n, lambda: ExcelInjector(template, verbose=False)
+    )
+
+    # 原来的逐格 ws.cell() 循环作对照
+    bench.run(
+        "excel.inject_dataframe[per_cell]",
+        n,
+        lambda: ExcelInjector(template).inject_dataframe(
+            df, "Monthly_Report", 4, 1, bulk=False
+        ),
+    )
+    injector = ExcelInjector(template)
+    bench.run(
+        "excel.inject_dataframe",
+        n,
+        lambda: injector.inject_dataframe(df, "Monthly_Report", 4, 1),
+    )
+    bench.run("excel.save", n, lambda: injector.save(workdir / "report.xlsx"))
+    # 每个 County 一份报表 (最多 200 份)，模板解析一次，进程池并行渲染
+    bench.run(
+        "excel.render_reports",
+        n,
+        lambda: render_reports(
+            df, "County", template, workdir / "reports", "Monthly_Report", 4, 1
+        ),
+    )
+
+
+def bench_charts(bench: Bench, n: int, df: Optional[pd.DataFrame]):
+    try:
+        from src.services.charts import SalesChartFactory
+    except ImportError as e:
+        bench.skip("charts", n, f"{e}")
+        return
+    if df is None:
+        # 没跑 cleaner 用例时，现洗一份图表要用的列
+        df = (
+            GenericCleaner(make_dirty_sales(n))
+            .normalize_headers()
+            .clean_text_columns(["region", "salesperson"])
+            .extract_numbers(["sales"])
+            .convert_dates(["date"])
+            .get_data()
+        )
+    factory = SalesChartFactory(df.copy())
+    bench.run("charts.region_bar", n, factory.create_region_bar_chart)
+    bench.run("charts.daily_trend", n, factory.create_daily_trend_chart)
+    bench.run("charts.salesperson_pie", n, factory.create_salesperson_pie_chart)
+
+
+# === 基线对比 ===
+
+
+def compare(
+    results: List[Dict],
+    baseline: List[Dict],
+    tolerance: float,
+    min_seconds: float = 0.1,
+    noise_s: float = 0.05,
+) -> List[str]:
+    """
+    耗时比基线慢超过 tolerance (0.2 = 20%) 的用例算回退。
+    两次都不到 min_seconds 的用例、或者只慢了不到 noise_s 秒的，都在计时噪声里，不算回退。
+    """
+    base = {(r["case"], r["rows"]): r for r in baseline if "wall_s" in r}
+    regressions = []
+    print("\n=== Baseline comparison ===")
+    for r in results:
+        old = base.get((r["case"], r["rows"]))
+        if "wall_s" not in r or old is None or not old["wall_s"]:
+            continue
+        ratio = r["wall_s"] / old["wall_s"]
+        flag = "✅"
+        if (
+            ratio > 1 + tolerance
+            and r["wall_s"] - old["wall_s"] > noise_s
+            and max(r["wall_s"], old["wall_s"]) >= min_seconds
+        ):
+            flag = "⚠️"
+            regressions.append(f"{r['case']} @ {r['rows']:,}")
+        mem = ""
+        if r.get("peak_mem_mb") is not None and old.get("peak_mem_mb") is not None:
+            mem = f"  mem {r['peak_mem_mb'] - old['peak_mem_mb']:+,.1f} MB"
+        print(
+            f"{flag} {r['case']:<34} {r['rows']:>11,} rows  "
+            f"{old['wall_s']:>8.3f}s -> {r['wall_s']:>8.3f}s ({ratio:5.2f}x){mem}"
+        )
+    return regressions
+
+
+def run_suite(bench: Bench, sizes: List[str], cases: List[str]):
+    """在一个临时目录里把选中的用例按规模跑一遍"""
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        for size in sizes:
+            n = SIZES[size]
+            print(f"\n🏁 [Bench] {n:,} rows ({'memory' if bench.memory else 'timing'})")
+            cleaned = None
+            if "cleaner" in cases:
+                cleaned = bench_cleaner(bench, n, workdir)
+            if "recon" in cases:
+                bench_recon(bench, n, workdir)
+            if "excel" in cases:
+                bench_excel(bench, n, workdir)
+            if "charts" in cases:
+                bench_charts(bench, n, cleaned)
+    bench.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="BPA Toolkit benchmarks")
+    parser.add_argument("--sizes", nargs="+", choices=SIZES, default=["10k", "1m"])
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    # 短于这个时间的用例不判回退 (秒)
+    parser.add_argument("--min-seconds", type=float, default=0.1)
+    # 慢了不到这么多秒的不算回退 (秒)
+    parser.add_argument("--noise", type=float, default=0.05)
+    # 只计时，不跑量内存的第二遍
+    parser.add_argument("--skip-memory", action="store_true")
+    args = parser.parse_args(argv)
+
+    started_at = datetime.now()
+    timing = Bench()
+    run_suite(timing, args.sizes, args.cases)
+    memory = None
+    if not args.skip_memory:
+        memory = Bench(memory=True)
+        run_suite(memory, args.sizes, args.cases)
+
+    results = merge_results(timing, memory)
+    run = {
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": platform.platform(),
+        "results": results,
+    }
+    BENCH_DIR.mkdir(parents=True, exist_ok=True)
+    out = BENCH_DIR / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    out.write_text(json.dumps(run, indent=2), encoding="utf-8")
+    print(f"\n✅ [Bench] Results saved to: {out}")
+
+    regressions = []
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        for field in ("python", "pandas", "machine"):
+            if baseline.get(field) != run[field]:
+                print(
+                    f"⚠️ Baseline {field} {baseline.get(field)} != {run[field]}, "
+                    "timings may not be comparable"
+                )
+        regressions = compare(
+            results, baseline["results"], args.tolerance, args.min_seconds, args.noise
+        )
+    else:
+        print(f"ℹ️ No baseline at {args.baseline}, run with --update-baseline")
+
+    if args.update_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(run, indent=2), encoding="utf-8")
+        print(f"📌 [Bench] Baseline updated: {args.baseline}")
+
+    if regressions:
+        print(f"❌ {len(regressions)} regressions: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
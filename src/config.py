@@ -17,7 +17,19 @@ PROCESSED_DIR = DATA_DIR / "processed"
 # 对账专用目录 (刚才漏掉的就是这一行)
 RECON_DATA_DIR = DATA_DIR / "reconciliation"
 
+# 增量对账：每天新到的 ERP_*.csv / Bank_*.csv 放这里
+RECON_DAILY_DIR = RECON_DATA_DIR / "daily"
+
+# 程序自己生成、随时可以删掉重建的缓存 (不进版本库)
+CACHE_DIR = DATA_DIR / ".cache"
+
+# Excel 模板解析后的 pickle 快照
+TEMPLATE_CACHE_DIR = CACHE_DIR / "templates"
+
+# 本地汇率历史 (ExchangeRateClient 每次取到的汇率都追加进来，按日期做 as-of 查询)
+FX_RATES_PATH = DATA_DIR / "fx_rates.parquet"
+
 # === 确保目录存在 ===
 # 自动创建所有定义的文件夹
-for d in [RAW_DIR, PROCESSED_DIR, RECON_DATA_DIR]:
+for d in [RAW_DIR, PROCESSED_DIR, RECON_DATA_DIR, RECON_DAILY_DIR]:
     d.mkdir(parents=True, exist_ok=True)
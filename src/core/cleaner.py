@@ -1,47 +1,320 @@
+import functools
+import hashlib
+import inspect
+import json
 from pathlib import Path
-from typing import List, Union, Any
+from typing import Any, Callable, List, Optional, Union
 
+import numpy as np
 import pandas as pd
+from pandas.api.types import (
+    is_bool_dtype,
+    is_float_dtype,
+    is_integer_dtype,
+    is_object_dtype,
+    is_string_dtype,
+)
+
+from src.core.dates import infer_date_formats, parse_dates
+from src.core.duckdb_backend import DuckDBPipeline
+from src.core.hash_index import HashIndex, hash_rows
+from src.core.plan import optimize, project
+from src.core.profiling import StepProfiler
+from src.core.readers import (
+    ENGINES,
+    DtypeHints,
+    read_header,
+    read_table,
+    sniff_encoding,
+)
+from src.core.storage import is_parquet_path, write_parquet
+from src.core.streaming import ChunkedRunner
+
+# 实现清洗步骤的模块：这些源码改了，旧的清洗结果和检查点都算过期
+_CODE_MODULES = (
+    "cleaner.py",
+    "dates.py",
+    "duckdb_backend.py",
+    "hash_index.py",
+    "plan.py",
+    "readers.py",
+    "storage.py",
+    "streaming.py",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def code_version(cleaner_cls: type = None) -> str:
+    """
+    清洗代码的指纹：上面这些模块 (加上 cleaner_cls 所在的模块，子类化的 cleaner) 的源码哈希。
+    只改了代码、没改步骤定义时，旧结果也不会被当成仍然有效。
+    """
+    here = Path(__file__).resolve().parent
+    files = [here / name for name in _CODE_MODULES]
+    if cleaner_cls is not None:
+        files.append(Path(inspect.getsourcefile(cleaner_cls)).resolve())
+    digest = hashlib.sha256()
+    for path in sorted(set(files)):
+        digest.update(path.name.encode("utf-8"))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def _pipeline_step(method):
+    """
+    清洗步骤装饰器。
+    普通模式下直接执行；延迟/流式模式下只记录 (方法名, 参数)，
+    等 save() / get_data() 时优化后统一执行。
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self._deferred:
+            return self._measure(method.__name__, lambda: method(self, *args, **kwargs))
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        params = dict(bound.arguments)
+        params.pop("self")
+        self._steps.append((method.__name__, params))
+        return self
+
+    return wrapper
+
+
+def _normalize_names(columns: pd.Index) -> pd.Index:
+    """列名标准化规则 (normalize_headers 和列裁剪共用)"""
+    return (
+        pd.Index(columns)
+        .str.strip()
+        .str.lower()
+        .str.replace(" ", "_", regex=False)
+        .str.replace("-", "_", regex=False)
+    )
+
+
+def _keep_rows(df: pd.DataFrame, mask) -> pd.DataFrame:
+    """
+    按布尔掩码保留行。
+    用 take 而不是 df[mask]：结果是独立的新表，后续步骤给它赋值不会触发 SettingWithCopyWarning。
+    """
+    return df.take(np.flatnonzero(mask))
+
+
+def _map_unique(s: pd.Series, func: Callable[[pd.Series], pd.Series]) -> pd.Series:
+    """
+    低基数列加速：只对去重后的值执行 func (astype / 正则 / 日期解析)，再按编码映射回每一行。
+    地区、人名、日期这类列几千万行可能只有几百个不同值，昂贵的字符串处理只需做几百次。
+    去重后的值保持首次出现的顺序 (NaN 也算一个值)，所以结果和逐行处理完全一致。
+    """
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    if len(uniques) > len(s) // 2:
+        # 基本不重复：映射反而多一次开销，直接处理整列
+        return func(s)
+    result = func(pd.Series(uniques, name=s.name))
+    return result.take(codes).set_axis(s.index)
 
 
 class GenericCleaner:
     """
     通用数据清洗工具箱。
     不包含任何具体业务逻辑，只提供原子化的清洗功能。
+
+    执行方式：
+    - 默认：每一步立即执行
+    - lazy=True：只记录执行计划，get_data() / save() 时合并同类步骤、裁剪列后一次执行
+    - load_file(chunksize=...)：流式，按分块执行计划并追加写出
+    - backend="duckdb"：整条计划编译成一条 DuckDB SQL，多线程 + 可落盘执行
+
+    profile=True 时记录每一步的耗时、内存和行列数，save() 时在输出旁边写一份 JSON 运行报告；
+    cprofile_steps 里的步骤额外用 cProfile 采样 (开销较大，只在排查时打开)。
     """
 
-    def __init__(self, df: pd.DataFrame = None):
+    def __init__(
+        self,
+        df: pd.DataFrame = None,
+        lazy: bool = False,
+        backend: str = "pandas",
+        profile: bool = False,
+        cprofile_steps: Optional[List[str]] = None,
+    ):
+        if backend not in ("pandas", "duckdb"):
+            raise ValueError(f"Unsupported backend: {backend}")
         # 支持传入 df，或者初始化为空后续 load
         self.df = df
+        self.lazy = lazy
+        self.backend = backend
+        # 延迟/流式模式下的状态
+        self._source = None
+        self._encoding = "utf-8"
+        self._chunksize = None
+        self._read_options = {"engine": "c", "dtype": None, "usecols": None}
+        self._steps = []
+        # drop_duplicates(index_path=...) 更新过、还没写回磁盘的指纹索引 (save() 成功后才写回)
+        self._pending_indexes: List[HashIndex] = []
+        # convert_dates 的格式命中报告：{列名: {格式: 行数}}
+        self.date_report = {}
+        self.profiler = (
+            StepProfiler(cprofile_steps) if profile or cprofile_steps else None
+        )
+
+    @property
+    def _deferred(self) -> bool:
+        return self.lazy or self._chunksize is not None or self.backend != "pandas"
+
+    def _measure(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        frame: Optional[Callable[[], Optional[pd.DataFrame]]] = None,
+    ) -> Any:
+        """开了 profile 就记录这一步，否则直接执行"""
+        if self.profiler is None:
+            return func()
+        return self.profiler.run(name, func, frame or (lambda: self.df))
+
+    @property
+    def _mode(self) -> str:
+        if self._chunksize is not None:
+            return "streaming"
+        if self.backend != "pandas":
+            return self.backend
+        return "lazy" if self.lazy else "eager"
 
     def load_file(
-        self, file_path: Union[str, Path], encoding: str = "utf-8"
+        self,
+        file_path: Union[str, Path],
+        encoding: Optional[str] = None,
+        chunksize: Optional[int] = None,
+        engine: str = "c",
+        dtype: Optional[DtypeHints] = None,
+        usecols: Optional[List[str]] = None,
     ) -> "GenericCleaner":
-        """加载 CSV 或 Excel"""
+        """
+        加载 CSV 或 Excel。
+        encoding: 不指定时从文件开头的字节样本嗅探 (utf-8 / utf-8-sig / ISO-8859-1)。
+        chunksize: 传入后进入流式模式 (仅 CSV)，后续步骤只记录，save() 时按分块执行。
+        engine: CSV 解析引擎，"c" (默认) / "pyarrow" / "duckdb"，后两个多线程。
+        dtype: 列类型提示，如 {"zip": str}，避免类型推断出错也省掉推断开销。
+        usecols: 只读这些原始列。
+        """
         path = Path(file_path)
         print(f"🔧 [Core] Loading: {path.name}")
 
-        if path.suffix == ".csv":
-            try:
-                self.df = pd.read_csv(path, encoding=encoding)
-            except UnicodeDecodeError:
-                self.df = pd.read_csv(path, encoding="ISO-8859-1")
-        elif path.suffix in [".xlsx", ".xls"]:
-            self.df = pd.read_excel(path)
-        else:
+        if path.suffix not in [".csv", ".xlsx", ".xls"]:
             raise ValueError("Unsupported file format")
+        if engine not in ENGINES:
+            raise ValueError(f"Unsupported engine: {engine}")
+
+        if chunksize is not None:
+            if self.backend == "duckdb":
+                raise ValueError(
+                    "The duckdb backend is already out-of-core, drop chunksize"
+                )
+            if path.suffix != ".csv":
+                raise ValueError("Streaming mode only supports CSV files")
+            if engine != "c":
+                raise ValueError("Streaming mode only supports the 'c' engine")
+            self._chunksize = chunksize
+            print(f"🌊 [Core] Streaming mode: {chunksize:,} rows per chunk")
+
+        if encoding is None and path.suffix == ".csv":
+            encoding = sniff_encoding(path)
+            print(f"🔤 [Core] Detected encoding: {encoding}")
+        self._encoding = encoding or "utf-8"
+        self._read_options = {"engine": engine, "dtype": dtype, "usecols": usecols}
+
+        if self._deferred:
+            # 延迟读取：等知道计划用到哪些列再读
+            self._source = path
+            self._steps = []
+        else:
+            self.df = self._measure(
+                "load_file",
+                lambda: read_table(path, self._encoding, **self._read_options),
+            )
         return self
 
+    def _read_header(self) -> List[str]:
+        if self._source is None:
+            return list(self.df.columns)
+        header = read_header(self._source, self._encoding)
+        usecols = self._read_options["usecols"]
+        return header if usecols is None else [c for c in header if c in usecols]
+
+    def _plan(self):
+        """优化记录下来的步骤，返回 (步骤, 需要读入的原始列)"""
+        steps, usecols = project(
+            optimize(self._steps), self._read_header(), _normalize_names
+        )
+        if usecols is None:
+            usecols = self._read_options["usecols"]
+        print(
+            f"🧠 [Core] Plan: {len(self._steps)} steps -> {len(steps)} steps"
+            + (f", reading {len(usecols)} columns" if usecols is not None else "")
+        )
+        return steps, usecols
+
+    def _collect(self):
+        """延迟模式：执行计划，结果落到 self.df"""
+        if not self._steps and self._source is None:
+            return
+        steps, usecols = self._plan()
+        if self._source is not None:
+            options = dict(self._read_options, usecols=usecols)
+            df = self._measure(
+                "load_file",
+                lambda: read_table(self._source, self._encoding, **options),
+                frame=lambda: None,
+            )
+        else:
+            df = self.df if usecols is None else self.df.reindex(columns=usecols)
+
+        # 用一个普通模式的 worker 在同一个 DataFrame 上依次执行
+        worker = type(self)(df)
+        for name, params in steps:
+            self._measure(
+                name,
+                functools.partial(getattr(worker, name), **params),
+                frame=lambda: worker.df,
+            )
+        self.df = worker.df
+        self.date_report.update(worker.date_report)
+        self._pending_indexes.extend(worker._pending_indexes)
+        self._source = None
+        self._steps = []
+
+    def _duckdb_pipeline(self) -> DuckDBPipeline:
+        steps = optimize(self._steps)
+        print(f"🦆 [Core] DuckDB plan: {len(self._steps)} steps -> {len(steps)} steps")
+        return DuckDBPipeline(
+            steps,
+            _normalize_names,
+            source=self._source,
+            df=self.df,
+            encoding=self._encoding,
+            usecols=self._read_options["usecols"],
+            dtype=self._read_options["dtype"],
+        )
+
+    @_pipeline_step
     def normalize_headers(self) -> "GenericCleaner":
         """列名标准化：转小写，空格变下划线 (Product Name -> product_name)"""
-        self.df.columns = (
-            self.df.columns.str.strip()
-            .str.lower()
-            .str.replace(" ", "_", regex=False)
-            .str.replace("-", "_", regex=False)
+        self.df.columns = _normalize_names(self.df.columns)
+        return self
+
+    @_pipeline_step
+    def select_columns(self, columns: List[str]) -> "GenericCleaner":
+        """
+        只保留指定列 (不存在的列忽略)。
+        延迟/流式模式下会下推到读文件阶段，其余列根本不读入内存。
+        """
+        self.df = self.df.reindex(
+            columns=[col for col in columns if col in self.df.columns]
         )
         return self
 
+    @_pipeline_step
     def handle_missing_values(
         self, columns: List[str], strategy: str = "drop", fill_value: Any = 0
     ) -> "GenericCleaner":
@@ -49,75 +322,270 @@ class GenericCleaner:
         处理缺失值 (NaN)。
         strategy: 'drop' (删除行), 'fill' (填充指定值), 'mean' (填充平均值)
         """
-        for col in columns:
-            if col not in self.df.columns:
-                continue
+        columns = [col for col in columns if col in self.df.columns]
+
+        if strategy == "drop":
+            # 一次过滤所有列，而不是每列过滤一遍
+            if columns:
+                self.df = _keep_rows(self.df, self.df[columns].notna().all(axis=1))
+            return self
 
-            if strategy == "drop":
-                self.df = self.df.dropna(subset=[col])
-            elif strategy == "fill":
+        for col in columns:
+            if strategy == "fill":
                 self.df[col] = self.df[col].fillna(fill_value)
             elif strategy == "mean":
                 mean_val = pd.to_numeric(self.df[col], errors="coerce").mean()
                 self.df[col] = self.df[col].fillna(mean_val)
         return self
 
+    @_pipeline_step
     def clean_text_columns(
-        self, columns: List[str], case_type: str = "title"
+        self, columns: List[str], case_type: str = "title", as_category: bool = False
     ) -> "GenericCleaner":
         """
         清洗文本列：去空格 + 大小写转换。
         case_type: 'lower', 'upper', 'title'
+        as_category: 结果存成 category (地区、人名这类重复值多的列省内存)
         """
+
+        def clean(s: pd.Series) -> pd.Series:
+            s = s.astype(str).str.strip()
+            if case_type == "lower":
+                return s.str.lower()
+            if case_type == "upper":
+                return s.str.upper()
+            if case_type == "title":
+                return s.str.title()
+            return s
+
         for col in columns:
             if col not in self.df.columns:
                 continue
-
-            s = self.df[col].astype(str).str.strip()
-            if case_type == "lower":
-                self.df[col] = s.str.lower()
-            elif case_type == "upper":
-                self.df[col] = s.str.upper()
-            elif case_type == "title":
-                self.df[col] = s.str.title()
+            result = _map_unique(self.df[col], clean)
+            self.df[col] = result.astype("category") if as_category else result
         return self
 
+    @_pipeline_step
     def extract_numbers(self, columns: List[str]) -> "GenericCleaner":
         """
         从脏字符串中提取数字 (例如 "$1,200.50 (Est)" -> 1200.50)。
         """
-        for col in columns:
-            if col not in self.df.columns:
-                continue
 
+        def extract(s: pd.Series) -> pd.Series:
             # 1. 转字符串，去逗号
-            s = self.df[col].astype(str).str.replace(",", "", regex=False)
+            s = s.astype(str).str.replace(",", "", regex=False)
             # 2. 正则提取
             extracted = s.str.extract(r"(\d+\.?\d*)", expand=False)
             # 3. 转数字
-            self.df[col] = pd.to_numeric(extracted, errors="coerce")
+            return pd.to_numeric(extracted, errors="coerce")
+
+        for col in columns:
+            if col not in self.df.columns:
+                continue
+            self.df[col] = _map_unique(self.df[col], extract)
         return self
 
-    def convert_dates(self, columns: List[str]) -> "GenericCleaner":
-        """将列转换为标准日期格式"""
+    @_pipeline_step
+    def convert_dates(
+        self,
+        columns: List[str],
+        formats: Optional[List[str]] = None,
+        sample_size: int = 1000,
+    ) -> "GenericCleaner":
+        """
+        将列转换为标准日期格式，同一列可以混着多种格式 (2024-01-01 / 2024/01/02)。
+        formats: 候选格式，按顺序向量化尝试；不指定时从前 sample_size 个不同值推断，
+                 再补上常见格式。都不匹配的才逐个解析。
+        每列各格式命中的行数记录在 self.date_report。
+        """
         for col in columns:
             if col not in self.df.columns:
                 continue
-            self.df[col] = pd.to_datetime(self.df[col], errors="coerce")
+            s = self.df[col]
+            if not (is_object_dtype(s) or is_string_dtype(s)):
+                # 已经是日期 / 数字，不需要按格式解析
+                self.df[col] = pd.to_datetime(s, errors="coerce")
+                continue
+
+            # 按不同值解析，再映射回每一行
+            codes, uniques = pd.factorize(s, use_na_sentinel=False)
+            uniques = pd.Series(uniques, name=col)
+            candidates = formats or infer_date_formats(uniques, sample_size)
+            parsed, labels = parse_dates(uniques, candidates)
+            self.df[col] = parsed.take(codes).set_axis(s.index)
+
+            counts = pd.Series(labels.take(codes)).value_counts()
+            self.date_report[col] = {k: int(v) for k, v in counts.items()}
         return self
 
-    def drop_duplicates(self) -> "GenericCleaner":
-        """去重"""
-        self.df = self.df.drop_duplicates()
+    @_pipeline_step
+    def add_period_column(
+        self, date_column: str, freq: str = "M", name: str = "month"
+    ) -> "GenericCleaner":
+        """
+        从日期列派生周期列 (freq='M' -> "2024-01")，一般用作 Parquet 分区键。
+        freq: 'Y' / 'M' / 'D'
+        """
+        if date_column not in self.df.columns:
+            return self
+        dates = pd.to_datetime(self.df[date_column], errors="coerce")
+        self.df[name] = dates.dt.to_period(freq).astype(str).where(dates.notna())
+        return self
+
+    @_pipeline_step
+    def drop_duplicates(
+        self,
+        subset: Optional[List[str]] = None,
+        index_path: Optional[Union[str, Path]] = None,
+    ) -> "GenericCleaner":
+        """
+        去重，保留第一次出现的行。
+        subset: 只按这些列判断重复 (如订单号)，默认整行。
+        index_path: 持久化指纹索引 (.npy)。历史批次出现过的行也会被去掉，
+                    本次新出现的行指纹写回索引，下一批接着用。
+                    和流式模式一样，save() 写完输出之后才写回索引：
+                    输出没写成功的话，这一批下次重跑不会被当成重复行丢掉。
+                    只用 get_data() 自己写输出的，写成功后调用 commit_indexes()。
+        """
+        if index_path is None:
+            self.df = self.df.drop_duplicates(subset=subset)
+            return self
+        index = HashIndex(index_path)
+        known = len(index)
+        is_new = index.add_new(hash_rows(self.df, subset))
+        print(
+            f"🧬 [Core] Dedup against {known:,} known rows: "
+            f"dropped {len(is_new) - is_new.sum():,}"
+        )
+        self.df = _keep_rows(self.df, is_new)
+        self._pending_indexes.append(index)
+        return self
+
+    @_pipeline_step
+    def optimize_memory(
+        self, category_ratio: float = 0.5, downcast_floats: bool = False
+    ) -> "GenericCleaner":
+        """
+        压缩内存 (不改变任何值)：
+        - 整数按取值范围降到 int8 / int16 / int32。不降成无符号：uint 和负数一运算就会回绕
+        - 浮点数默认保持 float64：单个值能原样转回 float32，大量求和的累计误差照样会变大
+          (200 万行金额求和差了几百)。downcast_floats=True 才降，且只降能原样转回来的列
+        - 不同值占比不超过 category_ratio 的文本列转 category (地区、人名、县)
+        """
+        before = self.df.memory_usage(deep=True).sum()
+        for col in self.df.columns:
+            s = self.df[col]
+            if is_integer_dtype(s) and not is_bool_dtype(s):
+                self.df[col] = pd.to_numeric(s, downcast="integer")
+            elif downcast_floats and is_float_dtype(s) and s.dtype != np.float32:
+                small = s.astype(np.float32)
+                if ((small.astype(s.dtype) == s) | s.isna()).all():
+                    self.df[col] = small
+            elif is_object_dtype(s) or is_string_dtype(s):
+                if len(s) and s.nunique(dropna=False) <= len(s) * category_ratio:
+                    self.df[col] = s.astype("category")
+        after = self.df.memory_usage(deep=True).sum()
+        print(
+            f"🗜️ [Core] Memory: {before / 2**20:,.1f} MB -> {after / 2**20:,.1f} MB "
+            f"(saved {before - after:,} bytes)"
+        )
         return self
 
+    def _print_date_report(self):
+        for col, counts in self.date_report.items():
+            print(f"📅 [Core] Date formats of '{col}': {counts}")
+
+    def plan_fingerprint(self) -> str:
+        """
+        执行计划的指纹 (步骤名 + 参数 + 清洗代码的版本)，只在延迟/流式模式下有意义。
+        清洗链或清洗代码有任何改动指纹都会变，用来判断旧的清洗结果是否过期。
+        """
+        if not self._deferred:
+            raise ValueError(
+                "Only deferred (lazy/streaming/duckdb) cleaners have a plan"
+            )
+        payload = json.dumps(
+            [code_version(type(self)), self._steps], sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
     def get_data(self) -> pd.DataFrame:
         """返回处理好的 DataFrame"""
+        if self._chunksize is not None:
+            raise ValueError("Streaming mode has no in-memory result, use save()")
+        if self.backend == "duckdb":
+            compact = [p for name, p in self._steps if name == "optimize_memory"]
+            self.df = self._duckdb_pipeline().to_df()
+            self._source = None
+            self._steps = []
+            if compact:
+                # SQL 里没有 category / 降位宽的概念，对取回来的结果再压一次
+                self.df = type(self)(self.df).optimize_memory(**compact[-1]).df
+        elif self.lazy:
+            self._collect()
         return self.df
 
-    def save(self, output_path: Union[str, Path]):
-        """保存文件"""
+    def save(
+        self,
+        output_path: Union[str, Path],
+        partition_cols: Optional[List[str]] = None,
+    ):
+        """
+        保存文件。后缀 .parquet 或传了 partition_cols 时写 Parquet (保留 dtype)，否则写 CSV。
+        partition_cols: Hive 分区列 (如 ["month"] / ["region"])，output_path 会是一个目录。
+        """
         p = Path(output_path)
         p.parent.mkdir(parents=True, exist_ok=True)
-        self.df.to_csv(p, index=False)
-        print(f"✅ [Core] Saved to: {p}")
+        if self._chunksize is not None:
+            steps, usecols = self._plan()
+            runner = ChunkedRunner(
+                type(self),
+                self._source,
+                steps,
+                self._chunksize,
+                self._encoding,
+                usecols,
+                self._read_options["dtype"],
+                self.profiler,
+            )
+            rows = runner.run(p, partition_cols)
+            self.date_report = runner.date_report
+            self._print_date_report()
+            print(f"✅ [Core] Streamed {rows:,} rows to: {p}")
+        elif self.backend == "duckdb" and (self._steps or self._source is not None):
+            # 整条计划是一条 SQL，没法拆出每一步，只记录总耗时
+            pipeline = self._duckdb_pipeline()
+            self._measure(
+                "duckdb",
+                lambda: pipeline.to_file(p, partition_cols),
+                frame=lambda: None,
+            )
+            print(f"✅ [Core] DuckDB wrote: {p}")
+        else:
+            if self.lazy:
+                self._collect()
+            self._print_date_report()
+            if partition_cols or is_parquet_path(p):
+                write = functools.partial(write_parquet, self.df, p, partition_cols)
+            else:
+                write = functools.partial(self.df.to_csv, p, index=False)
+            self._measure("save", write)
+            print(f"✅ [Core] Saved to: {p}")
+            # 输出写成功了才落盘持久化索引
+            self.commit_indexes()
+        self._write_run_report(p)
+
+    def commit_indexes(self):
+        """把 drop_duplicates(index_path=...) 更新过的指纹索引写回磁盘"""
+        for index in self._pending_indexes:
+            index.save()
+        self._pending_indexes = []
+
+    def _write_run_report(self, output_path: Path):
+        if self.profiler is None:
+            return
+        path = self.profiler.write(
+            output_path, mode=self._mode, date_report=self.date_report
+        )
+        self.profiler.close()
+        print(f"⏱️ [Core] Run report: {path}")
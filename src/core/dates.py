@@ -0,0 +1,66 @@
+from collections import Counter
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+# 兜底的候选格式 (按优先级)。斜杠日期默认月在前，和 pandas 的推断习惯一致
+DEFAULT_DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%Y/%m/%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y/%m/%d %H:%M:%S",
+    "%m/%d/%Y",
+    "%d/%m/%Y",
+    "%d.%m.%Y",
+    "%Y%m%d",
+]
+
+# 报告里的特殊标签
+MIXED = "mixed"  # 所有候选格式都不匹配，逐个元素解析成功的
+UNPARSED = "unparsed"  # 非空但解析失败 (变成 NaT)
+MISSING = "missing"  # 原本就是空值
+
+
+def infer_date_formats(values: pd.Series, sample_size: int = 1000) -> List[str]:
+    """
+    从样本推断候选格式：对前 sample_size 个不同的非空字符串逐个猜格式，
+    按出现次数排序，再补上 DEFAULT_DATE_FORMATS 里没出现过的。
+    """
+    sample = pd.Series(values).dropna().drop_duplicates().head(sample_size)
+    guessed = Counter(
+        fmt
+        for fmt in (guess_datetime_format(v) for v in sample if isinstance(v, str))
+        if fmt
+    )
+    formats = [fmt for fmt, _ in guessed.most_common()]
+    return formats + [fmt for fmt in DEFAULT_DATE_FORMATS if fmt not in formats]
+
+
+def parse_dates(s: pd.Series, formats: List[str]) -> Tuple[pd.Series, np.ndarray]:
+    """
+    按顺序尝试候选格式：每个格式只处理前面还没解析出来的行，都是向量化解析；
+    最后剩下的非空值再逐个解析一次 (format="mixed")，保证合法日期不丢。
+    返回 (解析结果, 每行命中的格式标签)。
+    """
+    result = pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+    labels = np.full(len(s), MISSING, dtype=object)
+    pending = s.notna().to_numpy()
+    text = s.astype(str)
+
+    for fmt in formats + [MIXED]:
+        if not pending.any():
+            break
+        parsed = pd.to_datetime(text[pending], format=fmt, errors="coerce")
+        if getattr(parsed.dtype, "tz", None) is not None:
+            # 带时区的格式 (%z) 统一转成 UTC 再去掉时区，才能和其它格式放进同一列
+            parsed = parsed.dt.tz_convert(None)
+        hit = parsed.notna().to_numpy()
+        idx = np.flatnonzero(pending)[hit]
+        result.iloc[idx] = parsed[hit].to_numpy()
+        labels[idx] = fmt
+        pending[idx] = False
+
+    labels[pending] = UNPARSED
+    return result, labels
@@ -0,0 +1,330 @@
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import duckdb
+import pandas as pd
+
+from src.core.dates import infer_date_formats
+from src.core.plan import Step
+from src.core.storage import clear_output, is_parquet_path
+
+# 行号列：DuckDB 多线程执行不保证顺序，用它把输出顺序对齐 pandas
+_RID = "__rid"
+
+
+def _quote(name: Any) -> str:
+    """SQL 标识符转义"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _literal(value: Any) -> str:
+    """Python 值 -> SQL 字面量"""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# pandas Period 的字符串形式 -> strftime 格式
+_PERIOD_FORMATS = {"Y": "%Y", "M": "%Y-%m", "D": "%Y-%m-%d"}
+
+
+def _is_text(sql_type: str) -> bool:
+    return sql_type.upper() == "VARCHAR"
+
+
+# pandas dtype 提示 -> DuckDB 列类型 (category 在 SQL 里就是文本)
+_SQL_TYPES = {
+    "str": "VARCHAR",
+    "object": "VARCHAR",
+    "string": "VARCHAR",
+    "category": "VARCHAR",
+    "float": "DOUBLE",
+    "float64": "DOUBLE",
+    "float32": "FLOAT",
+    "int": "BIGINT",
+    "int64": "BIGINT",
+    "Int64": "BIGINT",
+    "int32": "INTEGER",
+    "Int32": "INTEGER",
+    "bool": "BOOLEAN",
+    "boolean": "BOOLEAN",
+    "datetime64[ns]": "TIMESTAMP",
+}
+
+
+def _sql_type(dtype: Any) -> str:
+    name = dtype.__name__ if isinstance(dtype, type) else str(dtype)
+    if name not in _SQL_TYPES:
+        raise ValueError(f"Unsupported dtype for duckdb: {name}")
+    return _SQL_TYPES[name]
+
+
+class DuckDBPipeline:
+    """
+    把 GenericCleaner 记录的步骤编译成一条 DuckDB SQL (每步一个 CTE)。
+    整条查询在 DuckDB 里多线程执行，内存不够时自动落盘，结果直接写文件。
+    语义以 pandas 实现为准 (包括 astype(str) 把 NaN 变成 'nan' 这种细节)。
+    """
+
+    def __init__(
+        self,
+        steps: List[Step],
+        rename: Callable[[List[str]], List[str]],
+        source: Optional[Union[str, Path]] = None,
+        df: Optional[pd.DataFrame] = None,
+        encoding: str = "utf-8",
+        usecols: Optional[List[str]] = None,
+        dtype: Optional[Dict[str, Any]] = None,
+    ):
+        self.steps = steps
+        self.rename = rename
+        self.source = Path(source) if source is not None else None
+        self.df = df
+        self.encoding = encoding
+        self.usecols = usecols
+        self.dtype = dtype
+        self.con = duckdb.connect()
+
+    # === 编译 ===
+
+    def _source_sql(self) -> str:
+        if self.source is not None and self.source.suffix == ".csv":
+            encoding = "latin-1" if self.encoding.upper() == "ISO-8859-1" else "utf-8"
+            options = [
+                _literal(str(self.source)),
+                "header = true",
+                f"encoding = {_literal(encoding)}",
+            ]
+            if self.dtype:
+                types = ", ".join(
+                    f"{_literal(col)}: {_literal(_sql_type(t))}"
+                    for col, t in self.dtype.items()
+                )
+                options.append(f"types = {{{types}}}")
+            return f"read_csv({', '.join(options)})"
+        if self.source is not None:
+            self.df = pd.read_excel(self.source, usecols=self.usecols, dtype=self.dtype)
+        self.con.register("source_df", self.df)
+        return "source_df"
+
+    def _compile(self) -> str:
+        self._ctes = []
+        source = self._source_sql()
+        cols = "*"
+        if self.usecols is not None:
+            # 和 pandas 的 usecols 一样：只读这些列，按文件里的顺序
+            names = self.con.sql(f"SELECT * FROM {source}").columns
+            cols = ", ".join(_quote(c) for c in names if c in self.usecols)
+        self._add(f"SELECT {cols}, row_number() OVER () AS {_RID} FROM {source}")
+        for name, params in self.steps:
+            getattr(self, f"_compile_{name}")(**params)
+        return self._with(
+            f"SELECT * EXCLUDE ({_RID}) FROM {self._last} ORDER BY {_RID}"
+        )
+
+    def _add(self, select_sql: str):
+        self._ctes.append((f"step_{len(self._ctes)}", select_sql))
+
+    @property
+    def _last(self) -> str:
+        return self._ctes[-1][0]
+
+    def _with(self, tail: str) -> str:
+        ctes = ",\n".join(f"{name} AS ({sql})" for name, sql in self._ctes)
+        return f"WITH {ctes}\n{tail}"
+
+    def _schema(self) -> Dict[str, str]:
+        """当前这一步的列名 -> 类型 (只做绑定，不执行)"""
+        rel = self.con.sql(self._with(f"SELECT * FROM {self._last}"))
+        return {col: str(t) for col, t in zip(rel.columns, rel.types) if col != _RID}
+
+    def _project(self, exprs: Dict[str, str], where: Optional[str] = None):
+        """保留所有列，exprs 里的列替换成对应表达式"""
+        cols = [
+            f"{exprs[col]} AS {_quote(col)}" if col in exprs else _quote(col)
+            for col in self._schema()
+        ]
+        sql = f"SELECT {', '.join(cols)}, {_RID} FROM {self._last}"
+        if where:
+            sql += f" WHERE {where}"
+        self._add(sql)
+
+    def _present(self, columns: List[str]) -> List[str]:
+        schema = self._schema()
+        return [col for col in columns if col in schema]
+
+    def _compile_normalize_headers(self):
+        old = list(self._schema())
+        new = self.rename(old)
+        cols = [f"{_quote(o)} AS {_quote(n)}" for o, n in zip(old, new)]
+        self._add(f"SELECT {', '.join(cols)}, {_RID} FROM {self._last}")
+
+    def _compile_select_columns(self, columns: List[str]):
+        cols = [_quote(col) for col in self._present(columns)]
+        self._add(f"SELECT {', '.join(cols + [_RID])} FROM {self._last}")
+
+    def _compile_clean_text_columns(
+        self, columns: List[str], case_type: str = "title", as_category: bool = False
+    ):
+        # as_category 只影响 pandas 的内存表示，SQL 结果统一是 VARCHAR
+        exprs = {}
+        for col in self._present(columns):
+            # astype(str) + str.strip()
+            s = f"coalesce(CAST({_quote(col)} AS VARCHAR), 'nan')"
+            s = f"regexp_replace({s}, '^\\s+|\\s+$', '', 'g')"
+            if case_type == "lower":
+                s = f"lower({s})"
+            elif case_type == "upper":
+                s = f"upper({s})"
+            elif case_type == "title":
+                # str.title()：每段连续字母首字母大写，其余小写
+                words = f"regexp_extract_all({s}, '\\pL+|\\PL+')"
+                s = (
+                    f"array_to_string(list_transform({words}, "
+                    f"w -> upper(w[1]) || lower(w[2:])), '')"
+                )
+            exprs[col] = s
+        self._project(exprs)
+
+    def _compile_extract_numbers(self, columns: List[str]):
+        exprs = {}
+        for col in self._present(columns):
+            s = f"replace(coalesce(CAST({_quote(col)} AS VARCHAR), 'nan'), ',', '')"
+            number = f"NULLIF(regexp_extract({s}, '(\\d+\\.?\\d*)', 1), '')"
+            exprs[col] = f"TRY_CAST({number} AS DOUBLE)"
+        self._project(exprs)
+
+    def _compile_convert_dates(
+        self,
+        columns: List[str],
+        formats: Optional[List[str]] = None,
+        sample_size: int = 1000,
+    ):
+        schema = self._schema()
+        exprs = {}
+        for col in self._present(columns):
+            q = _quote(col)
+            if not _is_text(schema[col]):
+                exprs[col] = f"TRY_CAST({q} AS TIMESTAMP)"
+                continue
+            candidates = formats
+            if not candidates:
+                # 和 pandas 一样：按出现顺序取前 sample_size 个不同值推断候选格式
+                sample = self.con.sql(
+                    self._with(
+                        f"SELECT {q} FROM {self._last} WHERE {q} IS NOT NULL "
+                        f"GROUP BY {q} ORDER BY min({_RID}) LIMIT {int(sample_size)}"
+                    )
+                ).fetchall()
+                candidates = infer_date_formats([row[0] for row in sample], sample_size)
+            # 按顺序逐个格式尝试，都不匹配的交给 DuckDB 自己的日期识别兜底
+            tries = [f"try_strptime({q}, {_literal(fmt)})" for fmt in candidates]
+            tries.append(f"TRY_CAST({q} AS TIMESTAMP)")
+            exprs[col] = f"coalesce({', '.join(tries)})"
+        self._project(exprs)
+
+    def _compile_handle_missing_values(
+        self, columns: List[str], strategy: str = "drop", fill_value: Any = 0
+    ):
+        columns = self._present(columns)
+        if not columns:
+            return
+        if strategy == "drop":
+            where = " AND ".join(f"{_quote(col)} IS NOT NULL" for col in columns)
+            self._project({}, where=where)
+            return
+
+        schema = self._schema()
+        exprs = {}
+        for col in columns:
+            q = _quote(col)
+            if strategy == "mean":
+                value = f"(SELECT avg(TRY_CAST({q} AS DOUBLE)) FROM {self._last})"
+                value_is_text = False
+            elif strategy == "fill":
+                value = _literal(fill_value)
+                value_is_text = isinstance(fill_value, str)
+            else:
+                continue
+            # 类型对齐：文本列填数字 -> 转文本；数字列填文本 -> 列转文本
+            if _is_text(schema[col]):
+                exprs[col] = f"coalesce({q}, CAST({value} AS VARCHAR))"
+            elif value_is_text:
+                exprs[col] = f"coalesce(CAST({q} AS VARCHAR), {value})"
+            else:
+                exprs[col] = f"coalesce({q}, {value})"
+        self._project(exprs)
+
+    def _compile_add_period_column(
+        self, date_column: str, freq: str = "M", name: str = "month"
+    ):
+        if date_column not in self._schema():
+            return
+        fmt = _PERIOD_FORMATS[freq]
+        expr = f"strftime(TRY_CAST({_quote(date_column)} AS TIMESTAMP), '{fmt}')"
+        if name in self._schema():
+            self._project({name: expr})
+        else:
+            self._add(f"SELECT *, {expr} AS {_quote(name)} FROM {self._last}")
+
+    def _compile_drop_duplicates(
+        self, subset: Optional[List[str]] = None, index_path: Optional[str] = None
+    ):
+        if index_path is not None:
+            # 持久化索引是 pandas 的行指纹，SQL 里算不出同样的哈希
+            raise ValueError("drop_duplicates(index_path=...) needs the pandas backend")
+        if subset:
+            # 按部分列去重：每组保留行号最小 (最先出现) 的那一行
+            keys = ", ".join(_quote(col) for col in subset)
+            self._add(
+                f"SELECT * FROM {self._last} "
+                f"QUALIFY row_number() OVER (PARTITION BY {keys} ORDER BY {_RID}) = 1"
+            )
+            return
+        # GROUP BY 可以落盘，比窗口函数更适合超大表；min(rid) 保留第一次出现的行
+        cols = ", ".join(_quote(col) for col in self._schema())
+        self._add(
+            f"SELECT {cols}, min({_RID}) AS {_RID} FROM {self._last} GROUP BY {cols}"
+        )
+
+    def _compile_optimize_memory(
+        self, category_ratio: float = 0.5, downcast_floats: bool = False
+    ):
+        # DuckDB 是列存 + 自带压缩，SQL 里不用做什么；get_data() 取回的结果另外再压缩
+        pass
+
+    # === 执行 ===
+
+    def _run(self, action: Callable[[str], Any]) -> Any:
+        try:
+            return action(self._compile())
+        except duckdb.InvalidInputException as e:
+            # 和 pandas 路径一样的兜底：UTF-8 解码失败就按 ISO-8859-1 重来
+            if "unicode" not in str(e).lower() or self.encoding == "ISO-8859-1":
+                raise
+            self.encoding = "ISO-8859-1"
+            return action(self._compile())
+
+    def to_df(self) -> pd.DataFrame:
+        return self._run(lambda sql: self.con.sql(sql).df())
+
+    def to_file(
+        self,
+        output_path: Union[str, Path],
+        partition_cols: Optional[List[str]] = None,
+    ):
+        """结果直接由 DuckDB 写出，不经过 pandas"""
+        target = _literal(str(output_path))
+        if partition_cols:
+            cols = ", ".join(_quote(col) for col in partition_cols)
+            options = f"FORMAT PARQUET, PARTITION_BY ({cols})"
+        elif is_parquet_path(output_path):
+            options = "FORMAT PARQUET"
+        else:
+            options = "HEADER, DELIMITER ','"
+        clear_output(output_path)
+        self._run(lambda sql: self.con.execute(f"COPY ({sql}) TO {target} ({options})"))
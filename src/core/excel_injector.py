@@ -1,34 +1,132 @@
+import hashlib
+import os
+import pickle
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import openpyxl
 import pandas as pd
 
+from src.config import TEMPLATE_CACHE_DIR
+from src.core.report_writer import to_cell_values
+
+# === 模板缓存 ===
+# 解析好的模板 pickle 成字节：内存里一份，磁盘上 (TEMPLATE_CACHE_DIR，不和模板放在一起) 一份快照。
+# 每次取用 pickle.loads 出一个独立副本。pickle.loads 也要重建所有单元格对象，
+# 只比重新解析 xlsx 快 1.2~2 倍 (单元格越多、样式越多越接近 2 倍)，省下的主要是重复解析。
+# 键 = 路径 + 修改时间 + 大小 (+ openpyxl 版本)：模板一改就自动失效。
+_template_cache: Dict[str, Tuple[Tuple[int, int], bytes]] = {}
+
+
+def _template_key(path: Path) -> Tuple[str, Tuple[int, int]]:
+    stat = path.stat()
+    return str(path.resolve()), (stat.st_mtime_ns, stat.st_size)
+
+
+def template_bytes(
+    template_path: Union[str, Path], snapshot_dir: Optional[Union[str, Path]] = None
+) -> bytes:
+    """
+    模板的 pickle 快照 (内存 -> 磁盘快照 -> 解析 xlsx，依次回退)。
+    snapshot_dir: 磁盘快照放哪里，默认 TEMPLATE_CACHE_DIR (data/.cache/templates)。
+    """
+    path = Path(template_path)
+    name, version = _template_key(path)
+    cached = _template_cache.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    snapshot_dir = Path(snapshot_dir or TEMPLATE_CACHE_DIR)
+    prefix = hashlib.sha1(name.encode("utf-8")).hexdigest()[:12]
+    snapshot = snapshot_dir / (
+        f"{prefix}_{version[0]}_{version[1]}_{openpyxl.__version__}.pkl"
+    )
+    if snapshot.exists():
+        data = snapshot.read_bytes()
+    else:
+        data = pickle.dumps(
+            openpyxl.load_workbook(path), protocol=pickle.HIGHEST_PROTOCOL
+        )
+        try:
+            snapshot_dir.mkdir(parents=True, exist_ok=True)
+            # 同一个模板的旧快照删掉，再原子地写新的
+            for old in snapshot_dir.glob(f"{prefix}_*.pkl"):
+                old.unlink(missing_ok=True)
+            tmp = snapshot.with_suffix(".tmp")
+            tmp.write_bytes(data)
+            tmp.replace(snapshot)
+        except OSError:
+            # 缓存目录写不了时只用内存缓存
+            pass
+    _template_cache[name] = (version, data)
+    return data
+
+
+def load_template(
+    template_path: Union[str, Path], snapshot_dir: Optional[Union[str, Path]] = None
+) -> openpyxl.Workbook:
+    """从模板缓存取一个独立的工作簿副本 (改它不影响缓存和其他副本)"""
+    return pickle.loads(template_bytes(template_path, snapshot_dir))
+
 
 class ExcelInjector:
-    def __init__(self, template_path: Union[str, Path]):
+    def __init__(
+        self,
+        template_path: Union[str, Path],
+        workbook: Optional[openpyxl.Workbook] = None,
+        verbose: bool = True,
+        use_cache: bool = True,
+    ):
+        """
+        workbook: 已经解析好的模板副本 (批量出报表时用，不再重新解析 xlsx)
+        verbose: 打印进度 (批量模式下关掉，由批量函数统一汇报)
+        use_cache: 从模板缓存取副本 (默认)；False 时每次重新解析 xlsx
+        """
         self.template_path = Path(template_path)
-        # 加载工作簿 (Workbook)
-        print(f"Loading template: {self.template_path}")
-        self.wb = openpyxl.load_workbook(self.template_path)
+        self.verbose = verbose
+        if workbook is None:
+            # 加载工作簿 (Workbook)
+            self._log(f"Loading template: {self.template_path}")
+            if use_cache:
+                workbook = load_template(self.template_path)
+            else:
+                workbook = openpyxl.load_workbook(self.template_path)
+        self.wb = workbook
+
+    def _log(self, message: str):
+        if self.verbose:
+            print(message)
 
     def inject_dataframe(
-        self, df: pd.DataFrame, sheet_name: str, start_row: int, start_col: int
+        self,
+        df: pd.DataFrame,
+        sheet_name: str,
+        start_row: int,
+        start_col: int,
+        bulk: bool = True,
     ):
         """
-        核心方法：将 DataFrame 的数据逐个填入单元格。
+        核心方法：将 DataFrame 的数据填入单元格。
         start_row: 从第几行开始填 (Excel行号，从1开始)
         start_col: 从第几列开始填 (Excel列号，A=1, B=2...)
+        bulk: 整列先转换类型再写 (默认，NaN 写成空单元格)；False 时走原来的 df.values 逐格循环
         """
         if sheet_name not in self.wb.sheetnames:
             raise ValueError(f"Sheet '{sheet_name}' not found in template!")
 
         ws = self.wb[sheet_name]
 
-        print(
+        self._log(
             f"Injecting {len(df)} rows into sheet '{sheet_name}' starting at R{start_row}C{start_col}..."
         )
 
+        if bulk:
+            self._inject_bulk(ws, df, start_row, start_col)
+            return self
+
         # 将 DataFrame 转为 numpy array，遍历速度更快
         data_matrix = df.values.tolist()
 
@@ -46,10 +144,137 @@ class ExcelInjector:
 
         return self
 
+    @staticmethod
+    def _inject_bulk(ws, df: pd.DataFrame, start_row: int, start_col: int):
+        """
+        批量写：先整列转换类型 (NaN -> 空、Timestamp -> datetime、numpy 数字 -> Python 数字)，
+        再按列逐格赋值。只走公开的 ws.cell / Cell.value：类型推断、公式识别、
+        行号和表格范围 (max_row) 都由 openpyxl 自己维护。
+        模板里已有的单元格 (带样式的数据行) 只改值，样式不动；块外的公式、命名区域都不碰。
+        """
+        for j in range(df.shape[1]):
+            col = start_col + j
+            for row, value in enumerate(to_cell_values(df.iloc[:, j]), start=start_row):
+                # ws.cell(..., value=None) 不会清空原值，空值要显式赋值
+                ws.cell(row=row, column=col).value = value
+
     def save(self, output_path: Union[str, Path]):
-        print(f"Saving report to: {output_path}")
+        self._log(f"Saving report to: {output_path}")
         self.wb.save(output_path)
-        print("Done.")
+        self._log("Done.")
+
+
+# === 批量出报表 ===
+# 子进程里的模板：主进程从模板缓存取快照字节，每个进程只收一次；
+# 每份报表 pickle.loads 出一个独立副本 (不复用同一个工作簿反复保存：openpyxl 保存时会关掉图片的数据流)
+_worker_template: Dict = {}
+
+
+def _init_render_worker(template_path: str, snapshot: bytes):
+    _worker_template["path"] = template_path
+    _worker_template["bytes"] = snapshot
+
+
+def _render_report(
+    key,
+    df: pd.DataFrame,
+    sheet_name: str,
+    start_row: int,
+    start_col: int,
+    output_path: Path,
+) -> Dict:
+    """
+    渲染一份报表 (在子进程里执行)。
+    不抛异常：成功失败都返回一条结果记录，一份报表出错不影响其他报表。
+    """
+    started = time.perf_counter()
+    result = {"group": key, "output": str(output_path), "rows": len(df)}
+    try:
+        injector = ExcelInjector(
+            _worker_template["path"],
+            workbook=pickle.loads(_worker_template["bytes"]),
+            verbose=False,
+        )
+        injector.inject_dataframe(df, sheet_name, start_row, start_col)
+        injector.save(output_path)
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _safe_filename(value) -> str:
+    return re.sub(r"[^\w\-.]+", "_", str(value)).strip("_") or "blank"
+
+
+def render_reports(
+    df: pd.DataFrame,
+    split_key: str,
+    template_path: Union[str, Path],
+    output_dir: Union[str, Path],
+    sheet_name: str,
+    start_row: int,
+    start_col: int,
+    columns: Optional[List[str]] = None,
+    filename: str = "Report_{key}.xlsx",
+    max_workers: Optional[int] = None,
+) -> List[Dict]:
+    """
+    按 split_key 分组，每组用同一个模板出一份报表 (比如每个经销商一份 Monthly_Report)。
+    模板只解析一次，各组在进程池里并行注入、保存。
+    columns: 注入哪些列 (按模板的列顺序)，默认全部列。
+    filename: 输出文件名，{key} 换成组名 (非法字符替换成 _)。
+    max_workers: 进程数，默认等于 CPU 核数。
+    返回每份报表的结果 (group / output / rows / status / seconds / error)。
+    """
+    print(
+        f"🚀 [Batch] Rendering reports by '{split_key}' from {Path(template_path).name}"
+    )
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # 只读模式只解析工作簿目录，不为了查 sheet 名把整个模板再建一遍
+    probe = openpyxl.load_workbook(template_path, read_only=True)
+    sheet_names = probe.sheetnames
+    probe.close()
+    if sheet_name not in sheet_names:
+        raise ValueError(f"Sheet '{sheet_name}' not found in template!")
+
+    started = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count(),
+        initializer=_init_render_worker,
+        initargs=(str(template_path), template_bytes(template_path)),
+    ) as pool:
+        futures = [
+            pool.submit(
+                _render_report,
+                key,
+                group[columns] if columns else group,
+                sheet_name,
+                start_row,
+                start_col,
+                output_dir / filename.format(key=_safe_filename(key)),
+            )
+            for key, group in df.groupby(split_key, sort=True)
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result["status"] == "ok":
+                print(f"   ✅ {result['group']} ({result['seconds']}s)")
+            else:
+                print(f"   ❌ {result['group']}: {result['error']}")
+
+    failed = sum(r["status"] != "ok" for r in results)
+    print(
+        f"✅ [Batch] {len(results) - failed} reports, {failed} failed "
+        f"in {time.perf_counter() - started:.1f}s -> {output_dir}"
+    )
+    return results
 
 
 # --- 实战调用 ---
@@ -0,0 +1,106 @@
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+
+def hash_rows(df: pd.DataFrame, subset: Optional[List[str]] = None) -> np.ndarray:
+    """
+    把每一行哈希成一个 uint64 指纹 (用于跨分块/跨文件去重)。
+    数值列统一转 float64 再哈希：同一个 10 在含 NaN 的分块里是 float，
+    在别的分块里是 int，不统一的话会被当成两行。
+    """
+    frame = df if subset is None else df[subset]
+    normalized = {}
+    for col in frame.columns:
+        s = frame[col]
+        if is_numeric_dtype(s) and not is_bool_dtype(s):
+            s = s.astype("float64")
+        normalized[col] = s
+    return pd.util.hash_pandas_object(
+        pd.DataFrame(normalized, index=frame.index), index=False
+    ).to_numpy()
+
+
+class HashIndex:
+    """
+    已见行指纹的集合。
+    内部是一个有序的 uint64 数组 (每行 8 字节)，比 Python set 省一个数量级的内存。
+
+    传入 path 时是持久化索引 (.npy)：历史指纹以内存映射方式打开，只读不加载，
+    本次新增的指纹单独放在内存里，save() 时分块归并写回磁盘。
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None):
+        self.path = Path(path) if path is not None else None
+        self._base = np.empty(0, dtype=np.uint64)
+        if self.path is not None and self.path.exists():
+            self._base = np.load(self.path, mmap_mode="r")
+        self._hashes = np.empty(0, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return len(self._base) + len(self._hashes)
+
+    @staticmethod
+    def _isin(sorted_hashes: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+        if len(sorted_hashes) == 0:
+            return np.zeros(len(hashes), dtype=bool)
+        pos = np.searchsorted(sorted_hashes, hashes)
+        pos = np.minimum(pos, len(sorted_hashes) - 1)
+        return sorted_hashes[pos] == hashes
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """返回布尔掩码：True 表示该指纹已在索引中"""
+        return self._isin(self._base, hashes) | self._isin(self._hashes, hashes)
+
+    def add_new(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        返回布尔掩码：True 表示首次出现 (批内第一次 + 历史没见过)。
+        同时把这些新指纹并入索引。
+        """
+        first_in_batch = ~pd.Index(hashes).duplicated(keep="first")
+        is_new = first_in_batch & ~self.contains(hashes)
+
+        new = np.sort(hashes[is_new])
+        if len(new):
+            # 有序插入是一次线性归并，不需要整体重排
+            self._hashes = np.insert(
+                self._hashes, np.searchsorted(self._hashes, new), new
+            )
+        return is_new
+
+    def save(self, path: Optional[Union[str, Path]] = None, block_size: int = 1 << 22):
+        """
+        把历史指纹和本次新增的指纹归并成一个有序数组写回 .npy。
+        历史部分按 block_size 分块搬运，内存只和新增量 + 一个块有关。
+        """
+        target = Path(path) if path is not None else self.path
+        if target is None:
+            raise ValueError("No path to save the hash index to")
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        base, new = self._base, self._hashes
+        # 先写临时文件再替换：中途崩溃不会损坏历史索引 (也不能边读 mmap 边覆盖)
+        tmp = target.with_name(target.name + ".tmp.npy")
+        out = np.lib.format.open_memmap(
+            tmp, mode="w+", dtype=np.uint64, shape=(len(base) + len(new),)
+        )
+        # 新指纹 k 插在历史的 pos[k] 之前，所以最终位置是 pos[k] + k；
+        # 历史指纹 i 前面有 count(pos <= i) 个新指纹
+        pos = np.searchsorted(base, new)
+        out[pos + np.arange(len(new))] = new
+        for start in range(0, len(base), block_size):
+            block = base[start : start + block_size]
+            i = np.arange(start, start + len(block))
+            out[i + np.searchsorted(pos, i, side="right")] = block
+        out.flush()
+        # 先释放所有内存映射，Windows 下被映射的文件不能替换
+        del out, base
+        self._base = None
+        tmp.replace(target)
+
+        self.path = target
+        self._base = np.load(target, mmap_mode="r")
+        self._hashes = np.empty(0, dtype=np.uint64)
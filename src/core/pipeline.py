@@ -0,0 +1,174 @@
+import hashlib
+import inspect
+import json
+import pickle
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import pandas as pd
+
+from src.core.cleaner import GenericCleaner, code_version
+from src.core.plan import Step
+from src.core.storage import file_sha256
+
+
+def load_steps(path: Union[str, Path]) -> List[Step]:
+    """
+    从 JSON 文件读流水线定义：
+    [{"step": "normalize_headers"}, {"step": "extract_numbers", "columns": ["sales"]}]
+    """
+    with open(path, encoding="utf-8") as f:
+        items = json.load(f)
+    return [
+        (item["step"], {k: v for k, v in item.items() if k != "step"}) for item in items
+    ]
+
+
+class Pipeline:
+    """
+    声明式流水线：有序的 (GenericCleaner 步骤名, 参数) 列表。
+
+    apply() 把步骤挂到任意 cleaner 上 (普通 / 延迟 / 流式 / duckdb 都行)；
+    run() 逐步执行并在每一步之后存检查点，键 = 输入文件哈希 + 清洗代码版本 + 到这一步为止的所有步骤定义。
+    重跑时 (上次中途失败，或者改了第 N 步) 从最后一个仍然有效的检查点继续，
+    不用从原始文件重新解析、重新清洗。跑成功后，不属于这次运行的旧检查点会被删掉，
+    所以 checkpoint_dir 要专给一条流水线用。
+    """
+
+    def __init__(
+        self,
+        steps: List[Step],
+        checkpoint_dir: Optional[Union[str, Path]] = None,
+        cleaner_cls=GenericCleaner,
+    ):
+        self.cleaner_cls = cleaner_cls
+        self.steps = [self._normalize(name, params) for name, params in steps]
+        self.checkpoint_dir = Path(checkpoint_dir) if checkpoint_dir else None
+
+    def _normalize(self, name: str, params: Dict[str, Any]) -> Step:
+        """检查步骤名，并补全默认参数：写不写默认值不影响检查点的键"""
+        method = getattr(self.cleaner_cls, name, None)
+        if method is None or name.startswith("_"):
+            raise ValueError(f"Unknown pipeline step: {name}")
+        bound = inspect.signature(method).bind(None, **params)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        arguments.pop("self")
+        return name, arguments
+
+    def apply(self, cleaner: GenericCleaner) -> GenericCleaner:
+        for name, params in self.steps:
+            getattr(cleaner, name)(**params)
+        return cleaner
+
+    def checkpoint_keys(self, input_key: str) -> List[str]:
+        """每一步之后的检查点键：前一步的键 + 这一步的定义，链式哈希"""
+        keys = []
+        key = input_key
+        for step in self.steps:
+            payload = json.dumps([key, step], sort_keys=True, default=str)
+            key = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+            keys.append(key)
+        return keys
+
+    def _checkpoint_path(self, key: str) -> Path:
+        return self.checkpoint_dir / f"{key}.pkl"
+
+    def _save_checkpoint(self, key: str, df: pd.DataFrame):
+        # pickle 而不是 Parquet：中间结果常有混合类型的脏列，要求原样恢复
+        path = self._checkpoint_path(key)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(path)
+
+    def run(
+        self,
+        input_path: Union[str, Path],
+        output_path: Optional[Union[str, Path]] = None,
+        partition_cols: Optional[List[str]] = None,
+        profile: bool = False,
+        cprofile_steps: Optional[List[str]] = None,
+        **read_options,
+    ) -> pd.DataFrame:
+        """
+        执行流水线，返回结果 (output_path 给了就顺便保存)。
+        profile / cprofile_steps: 透传给 cleaner (从检查点续跑时只记录实际执行的步骤)。
+        read_options: 透传给 load_file (encoding / engine / dtype / usecols)。
+        """
+        options = {"profile": profile, "cprofile_steps": cprofile_steps}
+        if self.checkpoint_dir is None:
+            cleaner = self.cleaner_cls(**options).load_file(input_path, **read_options)
+            return self._finish(self.apply(cleaner), output_path, partition_cols)
+
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        # 只改了清洗代码、没改步骤定义时，旧检查点也要失效
+        input_key = json.dumps(
+            [file_sha256(input_path), code_version(self.cleaner_cls), read_options],
+            sort_keys=True,
+            default=str,
+        )
+        keys = self.checkpoint_keys(input_key)
+
+        # 从后往前找最后一个有效的检查点。
+        # 带持久化索引的去重要在这次运行里重新执行 (索引在保存输出之后才写回)，不能越过它续跑
+        resumable = next(
+            (
+                i
+                for i, (name, params) in enumerate(self.steps)
+                if name == "drop_duplicates" and params.get("index_path") is not None
+            ),
+            len(keys),
+        )
+        start = 0
+        cleaner = None
+        for i in range(resumable - 1, -1, -1):
+            path = self._checkpoint_path(keys[i])
+            if path.exists():
+                with open(path, "rb") as f:
+                    cleaner = self.cleaner_cls(pickle.load(f), **options)
+                start = i + 1
+                print(
+                    f"♻️ [Pipeline] Resuming after step {start}/{len(keys)} "
+                    f"({self.steps[i][0]})"
+                )
+                break
+        if cleaner is None:
+            cleaner = self.cleaner_cls(**options).load_file(input_path, **read_options)
+
+        for i in range(start, len(self.steps)):
+            name, params = self.steps[i]
+            getattr(cleaner, name)(**params)
+            self._save_checkpoint(keys[i], cleaner.df)
+        result = self._finish(cleaner, output_path, partition_cols)
+        self._prune_checkpoints(keys)
+        return result
+
+    @staticmethod
+    def _finish(
+        cleaner: GenericCleaner,
+        output_path: Optional[Union[str, Path]],
+        partition_cols: Optional[List[str]],
+    ) -> pd.DataFrame:
+        if output_path is not None:
+            cleaner.save(output_path, partition_cols)
+        return cleaner.get_data()
+
+    def _prune_checkpoints(self, keep: List[str]) -> int:
+        """删掉不是这次运行的检查点 (旧输入、旧步骤、旧代码留下的)，返回删除的个数"""
+        keep = set(keep)
+        stale = [f for f in self.checkpoint_dir.glob("*.pkl") if f.stem not in keep]
+        for f in stale:
+            f.unlink(missing_ok=True)
+        if stale:
+            print(f"🧹 [Pipeline] Removed {len(stale)} stale checkpoints")
+        return len(stale)
+
+    def clear_checkpoints(self) -> int:
+        """删除检查点目录下所有检查点，返回删除的个数"""
+        if self.checkpoint_dir is None or not self.checkpoint_dir.exists():
+            return 0
+        files = list(self.checkpoint_dir.glob("*.pkl"))
+        for f in files:
+            f.unlink()
+        return len(files)
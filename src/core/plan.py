@@ -0,0 +1,131 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 一个步骤 = (GenericCleaner 方法名, 参数字典)
+Step = Tuple[str, Dict[str, Any]]
+
+# 逐行、只改自己那几列的步骤：可以随意和别的列上的步骤交换顺序
+_ROW_WISE = {"clean_text_columns", "extract_numbers", "convert_dates"}
+
+
+def _kind(step: Step) -> str:
+    """
+    步骤分类，决定它能不能和别的步骤交换顺序：
+    - row_wise: 逐行变换，只读写自己的列
+    - mean: 只改自己的列，但结果依赖当前有哪些行
+    - drop: 按自己的列过滤行
+    - barrier: 改表头 / 用到所有列，谁也不能跨过去
+    """
+    name, params = step
+    if name in _ROW_WISE:
+        return "row_wise"
+    if name == "handle_missing_values":
+        return {"fill": "row_wise", "mean": "mean", "drop": "drop"}.get(
+            params["strategy"], "barrier"
+        )
+    return "barrier"
+
+
+def _columns(step: Step) -> set:
+    return set(step[1].get("columns") or ())
+
+
+def _commutes(a: Step, b: Step) -> bool:
+    """a、b 交换顺序后结果是否不变"""
+    kinds = {_kind(a), _kind(b)}
+    if "barrier" in kinds:
+        return False
+    if _columns(a) & _columns(b):
+        return False
+    # 均值依赖行集合，不能和删行步骤交换
+    return kinds != {"mean", "drop"}
+
+
+def _mergeable(a: Step, b: Step) -> bool:
+    """同一种操作、除 columns 外参数完全一致、列不重叠 -> 可以合并成一步"""
+    if a[0] != b[0] or _kind(a) == "barrier":
+        return False
+    params_a = {k: v for k, v in a[1].items() if k != "columns"}
+    params_b = {k: v for k, v in b[1].items() if k != "columns"}
+    return params_a == params_b and not (_columns(a) & _columns(b))
+
+
+def optimize(steps: List[Step]) -> List[Step]:
+    """
+    合并同类步骤：每个步骤尽量往前挪，和前面同类、同参数的步骤合并成一次调用。
+    例如两次 extract_numbers、多次 dropna 会各自变成一次。
+    """
+    out: List[Step] = []
+    for step in steps:
+        name, params = step
+        target = None
+        for j in range(len(out) - 1, -1, -1):
+            if _mergeable(out[j], step):
+                target = j
+                break
+            if not _commutes(out[j], step):
+                break
+
+        if target is None:
+            out.append((name, dict(params)))
+        else:
+            merged = out[target][1]
+            merged["columns"] = list(merged["columns"]) + list(params["columns"])
+    return out
+
+
+def project(
+    steps: List[Step], header: List[str], rename: Callable[[List[str]], List[str]]
+) -> Tuple[List[Step], Optional[List[str]]]:
+    """
+    列裁剪：如果计划里有 select_columns，只读入最终要用到的原始列，
+    并删掉只作用在被丢弃列上的步骤。
+    header: 源数据的原始列名；rename: normalize_headers 对列名做的变换。
+    返回 (新的步骤列表, usecols)，不能裁剪时 usecols 为 None。
+    """
+    select_at = next(
+        (i for i, (name, _) in enumerate(steps) if name == "select_columns"), None
+    )
+    if select_at is None:
+        return steps, None
+
+    before = steps[:select_at]
+    # 去重 / 重复 select 会用到所有列，不能裁剪
+    if any(_kind(s) == "barrier" and s[0] != "normalize_headers" for s in before):
+        return steps, None
+
+    # normalize_headers 之前的步骤引用的是原始列名，比较时先换成标准化之后的名字
+    normalize_at = max(
+        (i for i, (name, _) in enumerate(before) if name == "normalize_headers"),
+        default=-1,
+    )
+
+    def final_names(i: int, columns) -> List[str]:
+        columns = list(columns)
+        return list(rename(columns)) if i < normalize_at and columns else columns
+
+    # 最终保留的列 + 删行步骤要检查的列
+    needed = set(steps[select_at][1]["columns"])
+    for i, s in enumerate(before):
+        if _kind(s) == "drop":
+            needed |= set(final_names(i, _columns(s)))
+
+    pruned: List[Step] = []
+    for i, (name, params) in enumerate(before):
+        if "columns" in params and _kind((name, params)) != "drop":
+            cols = [
+                c
+                for c, final in zip(
+                    params["columns"], final_names(i, params["columns"])
+                )
+                if final in needed
+            ]
+            if not cols:
+                continue  # 死代码：作用的列最后会被丢掉
+            params = dict(params, columns=cols)
+        pruned.append((name, params))
+
+    names = list(header)
+    if any(name == "normalize_headers" for name, _ in before):
+        names = list(rename(names))
+    usecols = [raw for raw, name in zip(header, names) if name in needed]
+    return pruned + steps[select_at:], usecols
@@ -0,0 +1,147 @@
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, List, Optional, Union
+
+import pandas as pd
+
+
+def _shape(df: Optional[pd.DataFrame]):
+    return (None, None) if df is None else df.shape
+
+
+def report_path(output_path: Union[str, Path]) -> Path:
+    """运行报告放在输出旁边：clean_bba_sales.parquet -> clean_bba_sales.report.json"""
+    p = Path(output_path)
+    return p.with_name(f"{p.stem}.report.json")
+
+
+class StepProfiler:
+    """
+    清洗步骤的性能记录：每一步的墙钟时间、CPU 时间、峰值内存增量、进出的行列数。
+    同一个 key 的多次调用 (流式模式下每个分块一次) 会累加成一条记录。
+    cprofile_steps: 这些步骤额外用 cProfile 采样，报告里附上最耗时的函数。
+    """
+
+    def __init__(self, cprofile_steps: Optional[List[str]] = None, top: int = 15):
+        self.cprofile_steps = set(cprofile_steps or ())
+        self.top = top
+        self.started_at = datetime.now()
+        self._records: Dict[Hashable, Dict[str, Any]] = {}
+        self._profiles: Dict[Hashable, cProfile.Profile] = {}
+        # 只有自己开的 tracemalloc 才由自己关
+        self._owns_tracemalloc = False
+
+    def run(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        frame: Callable[[], Optional[pd.DataFrame]],
+        key: Optional[Hashable] = None,
+    ) -> Any:
+        """
+        执行 func 并记录。
+        frame 返回执行前后要统计行列数的 DataFrame (func 返回 DataFrame 时输出按返回值统计)。
+        """
+        key = object() if key is None else key
+        rows_in, cols_in = _shape(frame())
+
+        profile = None
+        if name in self.cprofile_steps:
+            profile = self._profiles.setdefault(key, cProfile.Profile())
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        tracemalloc.reset_peak()
+        mem_start = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = None
+        try:
+            result = profile.runcall(func) if profile else func()
+            return result
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            peak = tracemalloc.get_traced_memory()[1] - mem_start
+            # 读文件这类步骤的产出是返回值，而不是原地修改的 DataFrame
+            out = result if isinstance(result, pd.DataFrame) else frame()
+            rows_out, cols_out = _shape(out)
+
+            record = self._records.setdefault(
+                key,
+                {
+                    "step": name,
+                    "calls": 0,
+                    "wall_s": 0.0,
+                    "cpu_s": 0.0,
+                    "peak_mem_mb": 0.0,
+                    "rows_in": 0,
+                    "rows_out": 0,
+                },
+            )
+            record["calls"] += 1
+            record["wall_s"] += wall
+            record["cpu_s"] += cpu
+            record["peak_mem_mb"] = max(record["peak_mem_mb"], peak / 2**20)
+            record["rows_in"] += rows_in or 0
+            record["rows_out"] += rows_out or 0
+            record["cols_in"] = cols_in
+            record["cols_out"] = cols_out
+
+    def _hot_functions(self, profile: cProfile.Profile) -> List[Dict[str, Any]]:
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        stats.sort_stats("cumulative")
+        rows = []
+        for func in stats.fcn_list[: self.top]:
+            _, ncalls, tottime, cumtime, _ = stats.stats[func]
+            filename, line, fn = func
+            rows.append(
+                {
+                    "function": f"{Path(filename).name}:{line}({fn})",
+                    "ncalls": ncalls,
+                    "tottime_s": round(tottime, 4),
+                    "cumtime_s": round(cumtime, 4),
+                }
+            )
+        return rows
+
+    def report(self, **extra) -> Dict[str, Any]:
+        steps = []
+        for key, record in self._records.items():
+            step = dict(record)
+            for field in ("wall_s", "cpu_s", "peak_mem_mb"):
+                step[field] = round(step[field], 4)
+            if key in self._profiles:
+                step["hot_functions"] = self._hot_functions(self._profiles[key])
+            steps.append(step)
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "total_wall_s": round(sum(s["wall_s"] for s in steps), 4),
+            **extra,
+            "steps": steps,
+        }
+
+    def write(self, output_path: Union[str, Path], **extra) -> Path:
+        """把报告写到输出文件旁边，返回报告路径"""
+        path = report_path(output_path)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                self.report(output=str(output_path), **extra),
+                f,
+                ensure_ascii=False,
+                indent=2,
+                default=str,
+            )
+        return path
+
+    def close(self):
+        """停掉 tracemalloc (它会拖慢之后所有的内存分配)，之后再记录会重新打开"""
+        if self._owns_tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._owns_tracemalloc = False
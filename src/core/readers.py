@@ -0,0 +1,116 @@
+import codecs
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+
+from src.core.duckdb_backend import DuckDBPipeline
+
+# CSV 读取引擎：c = pandas 默认 (单线程，唯一支持分块)；pyarrow / duckdb 多线程解析
+ENGINES = ("c", "pyarrow", "duckdb")
+
+# 列名 -> dtype 提示，如 {"zip": str, "sales": "float64", "region": "category"}
+DtypeHints = Dict[str, Union[str, type]]
+
+FALLBACK_ENCODING = "ISO-8859-1"
+
+
+def sniff_encoding(path: Union[str, Path], sample_size: int = 1 << 20) -> str:
+    """
+    读文件开头一段字节判断编码，省掉"UTF-8 读到一半失败再整个重读"的 I/O。
+    有 BOM -> utf-8-sig；能按 UTF-8 解码 -> utf-8；否则 ISO-8859-1 (任何字节都合法)。
+    """
+    with open(path, "rb") as f:
+        sample = f.read(sample_size)
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        # 样本可能在一个多字节字符中间截断，没读完整个文件时不要求结尾完整
+        decoder.decode(sample, final=len(sample) < sample_size)
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+    return "utf-8"
+
+
+def _is_decode_error(e: Exception) -> bool:
+    if isinstance(e, UnicodeDecodeError):
+        return True
+    # pyarrow / duckdb 把解码失败包装成自己的异常
+    return "utf-8" in str(e).lower() or "unicode" in str(e).lower()
+
+
+def _has_binary(df: pd.DataFrame) -> bool:
+    for col in df.select_dtypes(include="object"):
+        first = df[col].first_valid_index()
+        if first is not None and isinstance(df[col].at[first], bytes):
+            return True
+    return False
+
+
+def _read_csv_duckdb(
+    path: Path,
+    encoding: str,
+    usecols: Optional[List[str]],
+    dtype: Optional[DtypeHints],
+) -> pd.DataFrame:
+    # 没有步骤的 DuckDB 流水线就是一个多线程 CSV 读取器
+    df = DuckDBPipeline(
+        [], list, path, encoding=encoding, usecols=usecols, dtype=dtype
+    ).to_df()
+    # SQL 里没有 category，读完再转
+    categories = {c: t for c, t in (dtype or {}).items() if str(t) == "category"}
+    return df.astype({c: t for c, t in categories.items() if c in df.columns})
+
+
+def read_csv(
+    path: Union[str, Path],
+    encoding: str = "utf-8",
+    usecols: Optional[List[str]] = None,
+    dtype: Optional[DtypeHints] = None,
+    engine: str = "c",
+) -> pd.DataFrame:
+    """
+    读 CSV。
+    engine="pyarrow" / "duckdb" 多线程解析，大文件快很多；
+    注意 duckdb 会自己推断类型 (比如 2024-01-01 直接读成日期)，需要固定类型时传 dtype。
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unsupported engine: {engine}")
+    if engine == "duckdb":
+        return _read_csv_duckdb(Path(path), encoding, usecols, dtype)
+    df = pd.read_csv(
+        path, encoding=encoding, usecols=usecols, dtype=dtype, engine=engine
+    )
+    if engine == "pyarrow" and _has_binary(df):
+        # pyarrow 遇到非法 UTF-8 不报错，而是把整列读成 bytes
+        raise UnicodeDecodeError(encoding, b"", 0, 1, "column read as bytes")
+    return df
+
+
+def read_table(
+    path: Path,
+    encoding: str = "utf-8",
+    usecols: Optional[List[str]] = None,
+    dtype: Optional[DtypeHints] = None,
+    engine: str = "c",
+) -> pd.DataFrame:
+    """读 CSV / Excel。编码已经嗅探过，回退重读只在坏字节出现在样本之后时才会发生"""
+    if path.suffix != ".csv":
+        return pd.read_excel(path, usecols=usecols, dtype=dtype)
+    try:
+        return read_csv(path, encoding, usecols, dtype, engine)
+    except Exception as e:
+        if encoding == FALLBACK_ENCODING or not _is_decode_error(e):
+            raise
+        return read_csv(path, FALLBACK_ENCODING, usecols, dtype, engine)
+
+
+def read_header(path: Path, encoding: str = "utf-8") -> List[str]:
+    """只读表头"""
+    if path.suffix != ".csv":
+        return list(pd.read_excel(path, nrows=0).columns)
+    try:
+        return list(pd.read_csv(path, encoding=encoding, nrows=0).columns)
+    except UnicodeDecodeError:
+        return list(pd.read_csv(path, encoding=FALLBACK_ENCODING, nrows=0).columns)
@@ -0,0 +1,138 @@
+import os
+from pathlib import Path
+from typing import Iterable, List, Optional, Union
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+# 一个 sheet 最多 1,048,576 行，第一行是表头
+EXCEL_MAX_ROWS = 1_048_576
+# sheet 名最长 31 个字符
+_MAX_SHEET_NAME = 31
+
+
+def to_cell_values(s: pd.Series) -> list:
+    """一列 -> openpyxl 能写的 Python 值 (缺失值写成空单元格)"""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        s = s.astype(object)
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):
+        values = s.dt.tz_localize(None) if s.dt.tz is not None else s
+        values = values.astype(object)
+    elif pd.api.types.is_float_dtype(s.dtype):
+        # float 列 tolist() 直接就是 Python float，只需要把 NaN 换成 None
+        values = s.to_numpy(dtype="float64", na_value=np.nan)
+        if not np.isnan(values).any():
+            return values.tolist()
+        values = s.astype(object)
+    elif pd.api.types.is_integer_dtype(s.dtype) and not s.hasnans:
+        return s.to_numpy().tolist()
+    else:
+        values = s.astype(object)
+    return values.where(s.notna(), None).tolist()
+
+
+class StreamingExcelWriter:
+    """
+    常量内存的 Excel 写出 (openpyxl write-only 模式)。
+    行写进去就序列化到临时文件，不在内存里建单元格对象；
+    DataFrame 按 chunksize 行一块转换，内存只和 chunksize 有关。
+    超过一个 sheet 的行数上限时自动续写到 Name_2、Name_3 …
+    先保存到同目录的临时文件，成功后再换到 path；with 块里出错时不保存，
+    不会留下一个看起来正常、其实只写了一半的报表。
+
+    with StreamingExcelWriter(path) as writer:
+        writer.write_frame(summary, "Summary", index=True)
+        writer.write_frame(full_data, "Full_Data")
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        chunksize: int = 50_000,
+        max_rows: int = EXCEL_MAX_ROWS,
+    ):
+        self.path = Path(path)
+        self.chunksize = chunksize
+        # 每个 sheet 的数据行数 (除去表头)
+        self.max_rows = max_rows - 1
+        self.wb = openpyxl.Workbook(write_only=True)
+
+    def __enter__(self) -> "StreamingExcelWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        try:
+            self.close(commit=False)
+        except Exception:
+            # 收尾失败不能盖住 with 块里原来的异常
+            pass
+
+    def write_frame(
+        self, df: pd.DataFrame, sheet_name: str, index: bool = False
+    ) -> List[str]:
+        """写一个 DataFrame，返回实际用到的 sheet 名"""
+        if index:
+            df = df.reset_index()
+        return self.write_chunks([df], sheet_name, list(df.columns))
+
+    def write_chunks(
+        self,
+        chunks: Iterable[pd.DataFrame],
+        sheet_name: str,
+        columns: Optional[List[str]] = None,
+    ) -> List[str]:
+        """
+        逐块写 (比如 DuckDB 分批取出的结果)，整表不需要先拼起来。
+        columns: 表头，不给就用第一块的列名。
+        """
+        sheets: List[str] = []
+        ws = None
+        rows_in_sheet = 0
+        header = [str(c) for c in columns] if columns is not None else None
+
+        def new_sheet():
+            name = sheet_name if not sheets else f"{sheet_name}_{len(sheets) + 1}"
+            sheet = self.wb.create_sheet(name[:_MAX_SHEET_NAME])
+            sheets.append(sheet.title)
+            sheet.append(header)
+            return sheet
+
+        for chunk in chunks:
+            if header is None:
+                header = [str(c) for c in chunk.columns]
+            if ws is None:
+                ws = new_sheet()
+            for start in range(0, len(chunk), self.chunksize):
+                part = chunk.iloc[start : start + self.chunksize]
+                cols = [to_cell_values(part.iloc[:, i]) for i in range(part.shape[1])]
+                for row in zip(*cols):
+                    if rows_in_sheet == self.max_rows:
+                        ws = new_sheet()
+                        rows_in_sheet = 0
+                    ws.append(row)
+                    rows_in_sheet += 1
+        if ws is None and header is not None:
+            # 空表也留一个只有表头的 sheet
+            new_sheet()
+        return sheets
+
+    def close(self, commit: bool = True):
+        """
+        保存到临时文件再换到 path。
+        commit=False：放弃这次写出 (临时文件删掉，已有的同名报表保持原样)；
+        仍然走一遍 save，write-only 模式的 sheet 临时文件才会被清理。
+        """
+        if self.wb is None:
+            return
+        tmp = self.path.with_name(f"{self.path.name}.tmp")
+        try:
+            self.wb.save(tmp)
+            if commit:
+                os.replace(tmp, self.path)
+        finally:
+            self.wb = None
+            tmp.unlink(missing_ok=True)
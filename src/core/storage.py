@@ -0,0 +1,196 @@
+import glob
+import hashlib
+import shutil
+from pathlib import Path
+from typing import Any, List, Optional, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# pyarrow 的过滤条件写法：[("month", "==", "2024-01"), ("region", "in", [...])]
+Filters = List[Tuple[str, str, Any]]
+
+
+def is_parquet_path(path: Union[str, Path]) -> bool:
+    return Path(path).suffix == ".parquet"
+
+
+def file_sha256(path: Union[str, Path], block_size: int = 1 << 20) -> str:
+    """按块读文件算 SHA-256，不会把大文件整个读进内存"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def clear_output(path: Union[str, Path]):
+    """覆盖写之前删掉旧文件 / 旧的分区目录，避免残留过期分区"""
+    p = Path(path)
+    if p.is_dir():
+        shutil.rmtree(p)
+    elif p.exists():
+        p.unlink()
+
+
+def write_parquet(
+    df: pd.DataFrame,
+    path: Union[str, Path],
+    partition_cols: Optional[List[str]] = None,
+):
+    """
+    写 Parquet，保留 dtype (日期不会再变回字符串)。
+    partition_cols: 按这些列做 Hive 分区 (path/month=2024-01/xxx.parquet)。
+    """
+    clear_output(path)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if partition_cols:
+        pq.write_to_dataset(table, path, partition_cols=partition_cols)
+    else:
+        pq.write_table(table, path)
+
+
+def replace_parquet_slice(
+    path: Union[str, Path],
+    name: str,
+    df: Optional[pd.DataFrame] = None,
+    partition_cols: Optional[List[str]] = None,
+):
+    """
+    在 Parquet 数据集目录里替换一个来源的那一片：path 下所有 <name>.part-*.parquet
+    (包括各分区目录里的) 先删掉，再把 df 写成同名前缀的文件；df 为 None 时只删除。
+    其他来源的文件不动。数据集里已有文件时按已有的 schema 写，各片的列类型保持一致。
+    """
+    root = Path(path)
+    pattern = f"{glob.escape(name)}.part-*.parquet"
+    schema = None
+    if root.is_dir():
+        for old in root.rglob(pattern):
+            old.unlink()
+        if df is not None and any(root.rglob("*.parquet")):
+            schema = ds.dataset(root, format="parquet", partitioning="hive").schema
+    if df is None or df.empty:
+        return
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root,
+        partition_cols=partition_cols,
+        basename_template=f"{name}.part-{{i}}.parquet",
+    )
+
+
+def read_parquet(
+    path: Union[str, Path],
+    columns: Optional[List[str]] = None,
+    filters: Optional[Filters] = None,
+) -> pd.DataFrame:
+    """
+    读 Parquet 文件或 Hive 分区目录。
+    columns: 列裁剪，只读这些列；
+    filters: 分区裁剪 + 行过滤，过滤条件落在分区列上时不匹配的分区目录根本不会打开。
+    """
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    expression = pq.filters_to_expression(filters) if filters else None
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def _pin_nulls(schema: pa.Schema) -> pa.Schema:
+    """全是空值的列 (null 类型) 先当字符串，不然后面分块里有值时类型对不上"""
+    return pa.schema(
+        [f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in schema],
+        metadata=schema.metadata,
+    )
+
+
+def _unify(current: pa.Schema, incoming: pa.Schema) -> pa.Schema:
+    """
+    两个分块的 schema 合并成能装下两者的类型 (int64 + double -> double，null + X -> X)；
+    合并不了的 (比如数字 + 文本) 退化成字符串。
+    """
+    fields = []
+    for field in current:
+        other = incoming.field(field.name)
+        try:
+            merged = pa.unify_schemas(
+                [pa.schema([field]), pa.schema([other])], promote_options="permissive"
+            ).field(0)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            merged = field.with_type(pa.string())
+        fields.append(merged)
+    return _pin_nulls(pa.schema(fields, metadata=current.metadata))
+
+
+class ParquetAppender:
+    """
+    流式写 Parquet：每个分块追加一次。
+    单文件用同一个 ParquetWriter；分区目录则每个分块写一批新文件。
+    schema 以第一个分块为准 (全空的列当字符串)，后面的分块转换成这个 schema；
+    某一块的类型装不下 (稀疏列前面全空、后面才出现文本，整数列后面出现空值)，
+    就把 schema 放宽，已经写出的部分按新 schema 重写一遍再继续。
+    """
+
+    def __init__(
+        self, path: Union[str, Path], partition_cols: Optional[List[str]] = None
+    ):
+        self.path = Path(path)
+        self.partition_cols = partition_cols
+        self._writer = None
+        # 单文件模式下 writer 实际在写的文件 (放宽 schema 后是临时文件，close 时换到 path)
+        self._file = self.path
+        self._schema = None
+        self._part = 0
+        clear_output(self.path)
+
+    def write(self, df: pd.DataFrame):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._schema is None:
+            self._schema = _pin_nulls(table.schema)
+        elif not table.schema.equals(self._schema, check_metadata=False):
+            schema = _unify(self._schema, table.schema)
+            if not schema.equals(self._schema, check_metadata=False):
+                self._widen(schema)
+        table = table.cast(self._schema)
+        if self.partition_cols:
+            pq.write_to_dataset(
+                table,
+                self.path,
+                partition_cols=self.partition_cols,
+                basename_template=f"part-{self._part}-{{i}}.parquet",
+            )
+        else:
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self._file, self._schema)
+            self._writer.write_table(table)
+        self._part += 1
+
+    def _widen(self, schema: pa.Schema):
+        """换成更宽的 schema，已经写出的数据按新 schema 重写 (逐批读写，不整表进内存)"""
+        self._schema = schema
+        if self.partition_cols:
+            # 分区目录里的文件不含分区列，各自按文件里有的列转换
+            for path in self.path.rglob("part-*.parquet"):
+                table = pq.ParquetFile(path).read()
+                target = pa.schema([schema.field(name) for name in table.schema.names])
+                pq.write_table(table.cast(target), path)
+            return
+        if self._writer is None:
+            return
+        self._writer.close()
+        old = self._file
+        self._file = self.path.with_name(f"{self.path.name}.{self._part}.tmp")
+        self._writer = pq.ParquetWriter(self._file, schema)
+        for batch in pq.ParquetFile(old).iter_batches():
+            self._writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+        if old != self.path:
+            old.unlink()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            if self._file != self.path:
+                self._file.replace(self.path)
+                self._file = self.path
@@ -0,0 +1,232 @@
+import functools
+import itertools
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.core.dates import infer_date_formats
+from src.core.hash_index import HashIndex, hash_rows
+from src.core.plan import Step
+from src.core.profiling import StepProfiler
+from src.core.storage import ParquetAppender, is_parquet_path
+
+
+class ChunkedRunner:
+    """
+    流式执行器：把 GenericCleaner 记录下来的步骤按固定大小的分块重放，结果追加写出。
+    内存只和 chunksize 有关，和文件大小无关。
+
+    需要"全局视角"的步骤单独处理：
+    - handle_missing_values(strategy="mean")：先扫一遍算出全局均值 (sum / count)，
+      再改写成 strategy="fill" 的普通填充步骤。
+    - convert_dates：候选日期格式只推断一次，而不是每个分块各自推断。
+    - drop_duplicates：用 HashIndex 记住已经写出过的行指纹，跨分块去重；
+      传了 index_path 时从历史索引开始，跑完再写回，跨批次去重。
+    """
+
+    def __init__(
+        self,
+        cleaner_cls,
+        source: Union[str, Path],
+        steps: List[Step],
+        chunksize: int,
+        encoding: str = "utf-8",
+        usecols: Optional[List[str]] = None,
+        dtype: Optional[Dict[str, Any]] = None,
+        profiler: Optional[StepProfiler] = None,
+    ):
+        self.cleaner_cls = cleaner_cls
+        self.source = Path(source)
+        self.steps = list(steps)
+        self.chunksize = chunksize
+        self.encoding = encoding
+        self.usecols = usecols
+        self.dtype = dtype
+        self.profiler = profiler
+        # 各分块 convert_dates 报告的累加：{列名: {格式: 行数}}
+        self.date_report: Dict[str, Dict[str, int]] = {}
+
+    def _read_chunks(self) -> Iterator[pd.DataFrame]:
+        return pd.read_csv(
+            self.source,
+            encoding=self.encoding,
+            usecols=self.usecols,
+            dtype=self.dtype,
+            chunksize=self.chunksize,
+        )
+
+    def _apply(
+        self,
+        df: pd.DataFrame,
+        steps: List[Step],
+        indexes: Dict[int, HashIndex],
+        report: bool = False,
+    ) -> pd.DataFrame:
+        """
+        在单个分块上按顺序执行步骤。
+        report=True (正式那一遍) 时累加日期格式报告，开了 profile 的话按步骤累计耗时。
+        """
+        worker = self.cleaner_cls(df)
+
+        def dedup(index: HashIndex, subset: Optional[List[str]]):
+            is_new = index.add_new(hash_rows(worker.df, subset))
+            worker.df = worker.df.take(np.flatnonzero(is_new))
+
+        for i, (name, params) in enumerate(steps):
+            if name == "drop_duplicates":
+                step = functools.partial(dedup, indexes[i], params.get("subset"))
+            else:
+                step = functools.partial(getattr(worker, name), **params)
+            if report and self.profiler is not None:
+                self.profiler.run(name, step, lambda: worker.df, key=i)
+            else:
+                step()
+        if report:
+            for col, counts in worker.date_report.items():
+                total = self.date_report.setdefault(col, {})
+                for label, n in counts.items():
+                    total[label] = total.get(label, 0) + n
+        return worker.df
+
+    @staticmethod
+    def _indexes(steps: List[Step]) -> Dict[int, HashIndex]:
+        """每个去重步骤一个指纹索引 (传了 index_path 的从磁盘上的历史索引开始)"""
+        return {
+            i: HashIndex(params.get("index_path"))
+            for i, (name, params) in enumerate(steps)
+            if name == "drop_duplicates"
+        }
+
+    def _resolve(self) -> List[Step]:
+        """
+        第一阶段：把依赖全表的步骤改写成和分块无关的步骤 (optimize_memory 直接跳过)。
+        - mean：扫一遍文件 (只执行到它之前)，累加 sum / count 得到全局均值，改写成 fill。
+        - convert_dates 没给 formats：候选格式是从样本推断的，
+          流式下每个分块各推各的会不一致，所以先推断一次把列表定下来。
+        """
+        resolved: List[Step] = []
+        for name, params in self.steps:
+            if name == "optimize_memory":
+                # 结果直接写文件，不在内存里停留；逐块降位宽反而会让各块 schema 不一致
+                continue
+            if name == "handle_missing_values" and params["strategy"] == "mean":
+                resolved.extend(self._resolve_mean(resolved, params["columns"]))
+            elif name == "convert_dates" and not params.get("formats"):
+                resolved.extend(self._resolve_date_format(resolved, params))
+            else:
+                resolved.append((name, params))
+        return resolved
+
+    def _resolve_mean(self, prefix: List[Step], columns: List[str]) -> List[Step]:
+        totals = {col: [0.0, 0] for col in columns}
+        indexes = self._indexes(prefix)
+        for chunk in self._read_chunks():
+            df = self._apply(chunk, prefix, indexes)
+            for col in columns:
+                if col in df.columns:
+                    values = pd.to_numeric(df[col], errors="coerce")
+                    totals[col][0] += values.sum()
+                    totals[col][1] += values.count()
+
+        steps = []
+        for col in columns:
+            total, count = totals[col]
+            mean_val = total / count if count else float("nan")
+            print(f"📐 [Core] Global mean of '{col}': {mean_val:.4f}")
+            steps.append(
+                (
+                    "handle_missing_values",
+                    {"columns": [col], "strategy": "fill", "fill_value": mean_val},
+                )
+            )
+        return steps
+
+    def _resolve_date_format(
+        self, prefix: List[Step], params: Dict[str, Any]
+    ) -> List[Step]:
+        """
+        和整表执行一样，按出现顺序取前 sample_size 个不同值推断候选格式，
+        样本凑够就停止扫描，之后所有分块用同一份列表。
+        """
+        size = params["sample_size"]
+        samples = {col: pd.Series(dtype=object) for col in params["columns"]}
+        indexes = self._indexes(prefix)
+        for chunk in self._read_chunks():
+            if all(len(v) >= size for v in samples.values()):
+                break
+            df = self._apply(chunk, prefix, indexes)
+            for col, seen in samples.items():
+                if col in df.columns and len(seen) < size:
+                    values = pd.concat([seen, df[col].dropna().astype(object)])
+                    samples[col] = values.drop_duplicates().head(size)
+
+        return [
+            (
+                "convert_dates",
+                dict(params, columns=[col], formats=infer_date_formats(values, size)),
+            )
+            for col, values in samples.items()
+        ]
+
+    def run(
+        self,
+        output_path: Union[str, Path],
+        partition_cols: Optional[List[str]] = None,
+    ) -> int:
+        """执行并写出 (CSV 或 Parquet)，返回写出的行数"""
+        try:
+            return self._run(output_path, partition_cols)
+        except UnicodeDecodeError:
+            # 和 load_file 一样的兜底：换编码从头再来 (输出文件会被重写)
+            # (编码已经在 load_file 嗅探过，只有坏字节在样本之后才会走到这里)
+            if self.encoding == "ISO-8859-1":
+                raise
+            self.encoding = "ISO-8859-1"
+            return self._run(output_path, partition_cols)
+
+    def _measure(self, name: str, func: Callable[[], Any]) -> Any:
+        if self.profiler is None:
+            return func()
+        return self.profiler.run(name, func, lambda: None, key=name)
+
+    def _run(
+        self, output_path: Union[str, Path], partition_cols: Optional[List[str]]
+    ) -> int:
+        # 预扫描 (全局均值 / 日期格式) 单独记一项
+        steps = self._measure("resolve", self._resolve)
+        indexes = self._indexes(steps)
+        self.date_report = {}
+        rows = 0
+        parquet = None
+        if partition_cols or is_parquet_path(output_path):
+            parquet = ParquetAppender(output_path, partition_cols)
+        try:
+            chunks = iter(self._read_chunks())
+            for i in itertools.count():
+                chunk = self._measure("read_csv", lambda: next(chunks, None))
+                if chunk is None:
+                    break
+                df = self._apply(chunk, steps, indexes, report=True)
+                if parquet is not None:
+                    write = functools.partial(parquet.write, df)
+                else:
+                    # 第一个分块覆盖写 + 表头，之后追加
+                    write = functools.partial(
+                        df.to_csv,
+                        output_path,
+                        mode="w" if i == 0 else "a",
+                        header=i == 0,
+                        index=False,
+                    )
+                self._measure("save", write)
+                rows += len(df)
+        finally:
+            if parquet is not None:
+                parquet.close()
+        # 全部写完才落盘持久化索引：中途失败的话历史索引保持不变
+        for index in indexes.values():
+            if index.path is not None:
+                index.save()
+        return rows
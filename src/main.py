@@ -8,7 +8,8 @@ sys.path.append(str(PROJECT_ROOT))
 # 引入所有模块
 from scripts.gen_dirty_data import generate_chaos
 from scripts.gen_mock_recon import create_mock_files
-from src.services.bba_etl import run_bba_sales_etl
+from src.services.bba_etl import run_bba_sales_etl, run_bba_sales_batch
+from src.services.open_items import run_daily_recon
 from src.services.recon_bot import run_recon_bot
 
 # 如果 api_client 里你也封装了 run_exchange_demo，也可以引进来
@@ -23,6 +24,8 @@ def main():
         print("--- Services (业务逻辑) ---")
         print("3. Run BBA Sales ETL (Cleaning)")
         print("4. Run Reconciliation Bot (Accounting)")
+        print("5. Run BBA Sales ETL (Batch: all raw files, parallel)")
+        print("6. Run Incremental Reconciliation (daily files vs open items)")
         print("q. Quit")
 
         choice = input("\nSelect Action: ")
@@ -35,6 +38,10 @@ def main():
             run_bba_sales_etl()
         elif choice == "4":
             run_recon_bot()
+        elif choice == "5":
+            run_bba_sales_batch()
+        elif choice == "6":
+            run_daily_recon()
         elif choice.lower() == "q":
             print("Bye!")
             break
@@ -10,6 +10,9 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
 from src.services.charts import SalesChartFactory
+from src.services.bba_etl import SALES_DATASET
+from src.core.cleaner import GenericCleaner
+from src.core.storage import read_parquet
 from src.config import PROCESSED_DIR
 
 # === 页面配置 ===
@@ -24,14 +27,27 @@ if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
 
 
 @st.cache_data(ttl=3600, show_spinner="正在加载清洗后的数据...")
-def load_sales_data(file_path):
+def load_sales_data(file_path, month=None, compact=True):
     """
-    读取清洗后的 CSV 数据。
-    缓存机制：只要 file_path 没变，1小时内直接返回内存结果，不读硬盘。
+    读取清洗后的 Parquet 数据 (dtype 原样保留，不用重新解析)。
+    month: 只看某个月，按月分区时只会读这一个分区目录。
+    compact: 压缩内存 (地区/人名转 category、数值降位宽)，每个会话都缓存一份，省得多。
+    缓存机制：只要 file_path / month 没变，1小时内直接返回内存结果，不读硬盘。
     """
     # 可以在这里打印日志，观察缓存是否生效
     # print(">>> [Cache Miss] Loading data from disk...")
-    return pd.read_csv(file_path)
+    filters = [("month", "==", month)] if month else None
+    df = read_parquet(file_path, filters=filters)
+    if compact:
+        df = GenericCleaner(df).optimize_memory().get_data()
+    return df
+
+
+@st.cache_data(ttl=3600)
+def load_months(file_path):
+    """可选月份列表 (列裁剪：只读 month 一列)"""
+    months = read_parquet(file_path, columns=["month"])["month"].dropna()
+    return sorted(months.unique())
 
 
 @st.cache_data(ttl=3600)
@@ -54,11 +70,14 @@ def fetch_live_rates(base="USD"):
 st.header("📈 销售数据分析与洞察")
 
 # 1. 尝试加载数据
-data_path = PROCESSED_DIR / "clean_bba_sales.csv"
+data_path = PROCESSED_DIR / SALES_DATASET
 
 if data_path.exists():
+    # 月份筛选 (按月分区时只读选中的那个分区)
+    month = st.sidebar.selectbox("月份", ["全部"] + load_months(data_path))
+
     # 使用缓存函数读取
-    df = load_sales_data(data_path)
+    df = load_sales_data(data_path, None if month == "全部" else month)
 
     # 获取实时汇率 (用于 KPI 展示)
     rates = fetch_live_rates()
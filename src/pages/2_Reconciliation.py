@@ -8,7 +8,16 @@ ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
-from src.services.recon_bot import ReconBot
+from src.config import FX_RATES_PATH, RECON_DATA_DIR
+from src.core.storage import file_sha256, read_parquet, write_parquet
+from src.services.recon_bot import STATUS_DTYPE, ReconBot, engine_version
+
+# 对账结果的磁盘缓存：进程重启后再打开页面也不用重算
+RESULT_CACHE_DIR = RECON_DATA_DIR / ".page_cache"
+# 磁盘上最多留几份结果 (和内存里 load_exceptions 的 max_entries 一致)，旧的写新结果时删掉
+RESULT_CACHE_KEEP = 4
+ERP_PATH = RECON_DATA_DIR / "ERP_Records.csv"
+BANK_PATH = RECON_DATA_DIR / "Bank_Statement.csv"
 
 st.set_page_config(page_title="Recon Bot", page_icon="🤖", layout="wide")
 
@@ -16,16 +25,149 @@ if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
     st.warning("请先在首页登录！")
     st.stop()
 
+
+# === 缓存函数定义 (Performance Optimization) ===
+
+
+@st.cache_data(show_spinner=False)
+def ledger_hash(path: str, mtime_ns: int, size: int) -> str:
+    """
+    账本内容哈希。按 (路径, 修改时间, 大小) 缓存：文件没动过就不用每次重读整个文件算哈希。
+    """
+    return file_sha256(path)
+
+
+def result_key(match_residue: bool) -> str:
+    """
+    结果的键：两本账 + 汇率历史的内容哈希，再加上对账代码的版本和是否做第二轮匹配。
+    这些都不变，结果就不变，和用哪个引擎算无关；补了汇率或改了匹配规则都会重算。
+    """
+    parts = []
+    for path in (ERP_PATH, BANK_PATH, FX_RATES_PATH):
+        if not path.exists():
+            # 没有汇率历史也是一种状态，之后有了就换键
+            parts.append("none")
+            continue
+        stat = path.stat()
+        parts.append(ledger_hash(str(path), stat.st_mtime_ns, stat.st_size)[:16])
+    parts.append(engine_version())
+    parts.append("residue" if match_residue else "exact")
+    return "_".join(parts)
+
+
+def prune_result_cache(keep: str):
+    """只留最近的 RESULT_CACHE_KEEP 份结果 (keep 一定留)，账本每换一次就多一份的旧快照删掉"""
+    snapshots = sorted(
+        RESULT_CACHE_DIR.glob("*.parquet"),
+        key=lambda p: p.stat().st_mtime_ns,
+        reverse=True,
+    )
+    kept = 1
+    for path in snapshots:
+        if path.stem == keep:
+            continue
+        if kept < RESULT_CACHE_KEEP:
+            kept += 1
+            continue
+        path.unlink(missing_ok=True)
+
+
+@st.cache_resource(max_entries=4, show_spinner="正在对账...")
+def load_exceptions(key: str, _backend: str, _match_residue: bool) -> pd.DataFrame:
+    """
+    异常明细，所有会话共用一份 (cache_resource 不会每次取都复制一份几十万行的表)。
+    内存里没有就读磁盘缓存，磁盘上也没有才真正跑一次对账。
+    _backend 不参与缓存的键 (下划线开头 streamlit 不哈希)：两个引擎算出来的结果一样；
+    _match_residue 已经编进 key 里了。
+    """
+    path = RESULT_CACHE_DIR / f"{key}.parquet"
+    if path.exists():
+        df = read_parquet(path)
+    else:
+        bot = ReconBot(backend=_backend)
+        try:
+            bot.load_data().reconcile()
+            if _match_residue:
+                bot.match_residue()
+            df = bot.exceptions()
+        finally:
+            bot.close()
+        df = df.reset_index(drop=True)
+        RESULT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        write_parquet(df, path)
+        prune_result_cache(key)
+    df["Status"] = df["Status"].astype(STATUS_DTYPE)
+    return df
+
+
+@st.cache_resource(max_entries=32)
+def filter_rows(
+    key: str, _backend: str, _match_residue: bool, statuses: tuple, query: str
+):
+    """筛选后的行号 (只存行号，翻页时按行号切片)"""
+    df = load_exceptions(key, _backend, _match_residue)
+    mask = df["Status"].isin(statuses).to_numpy()
+    if query:
+        mask &= (
+            df["Order_ID"]
+            .astype(str)
+            .str.contains(query, case=False, regex=False)
+            .to_numpy()
+        )
+    return mask.nonzero()[0]
+
+
+# === 页面核心逻辑 ===
 st.header("🤖 自动对账机器人")
 
+if not ERP_PATH.exists() or not BANK_PATH.exists():
+    st.error("❌ 账本未找到，请先运行 'Generate Reconciliation Mock Data'。")
+    st.stop()
+
+# 账本超出内存时选 duckdb：在 DuckDB 里对账，内存不够自动落盘
+backend = st.radio("计算引擎", ["pandas", "duckdb"], horizontal=True)
+# 第二轮匹配默认关：打开后漏收款 / 不明入账 / 金额不符里能按金额日期配上的会换成复核状态
+match_residue = st.toggle(
+    "第二轮匹配 (金额容差 + 日期窗口)",
+    value=False,
+    help="单号没对平的再按金额和日期配一次，结果标成容差内 / 金额日期匹配 / 合并付款，供人工复核",
+)
+key = result_key(match_residue)
+cached = (RESULT_CACHE_DIR / f"{key}.parquet").exists()
+
 if st.button("🚀 开始对账"):
-    try:
-        bot = ReconBot()
-        bot.load_data().reconcile()
-        st.success("✅ 对账完成！")
-
-        # 展示异常
-        exceptions = bot.df_result[bot.df_result["Status"] != "✅ Matched (对平)"]
-        st.dataframe(exceptions, width="stretch")
-    except Exception as e:
-        st.error(f"Error: {e}")
+    st.session_state["recon_key"] = key
+elif cached:
+    # 账本没变、之前跑过：直接展示上次的结果
+    st.session_state["recon_key"] = key
+
+if st.session_state.get("recon_key") != key:
+    st.info("这组账本还没有对账结果，点击「开始对账」生成。")
+    st.stop()
+
+try:
+    exceptions = load_exceptions(key, backend, match_residue)
+except Exception as e:
+    st.error(f"Error: {e}")
+    st.stop()
+
+st.success(f"✅ 对账完成！共 {len(exceptions):,} 条异常")
+
+# === 服务端筛选 + 分页：只把当前这一页发给浏览器 ===
+present = list(exceptions["Status"].cat.remove_unused_categories().cat.categories)
+col1, col2, col3 = st.columns([3, 2, 1])
+with col1:
+    statuses = st.multiselect("状态", present, default=present)
+with col2:
+    query = st.text_input("单号包含", "").strip()
+with col3:
+    page_size = st.selectbox("每页行数", [50, 100, 500, 1000], index=1)
+
+rows = filter_rows(key, backend, match_residue, tuple(statuses), query)
+pages = max(1, -(-len(rows) // page_size))
+page = st.number_input(f"页码 (共 {pages} 页)", 1, pages, 1)
+start = (page - 1) * page_size
+stop = min(start + page_size, len(rows))
+
+st.caption(f"{len(rows):,} 条符合条件，显示第 {min(start + 1, stop):,} - {stop:,} 条")
+st.dataframe(exceptions.iloc[rows[start:stop]], width="stretch", hide_index=True)
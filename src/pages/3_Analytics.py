@@ -9,6 +9,9 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
 from src.services.charts import SalesChartFactory
+from src.services.bba_etl import SALES_DATASET
+from src.core.cleaner import GenericCleaner
+from src.core.storage import read_parquet
 from src.config import PROCESSED_DIR
 
 st.set_page_config(page_title="Analytics", page_icon="📈", layout="wide")
@@ -17,11 +20,21 @@ if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
     st.warning("请先在首页登录！")
     st.stop()
 
+
+@st.cache_data(ttl=3600, show_spinner="正在加载清洗后的数据...")
+def load_sales_data(file_path, compact=True):
+    """读取清洗后的数据；compact: 压缩内存 (文本转 category、数值降位宽)"""
+    df = read_parquet(file_path)
+    if compact:
+        df = GenericCleaner(df).optimize_memory().get_data()
+    return df
+
+
 st.header("📈 销售数据分析")
-data_path = PROCESSED_DIR / "clean_bba_sales.csv"
+data_path = PROCESSED_DIR / SALES_DATASET
 
 if data_path.exists():
-    df = pd.read_csv(data_path)
+    df = load_sales_data(data_path)
     factory = SalesChartFactory(df)
 
     st.plotly_chart(factory.create_region_bar_chart(), width="stretch")
@@ -1,11 +1,23 @@
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
 import requests
 
+from src.config import FX_RATES_PATH
+from src.core.storage import read_parquet, write_parquet
+
 
 class ExchangeRateClient:
     def __init__(self, base_currency="USD"):
         self.base_currency = base_currency
         self.api_url = f"https://api.exchangerate-api.com/v4/latest/{base_currency}"
         self.rates = {}  # 这是一个缓存，存我们拿到的数据
+        self.rates_date = None
+        # 汇率历史：date / currency / rate (1 个基准货币 = rate 个该货币)
+        self.history = None
+        self._index = None
 
     def fetch_rates(self):
         """核心：发送 GET 请求获取数据"""
@@ -25,6 +37,7 @@ class ExchangeRateClient:
                 # data 的结构通常是: {"date": "2024-01-01", "rates": {"EUR": 0.92, ...}}
                 self.rates = data.get("rates", {})
                 update_date = data.get("date")
+                self.rates_date = update_date
                 print(f"📊 [Data] Rates updated on: {update_date}")
                 print(f"   1 USD = {self.rates.get('EUR')} EUR")
                 print(f"   1 USD = {self.rates.get('CNY')} CNY")
@@ -55,6 +68,146 @@ class ExchangeRateClient:
 
         return round(amount / rate, 2)
 
+    # === 汇率历史 + 批量换算 ===
+
+    def save_history(self, path: Union[str, Path] = FX_RATES_PATH):
+        """把最近一次 fetch_rates() 取到的汇率追加到本地汇率历史 (同一天同一币种以新的为准)"""
+        if not self.rates:
+            raise ValueError("No rates to save, call fetch_rates() first")
+        snapshot = pd.DataFrame(
+            {
+                "date": pd.Timestamp(
+                    self.rates_date or pd.Timestamp.today()
+                ).normalize(),
+                "currency": list(self.rates),
+                "rate": list(self.rates.values()),
+                "base": self.base_currency,
+            }
+        )
+        path = Path(path)
+        if path.exists():
+            snapshot = pd.concat([read_parquet(path), snapshot], ignore_index=True)
+            snapshot = snapshot.drop_duplicates(
+                ["base", "date", "currency"], keep="last"
+            )
+        write_parquet(snapshot.reset_index(drop=True), path)
+        return self
+
+    def load_history(
+        self,
+        path: Union[str, Path] = FX_RATES_PATH,
+        history: Optional[pd.DataFrame] = None,
+    ):
+        """
+        读本地汇率历史 (或者直接给一张 date / currency / rate 的表)，只保留本客户端基准货币的汇率。
+        """
+        if history is None:
+            path = Path(path)
+            if not path.exists():
+                raise FileNotFoundError(
+                    f"No rate history at {path}. Run fetch_rates().save_history() first."
+                )
+            history = read_parquet(path)
+        if "base" in history:
+            history = history[history["base"] == self.base_currency]
+        history = history[["date", "currency", "rate"]].dropna()
+        history = history.assign(
+            date=pd.to_datetime(history["date"]).dt.normalize(),
+            currency=history["currency"].astype(str),
+        )
+        self.history = history.sort_values(["currency", "date"], kind="stable")
+        self._index = None
+        return self
+
+    def _rate_index(self):
+        """
+        按 (币种, 日期) 排好的汇率索引。复合键 = 币种编码 * 跨度 + 天数，
+        "某币种在某天之前最近的汇率"就是键上的一次 searchsorted (as-of 查询)。
+        """
+        if self._index is None:
+            history = self.history
+            currencies = pd.Index(history["currency"].unique())
+            codes = currencies.get_indexer(history["currency"])
+            days = history["date"].to_numpy(dtype="datetime64[D]").astype("int64")
+            if len(days):
+                first = int(days.min())
+                # 天数偏移从 1 开始：0 留给"早于历史第一天"，span - 1 是"最新"
+                span = int(days.max()) - first + 2
+            else:
+                # 汇率历史是空的：索引也是空的，所有查询都查不到 (NaN)
+                first, span = 0, 2
+            keys = codes.astype("int64") * span + (days - first + 1)
+            order = np.argsort(keys, kind="stable")
+            self._index = (
+                currencies,
+                first,
+                span,
+                keys[order],
+                codes[order],
+                history["rate"].to_numpy(dtype="float64")[order],
+            )
+        return self._index
+
+    def lookup_rates(
+        self, currencies: pd.Series, dates: Optional[pd.Series] = None
+    ) -> np.ndarray:
+        """
+        每一行的汇率 (1 个基准货币 = ? 个该货币)：取交易日当天或之前最近的一条汇率。
+        dates 不给或日期为空时用最新汇率；没有汇率的是 NaN。
+        没加载汇率历史时用 fetch_rates() 取到的实时汇率。
+        """
+        currencies = pd.Series(currencies).astype(str)
+        if self.history is None:
+            if not self.rates:
+                self.fetch_rates()
+            rates = currencies.map(self.rates).to_numpy(dtype="float64")
+        else:
+            known, first, span, keys, codes, values = self._rate_index()
+            query_codes = known.get_indexer(currencies)
+            if dates is None:
+                offsets = np.full(len(currencies), span - 1, dtype="int64")
+            else:
+                days = pd.to_datetime(pd.Series(dates), errors="coerce")
+                days = days.to_numpy(dtype="datetime64[D]").astype("int64")
+                missing = pd.isna(pd.Series(dates)).to_numpy() | (
+                    days == np.iinfo("int64").min
+                )
+                offsets = np.clip(days - first + 1, 0, span - 1)
+                offsets[missing] = span - 1
+            pos = np.searchsorted(keys, query_codes * span + offsets, side="right") - 1
+            found = (query_codes >= 0) & (pos >= 0)
+            found[found] = codes[pos[found]] == query_codes[found]
+            rates = np.full(len(currencies), np.nan)
+            rates[found] = values[pos[found]]
+        # 基准货币自己的汇率是 1
+        return np.where(currencies.to_numpy() == self.base_currency, 1.0, rates)
+
+    def convert_series(
+        self,
+        amounts: pd.Series,
+        currencies: pd.Series,
+        dates: Optional[pd.Series] = None,
+        to_currency: Optional[str] = None,
+    ) -> pd.Series:
+        """
+        整列换算：amounts (各行的币种在 currencies 里) -> to_currency (默认基准货币)。
+        给了 dates 就按交易日的历史汇率 (as-of)。换算不了的行是 NaN，并打印一条提示。
+        """
+        to_currency = to_currency or self.base_currency
+        amounts = pd.Series(amounts)
+        currencies = pd.Series(currencies, index=amounts.index).astype(str)
+        rate_from = self.lookup_rates(currencies, dates)
+        rate_to = self.lookup_rates(pd.Series(to_currency, index=amounts.index), dates)
+        values = amounts.to_numpy(dtype="float64") / rate_from * rate_to
+        # 本来就是目标币种的不动 (避免 a / r * r 的浮点误差)
+        same = currencies.to_numpy() == to_currency
+        values = np.where(same, amounts.to_numpy(dtype="float64"), values)
+        missing = np.isnan(values) & amounts.notna().to_numpy()
+        if missing.any():
+            names = ", ".join(sorted(currencies[missing].unique()))
+            print(f"⚠️ No rate for {int(missing.sum())} rows ({names})")
+        return pd.Series(values, index=amounts.index, name=amounts.name)
+
 
 if __name__ == "__main__":
     # 1. 初始化客户端
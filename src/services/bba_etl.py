@@ -1,35 +1,342 @@
+import hashlib
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+import numpy as np
+
 from src.config import RAW_DIR, PROCESSED_DIR
 from src.core.cleaner import GenericCleaner
+from src.core.hash_index import HashIndex, hash_rows
+from src.core.pipeline import Pipeline
+from src.core.storage import (
+    clear_output,
+    file_sha256,
+    read_parquet,
+    replace_parquet_slice,
+)
+
+# 清洗结果：Parquet 文件 (或分区目录)，页面用 src.core.storage.read_parquet 读取。
+# 批量模式下是一个目录，每个原始文件一组 <文件名>.part-*.parquet，文件改了只替换它那一组
+SALES_DATASET = "clean_bba_sales.parquet"
+# 批量模式下每个原始文件的清洗结果 (一个文件一个 Parquet)
+SALES_PARTS_DIR = PROCESSED_DIR / "bba_sales_parts"
+# 增量清洗的清单：记录每个原始文件的内容哈希、大小、流水线版本
+SALES_MANIFEST = PROCESSED_DIR / "bba_sales_manifest.json"
+
+
+# BBA 项目特有的清洗逻辑 (声明式流水线)：单文件、批量、检查点模式共用
+BBA_SALES_STEPS = [
+    # 步骤 A: 把 "Product Line" 这种列名洗成 "product_line"
+    ("normalize_headers", {}),
+    # 步骤 B: 处理地区和人名的格式 (North, John Doe)
+    (
+        "clean_text_columns",
+        {"columns": ["region", "salesperson", "county"], "case_type": "title"},
+    ),
+    # 步骤 C: 处理金额 "$100" -> 100.0
+    ("extract_numbers", {"columns": ["sales", "calls"]}),
+    # 步骤 D: 填充 sales 的空值为平均值，但删除 calls 为空的行
+    ("handle_missing_values", {"columns": ["sales"], "strategy": "mean"}),
+    ("handle_missing_values", {"columns": ["calls"], "strategy": "drop"}),
+    # 步骤 E: 日期转成真正的日期类型 (Parquet 会原样保存)
+    ("convert_dates", {"columns": ["date"]}),
+    ("add_period_column", {"date_column": "date", "freq": "M", "name": "month"}),
+    # 步骤 F: 去重
+    ("drop_duplicates", {}),
+]
+# 检查点模式下每一步的中间结果
+SALES_CHECKPOINT_DIR = PROCESSED_DIR / "bba_checkpoints"
 
 
-def run_bba_sales_etl():
+def bba_pipeline() -> Pipeline:
+    return Pipeline(BBA_SALES_STEPS, checkpoint_dir=SALES_CHECKPOINT_DIR)
+
+
+def apply_bba_chain(cleaner: GenericCleaner) -> GenericCleaner:
+    """把 BBA 清洗步骤挂到 cleaner 上 (组装流水线)"""
+    return bba_pipeline().apply(cleaner)
+
+
+def run_bba_sales_etl(
+    chunksize: Optional[int] = None,
+    backend: str = "pandas",
+    partition_by: Optional[str] = None,
+    profile: bool = False,
+    cprofile_steps: Optional[List[str]] = None,
+    resume: bool = False,
+):
+    """
+    chunksize: 按多少行一块流式清洗 (大文件防 OOM)，None 表示整表读入内存。
+    backend: "pandas" (默认) 或 "duckdb" (整条流水线在 DuckDB 里执行)。
+    partition_by: None / "month" / "region"，按月或按地区做 Hive 分区。
+    profile: 记录每一步的耗时和内存，输出旁边写 clean_bba_sales.report.json；
+    cprofile_steps: 对这些步骤 (如 ["convert_dates"]) 额外做 cProfile 采样。
+    resume: 逐步执行并在每步后存检查点；上次失败或改了某一步后，从最后一个有效的检查点继续
+            (只支持整表读入的 pandas 模式)。
+    """
     print("🚀 [Service] Starting BBA Sales Data Pipeline...")
 
     input_file = RAW_DIR / "dirty_real_sales.csv"
-    output_file = PROCESSED_DIR / "clean_bba_sales.csv"
+    output_file = PROCESSED_DIR / SALES_DATASET
+    partition_cols = [partition_by] if partition_by else None
 
-    # 1. 实例化通用清洗器
-    cleaner = GenericCleaner()
+    if resume:
+        if chunksize is not None or backend != "pandas":
+            raise ValueError("resume only supports the in-memory pandas mode")
+        bba_pipeline().run(
+            input_file,
+            output_file,
+            partition_cols,
+            profile=profile,
+            cprofile_steps=cprofile_steps,
+        )
+        return
 
-    # 2. 定义 BBA 项目特有的清洗逻辑 (组装流水线)
-    (
-        cleaner.load_file(input_file)
-        # 步骤 A: 把 "Product Line" 这种列名洗成 "product_line"
-        .normalize_headers()
-        # 步骤 B: 处理地区和人名的格式 (North, John Doe)
-        .clean_text_columns(
-            columns=["region", "salesperson", "county"], case_type="title"
+    # 1. 实例化通用清洗器 (延迟模式：save 时合并同类步骤后一次执行)
+    cleaner = GenericCleaner(
+        lazy=True, backend=backend, profile=profile, cprofile_steps=cprofile_steps
+    )
+
+    # 2. 组装流水线并保存
+    apply_bba_chain(cleaner.load_file(input_file, chunksize=chunksize)).save(
+        output_file, partition_cols=partition_cols
+    )
+
+
+def pipeline_version() -> str:
+    """当前清洗链的指纹：BBA_SALES_STEPS 或清洗代码任何改动都会让旧结果失效"""
+    return apply_bba_chain(GenericCleaner(lazy=True)).plan_fingerprint()
+
+
+def load_manifest() -> Dict:
+    if not SALES_MANIFEST.exists():
+        return {"files": {}}
+    with open(SALES_MANIFEST, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: Dict):
+    # 先写临时文件再替换，中途崩溃也不会留下半截 JSON
+    tmp = SALES_MANIFEST.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    tmp.replace(SALES_MANIFEST)
+
+
+def clean_bba_file(
+    input_file: Union[str, Path], output_file: Union[str, Path], backend: str
+) -> Dict:
+    """
+    清洗单个原始文件 (在子进程里执行)。
+    不抛异常：成功失败都返回一条结果记录，保证一个坏文件不会拖垮整批。
+    """
+    started = time.perf_counter()
+    path = Path(input_file)
+    stat = path.stat()
+    result = {
+        "file": path.name,
+        "output": str(output_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+    try:
+        # 先算哈希再清洗：清单里记录的就是这次实际清洗的内容
+        result["sha256"] = file_sha256(path)
+        cleaner = GenericCleaner(lazy=True, backend=backend)
+        apply_bba_chain(cleaner.load_file(path)).save(output_file)
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _is_fresh(path: Path, entry: Optional[Dict], version: str) -> bool:
+    """清单记录是否仍然有效 (文件没变、流水线没变、结果文件还在)"""
+    if not entry or entry["pipeline_version"] != version:
+        return False
+    if not Path(entry["output"]).exists():
+        return False
+    stat = path.stat()
+    if stat.st_size != entry["size"]:
+        return False
+    if stat.st_mtime_ns == entry["mtime_ns"]:
+        return True
+    # 修改时间变了但内容可能没变 (比如被重新拷贝过一次)，以哈希为准
+    if file_sha256(path) != entry["sha256"]:
+        return False
+    entry["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+
+def _part_hashes(part: Union[str, Path]) -> np.ndarray:
+    """单个文件清洗结果的行指纹，缓存在结果旁边 (.hashes.npy)，结果没重新生成就不用再读一遍"""
+    part = Path(part)
+    path = part.with_suffix(".hashes.npy")
+    if not path.exists() or path.stat().st_mtime_ns < part.stat().st_mtime_ns:
+        np.save(path, hash_rows(read_parquet(part)))
+    return np.load(path)
+
+
+def _is_batch_dataset(path: Path) -> bool:
+    """数据集是不是批量模式按来源分片写的 (单文件模式会把它整个覆盖掉)"""
+    return path.is_dir() and all(".part-" in f.name for f in path.rglob("*.parquet"))
+
+
+def merge_sales_parts(
+    entries: Dict[str, Dict],
+    changed: Set[str],
+    partition_by: Optional[str] = None,
+    rewrite: bool = False,
+) -> Tuple[int, int]:
+    """
+    把各文件的清洗结果合并进 SALES_DATASET，每个原始文件是数据集里的一片。
+    按文件名顺序跨文件去重 (行指纹)，每个文件保留了哪些行记成一个指纹 (entries[name]["slice"])：
+    只有本次重新清洗的文件、或者因为前面的文件变了导致保留的行变了的文件才重写自己那一片，
+    其他文件原样不动。rewrite=True 时整个数据集重写 (比如分区方式变了)。
+    返回 (数据集总行数, 重写的文件数)。
+    """
+    dataset = PROCESSED_DIR / SALES_DATASET
+    partition_cols = [partition_by] if partition_by else None
+    if rewrite:
+        clear_output(dataset)
+    else:
+        # 已经不在清单里的文件 (原始文件删了、改动后清洗失败)：删掉它那一片
+        present = {f.name.split(".part-")[0] for f in dataset.rglob("*.parquet")}
+        for name in present - set(entries):
+            replace_parquet_slice(dataset, name)
+
+    index = HashIndex()
+    rows = 0
+    written = 0
+    for name in sorted(entries):
+        entry = entries[name]
+        keep = index.add_new(_part_hashes(entry["output"]))
+        digest = hashlib.sha256(np.packbits(keep).tobytes()).hexdigest()[:16]
+        rows += int(keep.sum())
+        if rewrite or name in changed or entry.get("slice") != digest:
+            df = read_parquet(entry["output"])
+            replace_parquet_slice(
+                dataset, name, df.take(np.flatnonzero(keep)), partition_cols
+            )
+            entry["slice"] = digest
+            written += 1
+    return rows, written
+
+
+def run_bba_sales_batch(
+    pattern: str = "*sales*.csv",
+    max_workers: Optional[int] = None,
+    backend: str = "pandas",
+    partition_by: Optional[str] = None,
+    incremental: bool = True,
+) -> List[Dict]:
+    """
+    批量模式：RAW_DIR 下所有匹配 pattern 的原始文件，用进程池并行清洗后合并。
+    每个文件独立清洗 (sales 的均值按文件计算)，合并时再做跨文件去重。
+    max_workers: 进程数，默认等于 CPU 核数。
+    incremental: 按清单跳过内容和流水线版本都没变的文件，只清洗新增/改动的文件。
+    返回本次处理的每个文件的结果 (status / seconds / error)。
+    """
+    print("🚀 [Service] Starting BBA Sales Batch Pipeline...")
+
+    files = sorted(RAW_DIR.glob(pattern))
+    if not files:
+        print(f"⚠️ No raw files matching '{pattern}' in {RAW_DIR}")
+        return []
+
+    SALES_PARTS_DIR.mkdir(parents=True, exist_ok=True)
+    version = pipeline_version()
+    manifest = load_manifest() if incremental else {"files": {}}
+    old_entries = manifest["files"]
+
+    # 1. 对比清单：哪些文件可以直接复用上次的清洗结果
+    entries = {}
+    todo = []
+    for f in files:
+        if _is_fresh(f, old_entries.get(f.name), version):
+            entries[f.name] = old_entries[f.name]
+        else:
+            todo.append(f)
+
+    # 原始文件已经删除的，对应的结果也删掉
+    removed = [name for name in old_entries if not (RAW_DIR / name).exists()]
+    for name in removed:
+        Path(old_entries[name]["output"]).unlink(missing_ok=True)
+        Path(old_entries[name]["output"]).with_suffix(".hashes.npy").unlink(
+            missing_ok=True
         )
-        # 步骤 C: 处理金额 "$100" -> 100.0
-        .extract_numbers(columns=["sales", "calls"])
-        # 步骤 D: 填充 sales 的空值为平均值，但删除 calls 为空的行
-        .handle_missing_values(columns=["sales"], strategy="mean")
-        .handle_missing_values(columns=["calls"], strategy="drop")
-        # 步骤 E: 去重并保存
-        .drop_duplicates()
-        .save(output_file)
+
+    print(
+        f"📂 [Batch] {len(files)} files: {len(todo)} to clean, "
+        f"{len(entries)} unchanged, {len(removed)} removed"
+    )
+
+    # 2. 并行清洗新增/改动的文件
+    results = []
+    if todo:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                pool.submit(
+                    clean_bba_file,
+                    f,
+                    SALES_PARTS_DIR / f"{f.stem}.parquet",
+                    backend,
+                )
+                for f in todo
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if result["status"] == "ok":
+                    print(f"   ✅ {result['file']} ({result['seconds']}s)")
+                    entries[result["file"]] = {
+                        "sha256": result["sha256"],
+                        "size": result["size"],
+                        "mtime_ns": result["mtime_ns"],
+                        "pipeline_version": version,
+                        "output": result["output"],
+                        "processed_at": datetime.now().isoformat(timespec="seconds"),
+                    }
+                else:
+                    print(f"   ❌ {result['file']}: {result['error']}")
+                    # 改动后清洗失败：旧结果已经过期，不能再参与合并
+                    Path(result["output"]).unlink(missing_ok=True)
+
+    save_manifest(
+        {"pipeline_version": version, "partition_by": partition_by, "files": entries}
     )
 
+    # 3. 有变化才合并，只重写变了的那几片 (分区方式变了、数据集被单文件模式覆盖过就整个重写)
+    rewrite = not (
+        _is_batch_dataset(PROCESSED_DIR / SALES_DATASET)
+        and manifest.get("partition_by") == partition_by
+    )
+    changed = {r["file"] for r in results if r["status"] == "ok"}
+    if not (todo or removed) and not rewrite:
+        print("✅ [Batch] Nothing changed, processed dataset is up to date")
+    elif entries:
+        rows, written = merge_sales_parts(entries, changed, partition_by, rewrite)
+        print(
+            f"✅ [Batch] Merged {len(entries)} files ({written} rewritten), "
+            f"{rows:,} rows -> {SALES_DATASET}"
+        )
+    else:
+        print("❌ [Batch] No usable files, processed dataset left untouched")
+    # 每一片的指纹 (entries[...]["slice"]) 合并完才有
+    save_manifest(
+        {"pipeline_version": version, "partition_by": partition_by, "files": entries}
+    )
+
+    failed = sum(r["status"] != "ok" for r in results)
+    print(f"📊 [Batch] Done: {len(results) - failed} cleaned, {failed} failed")
+    return results
+
 
 if __name__ == "__main__":
     run_bba_sales_etl()
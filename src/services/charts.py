@@ -8,7 +8,10 @@ class SalesChartFactory:
 
     def create_region_bar_chart(self):
         # 注意：这里全是小写 region, sales
-        region_sales = self.df.groupby("region")["sales"].sum().reset_index()
+        # observed=True：region 是 category 时只统计实际出现的地区
+        region_sales = (
+            self.df.groupby("region", observed=True)["sales"].sum().reset_index()
+        )
 
         fig = px.bar(
             region_sales,
@@ -34,7 +37,9 @@ class SalesChartFactory:
         # === 修复结束 ===
 
         # 后面用 df_clean 画图，而不是 self.df
-        daily_sales = df_clean.groupby("date")["sales"].sum().reset_index()
+        daily_sales = (
+            df_clean.groupby("date", observed=True)["sales"].sum().reset_index()
+        )
 
         fig = px.line(
             daily_sales, x="date", y="sales", markers=True, title="Daily Sales Trend"
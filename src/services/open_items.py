@@ -0,0 +1,473 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from src.config import RECON_DAILY_DIR, RECON_DATA_DIR
+from src.core.storage import file_sha256
+from src.services.recon_bot import (
+    BANK_RENAMES,
+    ERP_RENAMES,
+    STATUS_BATCH_PAYMENT,
+    STATUS_FUZZY_MATCH,
+    STATUS_MATCHED,
+    STATUS_MISMATCH,
+    STATUS_MISSING_IN_BANK,
+    STATUS_UNKNOWN_INCOME,
+    STATUS_WITHIN_TOLERANCE,
+    to_cents,
+)
+from src.services.recon_matcher import match_many_to_one, match_one_to_one
+
+DEFAULT_STORE = RECON_DATA_DIR / "open_items.duckdb"
+
+# 两边的未清项表；金额存整数分，日期存 DATE
+_SCHEMA = """
+CREATE SEQUENCE IF NOT EXISTS item_seq;
+CREATE SEQUENCE IF NOT EXISTS group_seq;
+CREATE TABLE IF NOT EXISTS runs (
+    run_id BIGINT PRIMARY KEY,
+    started_at TIMESTAMP,
+    source VARCHAR,
+    file_hash VARCHAR,
+    new_erp BIGINT,
+    new_bank BIGINT,
+    cleared BIGINT
+);
+CREATE TABLE IF NOT EXISTS open_erp (
+    item_id BIGINT PRIMARY KEY,
+    run_id BIGINT,
+    order_id VARCHAR,
+    txn_date DATE,
+    cents BIGINT,
+    client VARCHAR
+);
+CREATE TABLE IF NOT EXISTS open_bank (
+    item_id BIGINT PRIMARY KEY,
+    run_id BIGINT,
+    order_id VARCHAR,
+    txn_date DATE,
+    cents BIGINT
+);
+CREATE INDEX IF NOT EXISTS open_erp_order ON open_erp (order_id);
+CREATE INDEX IF NOT EXISTS open_bank_order ON open_bank (order_id);
+CREATE TABLE IF NOT EXISTS audit_log (
+    run_id BIGINT,
+    side VARCHAR,
+    item_id BIGINT,
+    order_id VARCHAR,
+    txn_date DATE,
+    amount DOUBLE,
+    status VARCHAR,
+    match_group BIGINT,
+    opened_run BIGINT,
+    cleared_at TIMESTAMP
+);
+"""
+
+_SIDES = {"erp": "open_erp", "bank": "open_bank"}
+
+
+def _normalize(df: pd.DataFrame, side: str) -> pd.DataFrame:
+    """原始账本 -> 仓库里的列 (列名映射和 ReconBot 一样)"""
+    if side == "erp":
+        df = df.rename(columns=ERP_RENAMES)
+        amount, date = df["ERP_Amount"], df["Date"]
+    else:
+        df = df.rename(columns=BANK_RENAMES)
+        amount, date = df["Bank_Amount"], df["Txn_Date"]
+    out = pd.DataFrame(
+        {
+            "order_id": df["Order_ID"].astype(str),
+            "txn_date": pd.to_datetime(date, errors="coerce"),
+            "cents": to_cents(amount.fillna(0)),
+        }
+    )
+    if side == "erp":
+        out["client"] = df["Client"] if "Client" in df else None
+    return out
+
+
+class OpenItemStore:
+    """
+    增量对账的未清项仓库 (RECON_DATA_DIR 下的一个 DuckDB 文件)。
+    只保存还没对上的 ERP / 银行记录；每天的新账单只和未清项匹配，对上的移出并写审计记录，
+    所以日常运行的开销跟新数据量 (加上当前未清项) 成正比，和历史总量无关。
+    """
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_STORE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = duckdb.connect(str(self.path))
+        self.con.execute(_SCHEMA)
+
+    def close(self):
+        self.con.close()
+
+    def is_processed(self, file_hash: str) -> bool:
+        return bool(
+            self.con.execute(
+                "SELECT count(*) FROM runs WHERE file_hash = ?", [file_hash]
+            ).fetchone()[0]
+        )
+
+    def open_items(self, side: str) -> pd.DataFrame:
+        """当前未清项 (side = "erp" / "bank")"""
+        return self.con.sql(f"SELECT * FROM {_SIDES[side]} ORDER BY item_id").df()
+
+    def audit_trail(self, order_id: Optional[str] = None) -> pd.DataFrame:
+        """核销记录：哪一次运行、什么时候、以什么状态清掉了哪一笔"""
+        sql = "SELECT * FROM audit_log"
+        params = []
+        if order_id is not None:
+            sql += " WHERE order_id = ?"
+            params.append(order_id)
+        return self.con.execute(sql + " ORDER BY cleared_at, item_id", params).df()
+
+    # === 一次增量运行 ===
+
+    def reconcile(
+        self,
+        erp: Optional[pd.DataFrame] = None,
+        bank: Optional[pd.DataFrame] = None,
+        source: str = "",
+        file_hash: Optional[str] = None,
+        tolerance_abs: float = 1.0,
+        tolerance_pct: float = 0.05,
+        date_window_days: int = 3,
+        max_batch_size: int = 5,
+        max_candidates: int = 50,
+        max_search: int = 10_000,
+    ) -> pd.DataFrame:
+        """
+        新到的 ERP / 银行记录入库并与未清项匹配，返回这次运行的增量结果：
+        本次核销的记录 + 本次新增、仍未清的记录。匹配规则和 ReconBot.match_residue 一样：
+        同单号 (金额相同或差额在容差内)，然后在日期窗口内按金额一对一、多对一。
+        同单号但差额超出容差的两边都留在未清项里 (状态为金额不符)，以后到的记录还能和它们配对。
+        """
+        self._tolerance = (tolerance_abs, tolerance_pct)
+        self.con.execute("BEGIN TRANSACTION")
+        try:
+            run_id = self.con.execute(
+                "SELECT coalesce(max(run_id), 0) + 1 FROM runs"
+            ).fetchone()[0]
+            new_erp = self._insert("erp", erp, run_id)
+            new_bank = self._insert("bank", bank, run_id)
+
+            cleared: List[pd.DataFrame] = []
+            self._match_by_id(run_id, cleared)
+            self._match_by_window(
+                run_id,
+                cleared,
+                date_window_days,
+                max_batch_size,
+                max_candidates,
+                max_search,
+            )
+            cleared = pd.concat(cleared, ignore_index=True) if cleared else None
+            n_cleared = self._clear(run_id, cleared)
+            self.con.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    run_id,
+                    datetime.now(),
+                    source,
+                    file_hash,
+                    new_erp,
+                    new_bank,
+                    n_cleared,
+                ],
+            )
+            delta = self._delta(run_id)
+            self.con.execute("COMMIT")
+        except Exception:
+            self.con.execute("ROLLBACK")
+            raise
+        print(
+            f"🧾 [Store] Run {run_id}: +{new_erp} ERP, +{new_bank} bank, "
+            f"{n_cleared} cleared"
+        )
+        return delta
+
+    def _allowance(self, cents: np.ndarray) -> np.ndarray:
+        tolerance_abs, tolerance_pct = self._tolerance
+        pct = np.round(np.abs(cents) * tolerance_pct).astype("int64")
+        return np.maximum(pct, round(tolerance_abs * 100))
+
+    def _insert(self, side: str, df: Optional[pd.DataFrame], run_id: int) -> int:
+        if df is None or df.empty:
+            return 0
+        rows = _normalize(df, side)
+        rows.insert(0, "run_id", run_id)
+        cols = ", ".join(rows.columns)
+        self.con.register("new_rows", rows)
+        self.con.execute(
+            f"INSERT INTO {_SIDES[side]} (item_id, {cols}) "
+            f"SELECT nextval('item_seq'), {cols} FROM new_rows"
+        )
+        self.con.unregister("new_rows")
+        return len(rows)
+
+    def _match_by_id(self, run_id: int, cleared: List[pd.DataFrame]):
+        """
+        同单号配对。候选是本次新记录涉及的单号下的所有未清项 (包括以前金额不符留下的)，
+        先配金额相同的，再在容差内配金额最接近的，每笔只配一次：
+        ERP B 200 / 流水 B 150 金额不符，之后更正的流水 B 200 到了还能和 ERP 配上。
+        """
+        # 单号编成整数，当作 match_one_to_one 的"日期"、窗口取 0：只在同单号里配
+        items = {}
+        for side, table in _SIDES.items():
+            items[side] = self.con.execute(
+                f"""
+                WITH keys AS (
+                    SELECT order_id, row_number() OVER (ORDER BY order_id) AS code
+                    FROM (
+                        SELECT order_id FROM open_erp WHERE run_id = $run
+                        UNION SELECT order_id FROM open_bank WHERE run_id = $run
+                    )
+                )
+                SELECT t.item_id, t.cents, k.code
+                FROM {table} t JOIN keys k USING (order_id)
+                ORDER BY t.item_id
+                """,
+                {"run": run_id},
+            ).df()
+        erp, bank = items["erp"], items["bank"]
+        erp_cents, bank_cents = erp["cents"].to_numpy(), bank["cents"].to_numpy()
+        e, b = match_one_to_one(
+            erp_cents,
+            erp["code"].to_numpy(),
+            bank_cents,
+            bank["code"].to_numpy(),
+            self._allowance(erp_cents),
+            0,
+        )
+        status = np.where(
+            erp_cents[e] == bank_cents[b], STATUS_MATCHED, STATUS_WITHIN_TOLERANCE
+        )
+        for side, ids in (
+            ("erp", erp["item_id"].to_numpy()[e]),
+            ("bank", bank["item_id"].to_numpy()[b]),
+        ):
+            cleared.append(
+                pd.DataFrame(
+                    {
+                        "side": side,
+                        "item_id": ids,
+                        "status": status,
+                        "match_group": None,
+                    }
+                )
+            )
+
+    def _window_items(
+        self, side: str, run_id: int, window: int, exclude: set
+    ) -> pd.DataFrame:
+        """
+        本次新记录日期 ±window 天内的未清项 (本次已核销的除外)。
+        同单号金额不符的也在里面：单号写错时只能靠金额和日期配上。
+        """
+        items = self.con.execute(
+            f"""
+            WITH span AS (
+                SELECT min(txn_date) - {int(window)} AS lo,
+                    max(txn_date) + {int(window)} AS hi
+                FROM (
+                    SELECT txn_date FROM open_erp WHERE run_id = $run
+                    UNION ALL SELECT txn_date FROM open_bank WHERE run_id = $run
+                )
+            )
+            SELECT t.item_id, t.cents, t.txn_date
+            FROM {_SIDES[side]} t, span
+            WHERE t.txn_date BETWEEN span.lo AND span.hi
+            ORDER BY t.item_id
+            """,
+            {"run": run_id},
+        ).df()
+        return items[~items["item_id"].isin(exclude)].reset_index(drop=True)
+
+    def _match_by_window(
+        self,
+        run_id: int,
+        cleared: List[pd.DataFrame],
+        window: int,
+        max_batch_size: int,
+        max_candidates: int,
+        max_search: int,
+    ):
+        done = set()
+        for frame in cleared:
+            done.update(frame["item_id"])
+        erp = self._window_items("erp", run_id, window, done)
+        bank = self._window_items("bank", run_id, window, done)
+        if erp.empty or bank.empty:
+            return
+
+        def days(items: pd.DataFrame) -> np.ndarray:
+            return items["txn_date"].to_numpy(dtype="datetime64[D]").astype("int64")
+
+        erp_cents, bank_cents = erp["cents"].to_numpy(), bank["cents"].to_numpy()
+        erp_days, bank_days = days(erp), days(bank)
+        e, b = match_one_to_one(
+            erp_cents,
+            erp_days,
+            bank_cents,
+            bank_days,
+            self._allowance(erp_cents),
+            window,
+        )
+        groups = self._next_groups(len(e))
+        cleared.append(
+            pd.DataFrame(
+                {
+                    "side": ["erp"] * len(e) + ["bank"] * len(b),
+                    "item_id": np.concatenate(
+                        [erp["item_id"].to_numpy()[e], bank["item_id"].to_numpy()[b]]
+                    ),
+                    "status": STATUS_FUZZY_MATCH,
+                    "match_group": np.concatenate([groups, groups]),
+                }
+            )
+        )
+
+        rest_erp = np.setdiff1d(np.arange(len(erp)), e)
+        rest_bank = np.setdiff1d(np.arange(len(bank)), b)
+        batches = match_many_to_one(
+            erp_cents[rest_erp],
+            erp_days[rest_erp],
+            bank_cents[rest_bank],
+            bank_days[rest_bank],
+            self._allowance(bank_cents[rest_bank]),
+            window,
+            max_batch_size,
+            max_candidates,
+            max_search,
+        )
+        groups = self._next_groups(len(batches))
+        for g, (j, members) in zip(groups, batches):
+            ids = erp["item_id"].to_numpy()[rest_erp[members]]
+            cleared.append(
+                pd.DataFrame(
+                    {
+                        "side": ["erp"] * len(ids) + ["bank"],
+                        "item_id": np.append(
+                            ids, bank["item_id"].to_numpy()[rest_bank[j]]
+                        ),
+                        "status": STATUS_BATCH_PAYMENT,
+                        "match_group": g,
+                    }
+                )
+            )
+
+    def _next_groups(self, n: int) -> np.ndarray:
+        if n == 0:
+            return np.empty(0, dtype="int64")
+        return (
+            self.con.execute(f"SELECT nextval('group_seq') FROM range({int(n)})")
+            .df()
+            .iloc[:, 0]
+            .to_numpy()
+        )
+
+    def _clear(self, run_id: int, cleared: Optional[pd.DataFrame]) -> int:
+        """核销：写审计记录，再把记录移出未清项"""
+        if cleared is None or cleared.empty:
+            return 0
+        cleared = cleared.astype({"item_id": "int64", "match_group": "Int64"})
+        self.con.register("cleared", cleared)
+        now = datetime.now()
+        for side, table in _SIDES.items():
+            self.con.execute(
+                f"""
+                INSERT INTO audit_log
+                SELECT $run, '{side}', t.item_id, t.order_id, t.txn_date,
+                    t.cents / 100, c.status, c.match_group, t.run_id, $now
+                FROM {table} t JOIN cleared c
+                    ON c.item_id = t.item_id AND c.side = '{side}'
+                """,
+                {"run": run_id, "now": now},
+            )
+            self.con.execute(
+                f"DELETE FROM {table} WHERE item_id IN "
+                f"(SELECT item_id FROM cleared WHERE side = '{side}')"
+            )
+        self.con.unregister("cleared")
+        return len(cleared)
+
+    def _delta(self, run_id: int) -> pd.DataFrame:
+        """
+        本次运行的增量：本次核销的 + 本次新增仍未清的
+        (另一边有同单号的未清项就是金额不符，否则是漏收款 / 不明入账)。
+        """
+        cleared = self.con.execute(
+            """
+            SELECT side, item_id, order_id AS "Order_ID", txn_date AS "Date",
+                amount AS "Amount", status AS "Status", match_group AS "Match_Group"
+            FROM audit_log WHERE run_id = ? ORDER BY side DESC, item_id
+            """,
+            [run_id],
+        ).df()
+        still_open = self.con.execute(
+            f"""
+            SELECT 'erp' AS side, item_id, order_id AS "Order_ID", txn_date AS "Date",
+                cents / 100 AS "Amount",
+                CASE WHEN order_id IN (SELECT order_id FROM open_bank)
+                    THEN '{STATUS_MISMATCH}' ELSE '{STATUS_MISSING_IN_BANK}' END AS "Status"
+            FROM open_erp WHERE run_id = $run
+            UNION ALL
+            SELECT 'bank', item_id, order_id, txn_date, cents / 100,
+                CASE WHEN order_id IN (SELECT order_id FROM open_erp)
+                    THEN '{STATUS_MISMATCH}' ELSE '{STATUS_UNKNOWN_INCOME}' END
+            FROM open_bank WHERE run_id = $run
+            """,
+            {"run": run_id},
+        ).df()
+        still_open["Match_Group"] = pd.array([pd.NA] * len(still_open), dtype="Int64")
+        return pd.concat([cleared, still_open], ignore_index=True)
+
+
+def run_daily_recon(
+    daily_dir: Union[str, Path] = RECON_DAILY_DIR,
+    store_path: Union[str, Path] = DEFAULT_STORE,
+) -> List[Path]:
+    """
+    处理 daily_dir 里还没处理过的 ERP_*.csv / Bank_*.csv (按文件名顺序，ERP 先于银行)，
+    每个文件一次增量运行，增量结果写到 RECON_DATA_DIR/Recon_Delta_<运行号>.csv。
+    已处理的文件按内容哈希记在仓库里，重跑不会重复入账。
+    """
+    print("🤖 [Service] Starting incremental reconciliation...")
+    daily_dir = Path(daily_dir)
+    files: Dict[str, List[Path]] = {
+        "erp": sorted(daily_dir.glob("ERP_*.csv")),
+        "bank": sorted(daily_dir.glob("Bank_*.csv")),
+    }
+    store = OpenItemStore(store_path)
+    written = []
+    try:
+        for side in ("erp", "bank"):
+            for path in files[side]:
+                file_hash = file_sha256(path)
+                if store.is_processed(file_hash):
+                    continue
+                key = "Order_ID" if side == "erp" else "Transaction_Ref"
+                df = pd.read_csv(path, dtype={key: str}, float_precision="round_trip")
+                delta = store.reconcile(
+                    **{side: df}, source=path.name, file_hash=file_hash
+                )
+                run_id = store.con.execute("SELECT max(run_id) FROM runs").fetchone()[0]
+                out = RECON_DATA_DIR / f"Recon_Delta_{run_id:05d}.csv"
+                delta.to_csv(out, index=False)
+                written.append(out)
+                print(f"✅ {path.name} -> {out.name}")
+        if not written:
+            print(f"Nothing new in {daily_dir}")
+        summary = store.con.execute(
+            "SELECT (SELECT count(*) FROM open_erp), (SELECT count(*) FROM open_bank)"
+        ).fetchone()
+        print(f"📌 Open items: {summary[0]} ERP, {summary[1]} bank")
+    finally:
+        store.close()
+    return written
@@ -1,17 +1,310 @@
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
+import duckdb
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
 from src.config import RECON_DATA_DIR
+from src.core.report_writer import StreamingExcelWriter
+from src.core.storage import read_parquet, write_parquet
+from src.services.api_client import ExchangeRateClient
+from src.services.recon_matcher import match_many_to_one, match_one_to_one
+
+# 对账状态 (报表里显示的文字不变)，Status 列存成 category，每行只占 1 字节编码
+STATUS_MATCHED = "✅ Matched (对平)"
+STATUS_MISMATCH = "⚠️ Amount Mismatch (金额不符)"
+STATUS_MISSING_IN_BANK = "❌ Missing in Bank (漏收款)"
+STATUS_UNKNOWN_INCOME = "❓ Unknown Income (不明入账)"
+# 第二轮匹配 (match_residue) 的结果：都还在异常明细里，供人工复核
+STATUS_WITHIN_TOLERANCE = "🟡 Within Tolerance (容差内)"
+STATUS_FUZZY_MATCH = "🔍 Matched by Amount & Date (金额日期匹配)"
+STATUS_BATCH_PAYMENT = "🔗 Batch Payment (合并付款)"
+# 多币种：缺汇率换算不了的 (金额是 NaN，不当成金额不符，也不参与第二轮匹配)
+STATUS_NO_FX_RATE = "💱 No FX Rate (缺汇率)"
+STATUS_DTYPE = pd.CategoricalDtype(
+    [
+        STATUS_MATCHED,
+        STATUS_MISMATCH,
+        STATUS_MISSING_IN_BANK,
+        STATUS_UNKNOWN_INCOME,
+        STATUS_WITHIN_TOLERANCE,
+        STATUS_FUZZY_MATCH,
+        STATUS_BATCH_PAYMENT,
+        STATUS_NO_FX_RATE,
+    ]
+)
+
+# 两本账的列名映射：银行的 Transaction_Ref 对应 ERP 的 Order_ID
+ERP_RENAMES = {"Amount_CNY": "ERP_Amount"}
+BANK_RENAMES = {"Transaction_Ref": "Order_ID", "In_Amount": "Bank_Amount"}
+
+# 多币种账本的币种列 (两本账都叫这个名字)
+CURRENCY = "Currency"
+
+# 第二轮匹配用的日期列
+ERP_DATE = "Date"
+BANK_DATE = "Txn_Date"
+
+
+def to_cents(amounts: pd.Series) -> np.ndarray:
+    """金额 -> 整数分：比较差异时不会被 0.1 + 0.2 这种浮点误差误判为金额不符"""
+    return np.round(amounts.to_numpy(dtype="float64") * 100).astype("int64")
+
+
+def _status_code(status: str) -> int:
+    return STATUS_DTYPE.categories.get_loc(status)
+
+
+# _to_days 里 NaT 对应的值
+NO_DATE = np.iinfo("int64").min
+
+
+def _to_days(values: pd.Series) -> np.ndarray:
+    """日期 -> 天数 (int64)；空的、解析不了的是 NO_DATE，不参与按日期匹配"""
+    dates = pd.to_datetime(values, errors="coerce")
+    return dates.to_numpy(dtype="datetime64[D]").astype("int64")
+
+
+# 决定对账结果的模块：这些源码改了 (匹配规则、容差、换算)，缓存的对账结果就算过期
+_ENGINE_MODULES = ("recon_bot.py", "recon_matcher.py", "api_client.py")
+
+
+@functools.lru_cache(maxsize=None)
+def engine_version() -> str:
+    """对账代码的指纹：上面这些模块的源码哈希，给缓存对账结果的地方当键的一部分"""
+    here = Path(__file__).resolve().parent
+    digest = hashlib.sha256()
+    for name in _ENGINE_MODULES:
+        digest.update(name.encode("utf-8"))
+        digest.update((here / name).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+# === 分区并行 ===
+# partition_by 里的特殊键：按月分区，ERP 用 Date、银行用 Txn_Date
+PERIOD = "period"
+# 分桶写 Parquet 时的分区列 (不能以 _ 开头：pyarrow 读目录时会跳过 _ 开头的文件和目录)
+BUCKET = "recon_bucket"
+
+
+def _outer_join(df_erp: pd.DataFrame, df_bank: pd.DataFrame) -> pd.DataFrame:
+    """按单号 outer join，算差额 (整数分) 和状态"""
+    # --- 核心逻辑：Outer Join ---
+    # indicator=True 会生成一个 '_merge' 列
+    result = pd.merge(df_erp, df_bank, on="Order_ID", how="outer", indicator=True)
+
+    # 计算金额差异 (Diff)：按整数分计算，再换回元
+    erp_cents = to_cents(result["ERP_Amount"].fillna(0))
+    bank_cents = to_cents(result["Bank_Amount"].fillna(0))
+    diff_cents = bank_cents - erp_cents
+    result["ERP_Amount"] = erp_cents / 100
+    result["Bank_Amount"] = bank_cents / 100
+    result["Diff"] = diff_cents / 100
+
+    # 打标签：Status (整列向量化判断，顺序即优先级)
+    merge = result["_merge"].to_numpy()
+    codes = np.select(
+        [merge == "left_only", merge == "right_only", diff_cents != 0],
+        [
+            _status_code(STATUS_MISSING_IN_BANK),
+            _status_code(STATUS_UNKNOWN_INCOME),
+            _status_code(STATUS_MISMATCH),
+        ],
+        default=_status_code(STATUS_MATCHED),
+    )
+    result["Status"] = pd.Categorical.from_codes(codes, dtype=STATUS_DTYPE)
+    return result
+
+
+def _bucket_bounds(order_ids: List[np.ndarray], buckets: int) -> np.ndarray:
+    """
+    单号区间桶的边界：从两本账里抽样取分位点，每个桶的行数大致相同。
+    桶按单号区间切，结果按桶号拼起来就是按单号排好的，不用再全局排序。
+    """
+    rng = np.random.default_rng(0)
+    samples = [
+        ids[rng.integers(0, len(ids), 100 * buckets)] for ids in order_ids if len(ids)
+    ]
+    sample = np.concatenate(samples) if samples else np.empty(0, dtype=object)
+    sample = np.unique(sample[pd.notna(sample)])
+    if not len(sample):
+        # 两本账都是空的 (或单号全是空值)：没有边界，所有行都在 0 号桶
+        return sample
+    cut = np.linspace(0, len(sample), buckets + 1)[1:-1].astype("int64")
+    return sample[cut]
+
+
+def _write_buckets(df: pd.DataFrame, bucket: np.ndarray, path: Path):
+    """
+    账本按桶号写成 Hive 分区的 Parquet (path/recon_bucket=3/...)，只写一次，子进程各读各的桶。
+    切分在 Arrow 里做，不在父进程里复制 DataFrame；preserve_order 保留文件里的行序。
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.append_column(BUCKET, pa.array(bucket, type=pa.int32()))
+    ds.write_dataset(
+        table,
+        path,
+        format="parquet",
+        partitioning=[BUCKET],
+        partitioning_flavor="hive",
+        preserve_order=True,
+    )
+
+
+def _partition_groups(
+    df: pd.DataFrame, date_col: str, partition_by: List[str]
+) -> Dict[Tuple, np.ndarray]:
+    """桶内按 partition_by 分组：分区键 -> 行位置"""
+    if not partition_by:
+        return {(): np.arange(len(df))}
+    keys = []
+    for col in partition_by:
+        if col == PERIOD:
+            # 年 * 100 + 月，日期为空的是 -1
+            dates = pd.to_datetime(df[date_col], errors="coerce")
+            period = dates.dt.year * 100 + dates.dt.month
+            keys.append(period.fillna(-1).astype("int64").to_numpy())
+        else:
+            keys.append(df[col].astype(str).to_numpy())
+    groups = df.groupby(keys, sort=False).indices
+    # 分区键换成 Python 值，partition_report 里显示成 (202401, 3) 而不是 np.int64(202401)
+    return {
+        tuple(
+            v.item() if isinstance(v, np.generic) else v
+            for v in (k if isinstance(k, tuple) else (k,))
+        ): rows
+        for k, rows in groups.items()
+    }
+
+
+def _reconcile_bucket(
+    bucket: int,
+    erp_path: str,
+    bank_path: str,
+    partition_by: List[str],
+    out_path: str,
+) -> List[Dict]:
+    """
+    对账一个单号区间桶 (在子进程里执行)。
+    自己从 Parquet 读这个桶的两本账，桶内按 partition_by 逐个分区对账，结果按单号排好写到 out_path。
+    不抛异常：每个分区返回一条结果记录，一个分区出错不影响其他分区。
+    """
+    started = time.perf_counter()
+    try:
+        df_erp, df_bank = (
+            read_parquet(path, filters=[(BUCKET, "==", bucket)]).drop(columns=BUCKET)
+            for path in (erp_path, bank_path)
+        )
+        erp_groups = _partition_groups(df_erp, ERP_DATE, partition_by)
+        bank_groups = _partition_groups(df_bank, BANK_DATE, partition_by)
+    except Exception as e:
+        return [
+            {
+                "partition": (bucket,),
+                "status": "failed",
+                "error": f"{type(e).__name__}: {e}",
+                "seconds": round(time.perf_counter() - started, 3),
+            }
+        ]
+
+    empty = np.empty(0, dtype="int64")
+    report, results = [], []
+    for key in sorted(set(erp_groups) | set(bank_groups)):
+        started = time.perf_counter()
+        erp_rows = erp_groups.get(key, empty)
+        bank_rows = bank_groups.get(key, empty)
+        result = {
+            "partition": key + (bucket,),
+            "erp_rows": len(erp_rows),
+            "bank_rows": len(bank_rows),
+        }
+        try:
+            results.append(_outer_join(df_erp.take(erp_rows), df_bank.take(bank_rows)))
+            result["status"] = "ok"
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        report.append(result)
+
+    if results:
+        merged = pd.concat(results, ignore_index=True)
+        if len(results) > 1:
+            # 同一单号可能在桶内的几个分区里都有：按单号稳定排序 (同一单号按分区键的顺序)
+            order = np.argsort(merged["Order_ID"].to_numpy(), kind="stable")
+            merged = merged.iloc[order]
+        write_parquet(merged, out_path)
+    return report
+
+
+# === DuckDB 模式 ===
+# pandas read_csv 默认当成缺失值的字符串 (常见的那些)，两条路径读出来的空值要一致
+_NA_STRINGS = ["", "NA", "N/A", "n/a", "#N/A", "NaN", "nan", "NULL", "null", "None"]
+# 写报表时从结果表一批取多少行 (每批转成一个 DataFrame 写进 Excel)
+REPORT_BATCH_ROWS = 100_000
+
+
+def _sql_str(value: Union[str, Path]) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _sql_cents(col: str) -> str:
+    # round_even 和 np.round 一样是银行家舍入
+    return f'CAST(round_even(coalesce("{col}", 0) * 100, 0) AS BIGINT)'
 
 
 class ReconBot:
-    def __init__(self):
+    """
+    ERP 账和银行流水对账。
+    - backend="pandas" (默认)：两本账读进内存，结果在 df_result
+    - backend="duckdb"：读取、outer join、差异和状态都在 DuckDB 里算，内存不够时落盘到 temp_dir，
+      报表由 DuckDB 直接写出；适合放不进内存的年末全主体账本。结果在 DuckDB 表 recon_result 里，
+      df_result 保持 None，需要看明细时用 summary() / exceptions()
+    memory_limit: DuckDB 内存上限，如 "4GB" (默认由 DuckDB 决定，约为物理内存的 80%)。
+    多币种：账本里有 Currency 列时，按单号配上之后再把金额换算成 reporting_currency
+    (原币金额和币种保留在 ERP_/Bank_Original_Amount、ERP_/Bank_Currency)：
+    两边币种相同的按原币比差额；不同的两边都按 ERP 日期 (没有就用银行日期) 的同一天汇率换算再比；
+    换算不了的状态是缺汇率。
+    fx: 带汇率历史的 ExchangeRateClient，默认读本地汇率历史 (FX_RATES_PATH)。只支持 pandas 后端。
+    """
+
+    def __init__(
+        self,
+        backend: str = "pandas",
+        memory_limit: Optional[str] = None,
+        temp_dir: Optional[Union[str, Path]] = None,
+        reporting_currency: str = "CNY",
+        fx: Optional[ExchangeRateClient] = None,
+    ):
+        if backend not in ("pandas", "duckdb"):
+            raise ValueError(f"Unsupported backend: {backend}")
+        self.backend = backend
+        self.memory_limit = memory_limit
+        self.temp_dir = temp_dir
+        self.reporting_currency = reporting_currency
+        self.fx = fx
         # 使用 config.py 里配置好的绝对路径
         self.data_dir = RECON_DATA_DIR
         self.df_erp = None
         self.df_bank = None
         self.df_result = None
+        # 分区并行时每个分区的结果 (partition / 行数 / status / seconds / error)
+        self.partition_report = None
+        self.con = None
+        self._work_dir = None
 
     def load_data(self):
         print("📥 [Bot] Loading ledgers...")
@@ -26,91 +319,637 @@ class ReconBot:
                 f"Missing data files in {self.data_dir}. Please run 'Generate Reconciliation Mock Data' first."
             )
 
-        # 读取数据
-        self.df_erp = pd.read_csv(erp_path)
-        self.df_bank = pd.read_csv(bank_path)
+        if self.backend == "duckdb":
+            return self._load_duckdb(erp_path, bank_path)
+
+        # 读取数据 (单号按文本读，"001" 不会先变成 1)
+        # round_trip：金额按文本精确解析，默认解析器偶尔差最后一位，恰好落在半分上时会舍入到另一分
+        self.df_erp = pd.read_csv(
+            erp_path, dtype={"Order_ID": str}, float_precision="round_trip"
+        )
+        self.df_bank = pd.read_csv(
+            bank_path, dtype={"Transaction_Ref": str}, float_precision="round_trip"
+        )
 
         # 预处理：统一关键列名 (Key Mapping)
         # 把银行的 Transaction_Ref 改名为 Order_ID，方便后续对比
-        self.df_bank = self.df_bank.rename(
-            columns={"Transaction_Ref": "Order_ID", "In_Amount": "Bank_Amount"}
-        )
+        self.df_bank = self.df_bank.rename(columns=BANK_RENAMES)
 
         # 把 ERP 的 Amount 改名
-        self.df_erp = self.df_erp.rename(columns={"Amount_CNY": "ERP_Amount"})
+        self.df_erp = self.df_erp.rename(columns=ERP_RENAMES)
 
         # 确保 ID 都是字符串，防止 "001" 变成 1
         self.df_erp["Order_ID"] = self.df_erp["Order_ID"].astype(str)
         self.df_bank["Order_ID"] = self.df_bank["Order_ID"].astype(str)
 
+        # 多币种账本：币种列按两边改名，金额在按单号配上之后再换算 (_convert_currencies)
+        self.df_erp = self.df_erp.rename(columns={CURRENCY: "ERP_Currency"})
+        self.df_bank = self.df_bank.rename(columns={CURRENCY: "Bank_Currency"})
+
         return self
 
-    def reconcile(self):
+    def _convert_currencies(self):
+        """
+        多币种：按单号配上之后换算成 reporting_currency，重算差额和状态。
+        一笔交易只用一个汇率日：ERP 日期，ERP 没有的 (不明入账 / 日期为空) 用银行日期，
+        两边按同一天的汇率换算，不会因为收付款日汇率不同出现假的金额不符。
+        """
+        fx = self.fx or ExchangeRateClient().load_history()
+        print(f"💱 [Bot] Converting amounts to {self.reporting_currency}...")
+        res = self.df_result
+        merge = res["_merge"].to_numpy()
+        dates = pd.Series(pd.NaT, index=res.index, dtype="datetime64[ns]")
+        for col in (ERP_DATE, BANK_DATE):
+            if col in res:
+                dates = dates.fillna(pd.to_datetime(res[col], errors="coerce"))
+
+        original, converted, currencies = {}, {}, {}
+        for side, amount, present in (
+            ("ERP", "ERP_Amount", merge != "right_only"),
+            ("Bank", "Bank_Amount", merge != "left_only"),
+        ):
+            values = res[amount].to_numpy(dtype="float64")
+            original[side] = to_cents(res[amount])
+            currency = f"{side}_Currency"
+            if currency not in res:
+                # 这本账没有币种列：本来就是记账本位币
+                currencies[side] = np.full(len(res), self.reporting_currency, object)
+                converted[side] = values
+                continue
+            currencies[side] = res[currency].astype(str).to_numpy()
+            res[f"{side}_Original_Amount"] = np.where(present, values, np.nan)
+            values = values.copy()
+            values[present] = fx.convert_series(
+                res[amount][present],
+                res[currency][present],
+                dates[present],
+                to_currency=self.reporting_currency,
+            ).to_numpy()
+            converted[side] = values
+
+        erp, bank = converted["ERP"], converted["Bank"]
+        no_rate = np.isnan(erp) | np.isnan(bank)
+        erp_cents = to_cents(pd.Series(np.nan_to_num(erp)))
+        bank_cents = to_cents(pd.Series(np.nan_to_num(bank)))
+        # 换算后的金额和单币种一样按分取整，缺汇率的留 NaN
+        res["ERP_Amount"] = np.where(np.isnan(erp), np.nan, erp_cents / 100)
+        res["Bank_Amount"] = np.where(np.isnan(bank), np.nan, bank_cents / 100)
+        # 币种相同的按原币比：差额和汇率无关，缺汇率也能判断对没对平
+        same = currencies["ERP"] == currencies["Bank"]
+        settled = np.where(
+            same, original["ERP"] == original["Bank"], erp_cents == bank_cents
+        )
+        both = merge == "both"
+        # 只有一边的先按漏收款 / 不明入账：缺汇率也不能让它们从漏收款报告里消失
+        codes = np.select(
+            [
+                both & same & settled,
+                merge == "left_only",
+                merge == "right_only",
+                no_rate,
+                ~settled,
+            ],
+            [
+                _status_code(STATUS_MATCHED),
+                _status_code(STATUS_MISSING_IN_BANK),
+                _status_code(STATUS_UNKNOWN_INCOME),
+                _status_code(STATUS_NO_FX_RATE),
+                _status_code(STATUS_MISMATCH),
+            ],
+            default=_status_code(STATUS_MATCHED),
+        )
+        diff = (bank_cents - erp_cents) / 100
+        diff[no_rate] = np.nan
+        diff[both & same & settled] = 0.0
+        res["Diff"] = diff
+        res["Status"] = pd.Categorical.from_codes(codes, dtype=STATUS_DTYPE)
+        missing = int((codes == _status_code(STATUS_NO_FX_RATE)).sum())
+        if missing:
+            print(f"   ⚠️ {missing} rows without FX rate")
+
+    def _load_duckdb(self, erp_path: Path, bank_path: Path):
+        # 每次运行一个独立的工作目录：数据库文件 + 落盘的中间结果，close() 时整个删掉
+        base = Path(self.temp_dir or self.data_dir / ".duckdb_tmp")
+        base.mkdir(parents=True, exist_ok=True)
+        self._work_dir = Path(tempfile.mkdtemp(prefix="recon_", dir=base))
+        # 用文件数据库而不是内存库：账本和结果表超出内存上限时可以换出到磁盘
+        self.con = duckdb.connect(str(self._work_dir / "recon.duckdb"))
+        self.con.execute(f"SET temp_directory = {_sql_str(self._work_dir)}")
+        if self.memory_limit:
+            self.con.execute(f"SET memory_limit = {_sql_str(self.memory_limit)}")
+
+        # 两本账各导入一张表，列名映射和 pandas 路径一样
+        # 缺失的单号和 pandas 的 astype(str) 一样变成 'nan'；__rid 记住文件里的行序
+        def load(name: str, path: Path, renames: dict):
+            key = {new: old for old, new in renames.items()}.get("Order_ID", "Order_ID")
+            na = ", ".join(_sql_str(v) for v in _NA_STRINGS)
+            source = (
+                f"read_csv({_sql_str(path)}, header = true, nullstr = [{na}], "
+                f"types = {{{_sql_str(key)}: 'VARCHAR'}}, "
+                f"auto_type_candidates = ['BIGINT', 'DOUBLE', 'VARCHAR'])"
+            )
+            rename = ", ".join(f'"{old}" AS "{new}"' for old, new in renames.items())
+            fill_key = f'SELECT * REPLACE (coalesce("{key}", \'nan\') AS "{key}")'
+            self.con.execute(
+                f"CREATE TABLE {name} AS SELECT * RENAME ({rename}), "
+                f"row_number() OVER () AS __rid FROM ({fill_key} FROM {source})"
+            )
+
+        load("erp", erp_path, ERP_RENAMES)
+        load("bank", bank_path, BANK_RENAMES)
+        for name in ("erp", "bank"):
+            if CURRENCY in self.con.sql(f"SELECT * FROM {name} LIMIT 0").columns:
+                raise ValueError(
+                    "Multi-currency ledgers need backend='pandas' (vectorized FX conversion)"
+                )
+        return self
+
+    def _joined_columns(self) -> List[str]:
+        """outer join 之后的列，顺序和重名列的后缀都跟 pd.merge 一致"""
+        erp_cols = list(self.con.sql("SELECT * FROM erp").columns)
+        bank_cols = list(self.con.sql("SELECT * FROM bank").columns)
+        erp_cols.remove("__rid")
+        bank_cols.remove("__rid")
+        shared = (set(erp_cols) & set(bank_cols)) - {"Order_ID"}
+        cols = []
+        for c in erp_cols:
+            if c == "Order_ID":
+                cols.append('coalesce(e."Order_ID", b."Order_ID") AS "Order_ID"')
+            else:
+                alias = f"{c}_x" if c in shared else c
+                cols.append(f'e."{c}" AS "{alias}"')
+        for c in bank_cols:
+            if c != "Order_ID":
+                alias = f"{c}_y" if c in shared else c
+                cols.append(f'b."{c}" AS "{alias}"')
+        return cols
+
+    def _reconcile_duckdb(self):
+        if self.con is None:
+            raise RuntimeError("Call load_data() first")
+        statuses = ", ".join(_sql_str(s) for s in STATUS_DTYPE.categories)
+        self.con.execute("DROP TABLE IF EXISTS recon_result")
+        self.con.execute("DROP TYPE IF EXISTS recon_status")
+        # ENUM 和 pandas 的 category 一样，每行只存编码
+        self.con.execute(f"CREATE TYPE recon_status AS ENUM ({statuses})")
+
+        joined_cols = ", ".join(self._joined_columns())
+        names = self.con.sql(f"SELECT {joined_cols} FROM erp e, bank b LIMIT 0").columns
+        amounts = {
+            "ERP_Amount": "__erp_cents / 100",
+            "Bank_Amount": "__bank_cents / 100",
+        }
+        out_cols = ", ".join(
+            f'{amounts[c]} AS "{c}"' if c in amounts else f'"{c}"' for c in names
+        )
+        # 顺序和 pd.merge(how="outer") 一致：按单号排序，同一单号内按两边文件里的行序
+        self.con.execute(f"""
+            CREATE TABLE recon_result AS
+            WITH joined AS (
+                SELECT {joined_cols}, e.__rid AS __erp_rid, b.__rid AS __bank_rid
+                FROM erp e FULL OUTER JOIN bank b ON e."Order_ID" = b."Order_ID"
+            ),
+            cents AS (
+                SELECT *,
+                    {_sql_cents("ERP_Amount")} AS __erp_cents,
+                    {_sql_cents("Bank_Amount")} AS __bank_cents
+                FROM joined
+            )
+            SELECT {out_cols},
+                CASE
+                    WHEN __bank_rid IS NULL THEN 'left_only'
+                    WHEN __erp_rid IS NULL THEN 'right_only'
+                    ELSE 'both'
+                END AS "_merge",
+                (__bank_cents - __erp_cents) / 100 AS "Diff",
+                CAST(
+                    CASE
+                        WHEN __bank_rid IS NULL THEN {_sql_str(STATUS_MISSING_IN_BANK)}
+                        WHEN __erp_rid IS NULL THEN {_sql_str(STATUS_UNKNOWN_INCOME)}
+                        WHEN __bank_cents <> __erp_cents THEN {_sql_str(STATUS_MISMATCH)}
+                        ELSE {_sql_str(STATUS_MATCHED)}
+                    END AS recon_status
+                ) AS "Status"
+            FROM cents
+            ORDER BY "Order_ID", __erp_rid, __bank_rid
+            """)
+        return self
+
+    def reconcile(
+        self,
+        partition_by: Optional[List[str]] = None,
+        max_workers: Optional[int] = None,
+        buckets: Optional[int] = None,
+    ):
+        """
+        按单号 outer join 两本账，算差额和状态。
+        partition_by / max_workers 给了任意一个就走分区并行 (只支持 pandas 后端)：
+        - partition_by: 两本账都有的列 (比如 "Account")，或者 PERIOD (按月，ERP 用 Date、银行用 Txn_Date)。
+          按期间分区时，跨月的在途款在两个月里分别是漏收款 / 不明入账，和月结对账的口径一致
+        - 两本账先按单号区间分成 buckets 桶 (默认 4 × 进程数)，写成按桶分区的 Parquet (放在 temp_dir)：
+          同一单号总在同一个桶里，子进程自己读自己的桶，桶内再按 partition_by 分区对账
+        - max_workers: 进程数，默认等于 CPU 核数
+        桶按单号区间排好，按桶号拼起来就和全局 merge 的行序一致；
+        失败的分区不进结果，记在 partition_report 里。
+        """
         print("⚙️ [Bot] Reconciling transactions...")
+        parallel = partition_by is not None or max_workers is not None
+        if self.backend == "duckdb":
+            if parallel:
+                raise ValueError(
+                    "Partitioned reconciliation needs backend='pandas' "
+                    "(DuckDB already parallelizes the join)"
+                )
+            return self._reconcile_duckdb()
+        if parallel:
+            self._reconcile_partitioned(list(partition_by or []), max_workers, buckets)
+        else:
+            self.df_result = _outer_join(self.df_erp, self.df_bank)
+        if "ERP_Currency" in self.df_result or "Bank_Currency" in self.df_result:
+            self._convert_currencies()
+        return self
+
+    def _reconcile_partitioned(
+        self,
+        partition_by: List[str],
+        max_workers: Optional[int],
+        buckets: Optional[int],
+    ):
+        for col in partition_by:
+            if col != PERIOD and (col not in self.df_erp or col not in self.df_bank):
+                raise ValueError(f"Partition column not in both ledgers: {col}")
+        max_workers = max_workers or os.cpu_count() or 1
+        buckets = buckets or 4 * max_workers
+
+        base = Path(self.temp_dir or self.data_dir / ".duckdb_tmp")
+        base.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="recon_parts_", dir=base) as work:
+            work = Path(work)
+
+            # 1. 两本账按同一组单号区间分桶，各写一次 Parquet
+            bounds = _bucket_bounds(
+                [
+                    self.df_erp["Order_ID"].to_numpy(),
+                    self.df_bank["Order_ID"].to_numpy(),
+                ],
+                buckets,
+            )
+            sizes = np.zeros(buckets, dtype="int64")
+            for name, df in (("erp", self.df_erp), ("bank", self.df_bank)):
+                bucket = np.searchsorted(
+                    bounds, df["Order_ID"].to_numpy(), side="right"
+                )
+                sizes += np.bincount(bucket, minlength=buckets)
+                _write_buckets(df, bucket, work / name)
+            # 大桶先提交：最慢的桶最先开始，尾部等待最短
+            order = [int(b) for b in np.argsort(-sizes, kind="stable") if sizes[b]]
+            print(f"   {len(order)} buckets on {max_workers} workers")
+
+            if not order:
+                # 两本账都没有行：没什么可并行的
+                self.df_result = _outer_join(self.df_erp, self.df_bank)
+                self.partition_report = pd.DataFrame(
+                    columns=["partition", "status", "seconds"]
+                )
+                return self
+
+            # 2. 并行对账：子进程只拿到路径和桶号，结果写回 Parquet，不经过 pickle
+            def bucket_args(b: int) -> tuple:
+                return (
+                    b,
+                    str(work / "erp"),
+                    str(work / "bank"),
+                    partition_by,
+                    str(work / f"result_{b:05d}.parquet"),
+                )
+
+            report = []
+
+            def collect(results: List[Dict]):
+                for result in results:
+                    if result["status"] != "ok":
+                        print(
+                            f"   ❌ Partition {result['partition']}: {result['error']}"
+                        )
+                    report.append(result)
+
+            pending = set(order)
+            try:
+                with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                    futures = {
+                        pool.submit(_reconcile_bucket, *bucket_args(b)): b
+                        for b in order
+                    }
+                    for future in as_completed(futures):
+                        collect(future.result())
+                        pending.discard(futures[future])
+            except (BrokenProcessPool, OSError) as e:
+                # 进程池起不来或者有子进程崩了 (比如被 OOM 杀掉)：剩下的桶在本进程里逐个跑
+                print(
+                    f"   ⚠️ Process pool failed ({type(e).__name__}: {e}), "
+                    f"running {len(pending)} buckets serially"
+                )
+                for b in order:
+                    if b in pending:
+                        collect(_reconcile_bucket(*bucket_args(b)))
+
+            self.partition_report = pd.DataFrame(report)
+            self.partition_report["partition"] = self.partition_report["partition"].map(
+                str
+            )
+
+            # 3. 合并：桶本身按单号区间排好，按桶号顺序拼起来就和全局 merge 的行序一致
+            # (文本列的空值从 Arrow 读回来是 None 而不是 NaN，isna() 一样认)
+            paths = [work / f"result_{b:05d}.parquet" for b in range(buckets)]
+            tables = [pq.read_table(p) for p in paths if p.exists()]
+            if not tables:
+                raise RuntimeError("All partitions failed")
+            merged = pa.concat_tables(tables, promote_options="permissive")
+            self.df_result = merged.to_pandas()
+        self.df_result["Status"] = self.df_result["Status"].astype(STATUS_DTYPE)
+        return self
+
+    def match_residue(
+        self,
+        tolerance_abs: float = 1.0,
+        tolerance_pct: float = 0.05,
+        date_window_days: int = 3,
+        max_batch_size: int = 5,
+        max_candidates: int = 50,
+        max_search: int = 10_000,
+    ):
+        """
+        第二轮：单号没对平的剩余部分，按金额容差 + 日期窗口再配一次 (单号缺失、写错都能配上)。
+        - 单号对上、金额差在容差内 (比如银行扣了手续费，480 vs 500) -> 容差内
+        - 漏收款和不明入账一对一：±date_window_days 天内金额最接近的一对 -> 金额日期匹配
+        - 一笔不明入账 = 同一窗口内 2..max_batch_size 笔漏收款之和 -> 合并付款
+        容差 = max(tolerance_abs 元, tolerance_pct × 金额)。
+        配上的行在 Match_Group 列里编号相同；max_candidates / max_search 是合并付款搜索的硬上限
+        (每笔流水最多看几笔 ERP、最多展开几个组合)。
+        """
+        print("🔍 [Bot] Matching residue by amount and date window...")
+        rows, residue = self._residue()
+        codes = residue["Status"].astype(STATUS_DTYPE).cat.codes.to_numpy().copy()
+        original = codes.copy()
+        group = np.zeros(len(residue), dtype="int64")
+        erp_cents = to_cents(residue["ERP_Amount"].fillna(0))
+        bank_cents = to_cents(residue["Bank_Amount"].fillna(0))
+
+        def allowance(cents: np.ndarray) -> np.ndarray:
+            pct = np.round(np.abs(cents) * tolerance_pct).astype("int64")
+            return np.maximum(pct, round(tolerance_abs * 100))
 
-        # --- 核心逻辑：Outer Join ---
-        # indicator=True 会生成一个 '_merge' 列
-        self.df_result = pd.merge(
-            self.df_erp, self.df_bank, on="Order_ID", how="outer", indicator=True
+        # 1. 单号对上，差额在容差内
+        within = (codes == _status_code(STATUS_MISMATCH)) & (
+            np.abs(bank_cents - erp_cents) <= allowance(erp_cents)
         )
+        codes[within] = _status_code(STATUS_WITHIN_TOLERANCE)
 
-        # 计算金额差异 (Diff)
-        self.df_result["ERP_Amount"] = self.df_result["ERP_Amount"].fillna(0)
-        self.df_result["Bank_Amount"] = self.df_result["Bank_Amount"].fillna(0)
+        e, batches = np.empty(0, dtype="int64"), []
+        if ERP_DATE not in residue or BANK_DATE not in residue:
+            # 没有日期列 (或两边都叫 Date 被 merge 改成了 Date_x/Date_y)：日期窗口的两步跳过
+            print(
+                f"   ⚠️ No {ERP_DATE}/{BANK_DATE} columns, skipping date-window matching"
+            )
+            return self._finish_residue(
+                rows, codes, original, group, within, e, batches
+            )
 
-        self.df_result["Diff"] = (
-            self.df_result["Bank_Amount"] - self.df_result["ERP_Amount"]
+        # 2. 一对一 (缺汇率换算不出金额的漏收款 / 不明入账不参与按金额匹配)
+        erp_days = _to_days(residue[ERP_DATE])
+        bank_days = _to_days(residue[BANK_DATE])
+        erp_rows = np.flatnonzero(
+            (codes == _status_code(STATUS_MISSING_IN_BANK))
+            & (erp_days != NO_DATE)
+            & residue["ERP_Amount"].notna().to_numpy()
+        )
+        bank_rows = np.flatnonzero(
+            (codes == _status_code(STATUS_UNKNOWN_INCOME))
+            & (bank_days != NO_DATE)
+            & residue["Bank_Amount"].notna().to_numpy()
+        )
+        e, b = match_one_to_one(
+            erp_cents[erp_rows],
+            erp_days[erp_rows],
+            bank_cents[bank_rows],
+            bank_days[bank_rows],
+            allowance(erp_cents[erp_rows]),
+            date_window_days,
         )
+        pair_groups = np.arange(1, len(e) + 1)
+        for picked in (erp_rows[e], bank_rows[b]):
+            codes[picked] = _status_code(STATUS_FUZZY_MATCH)
+            group[picked] = pair_groups
 
-        # 打标签：Status
-        def tag_status(row):
-            if row["_merge"] == "left_only":
-                return "❌ Missing in Bank (漏收款)"
-            elif row["_merge"] == "right_only":
-                return "❓ Unknown Income (不明入账)"
-            elif row["Diff"] != 0:
-                return "⚠️ Amount Mismatch (金额不符)"
-            else:
-                return "✅ Matched (对平)"
+        # 3. 多对一：剩下的流水按合并付款再找一次
+        erp_rows = erp_rows[codes[erp_rows] == _status_code(STATUS_MISSING_IN_BANK)]
+        bank_rows = bank_rows[codes[bank_rows] == _status_code(STATUS_UNKNOWN_INCOME)]
+        batches = match_many_to_one(
+            erp_cents[erp_rows],
+            erp_days[erp_rows],
+            bank_cents[bank_rows],
+            bank_days[bank_rows],
+            allowance(bank_cents[bank_rows]),
+            date_window_days,
+            max_batch_size,
+            max_candidates,
+            max_search,
+        )
+        for g, (j, members) in enumerate(batches, start=len(e) + 1):
+            picked = np.append(erp_rows[members], bank_rows[j])
+            codes[picked] = _status_code(STATUS_BATCH_PAYMENT)
+            group[picked] = g
 
-        self.df_result["Status"] = self.df_result.apply(tag_status, axis=1)
+        return self._finish_residue(rows, codes, original, group, within, e, batches)
 
+    def _finish_residue(self, rows, codes, original, group, within, e, batches):
+        """第二轮的结果写回 (只写状态变了的行)"""
+        changed = codes != original
+        self._apply_matches(rows[changed], codes[changed], group[changed])
+        print(
+            f"   {int(within.sum())} within tolerance, {len(e)} pairs, "
+            f"{len(batches)} batch payments"
+        )
         return self
 
-    def generate_report(self):
+    def _residue(self):
+        """没对平的行 (行位置 / DuckDB rowid, 第二轮匹配要用的列；日期列缺了就不取)"""
+        cols = ["Status", "ERP_Amount", "Bank_Amount", ERP_DATE, BANK_DATE]
+        if self.backend == "duckdb":
+            present = set(self.con.sql("SELECT * FROM recon_result LIMIT 0").columns)
+            cols = [c for c in cols if c in present]
+            select = ", ".join(f'"{c}"' for c in cols)
+            residue = self.con.sql(
+                f"SELECT rowid AS __row, {select} FROM recon_result "
+                f'WHERE "Status" <> {_sql_str(STATUS_MATCHED)}'
+            ).df()
+            return residue.pop("__row").to_numpy(), residue
+        cols = [c for c in cols if c in self.df_result.columns]
+        rows = np.flatnonzero(self.df_result["Status"].to_numpy() != STATUS_MATCHED)
+        return rows, self.df_result[cols].iloc[rows].reset_index(drop=True)
+
+    def _apply_matches(self, rows: np.ndarray, codes: np.ndarray, group: np.ndarray):
+        """把第二轮的状态和 Match_Group 写回结果 (group 为 0 表示没有配对)"""
+        statuses = STATUS_DTYPE.categories[codes]
+        groups = pd.array(group, dtype="Int64")
+        groups[group == 0] = pd.NA
+        if self.backend == "duckdb":
+            updates = pd.DataFrame(
+                {"__row": rows, "Status": statuses, "Match_Group": groups}
+            )
+            self.con.execute(
+                'ALTER TABLE recon_result ADD COLUMN IF NOT EXISTS "Match_Group" BIGINT'
+            )
+            self.con.register("match_updates", updates)
+            self.con.execute(
+                'UPDATE recon_result SET "Status" = CAST(u."Status" AS recon_status), '
+                '"Match_Group" = u."Match_Group" '
+                "FROM match_updates u WHERE recon_result.rowid = u.__row"
+            )
+            self.con.unregister("match_updates")
+            return
+        if "Match_Group" not in self.df_result:
+            self.df_result["Match_Group"] = pd.Series(
+                pd.NA, index=self.df_result.index, dtype="Int64"
+            )
+        status_col = self.df_result.columns.get_loc("Status")
+        group_col = self.df_result.columns.get_loc("Match_Group")
+        self.df_result.iloc[rows, status_col] = statuses
+        self.df_result.iloc[rows, group_col] = groups
+
+    def summary(self) -> pd.DataFrame:
+        """各状态的笔数 (只列出现过的状态，按笔数从多到少)"""
+        if self.backend == "duckdb":
+            return (
+                self.con.sql(
+                    'SELECT CAST("Status" AS VARCHAR) AS "Status", count(*) AS "Count" '
+                    'FROM recon_result GROUP BY "Status" ORDER BY "Count" DESC, "Status"'
+                )
+                .df()
+                .set_index("Status")
+            )
+        # 笔数相同时按状态定义的顺序，和 DuckDB 路径一致
+        counts = self.df_result["Status"].value_counts(sort=False)
+        counts = counts[counts > 0].sort_values(ascending=False, kind="stable")
+        return counts.to_frame("Count")
+
+    def _exceptions_sql(self) -> str:
+        return (
+            f'SELECT * FROM recon_result WHERE "Status" <> {_sql_str(STATUS_MATCHED)}'
+        )
+
+    def exceptions(self) -> pd.DataFrame:
+        """异常明细 (只看有问题的)"""
+        if self.backend == "duckdb":
+            df = self.con.sql(self._exceptions_sql()).df()
+            df["Status"] = df["Status"].astype(STATUS_DTYPE)
+            return df
+        return self.df_result[self.df_result["Status"] != STATUS_MATCHED]
+
+    def _result_chunks(self, sql: str) -> Tuple[Iterator[pd.DataFrame], List[str]]:
+        """DuckDB 查询结果按批取出 (一次只有一批在内存里)，返回 (DataFrame 迭代器, 列名)"""
+        reader = self.con.execute(sql).fetch_record_batch(REPORT_BATCH_ROWS)
+        return (batch.to_pandas() for batch in reader), reader.schema.names
+
+    def generate_report(self, full_data: str = "excel"):
+        """
+        写对账报告。Excel 用流式写出 (内存不随行数增长)，超过一个 sheet 的行数上限自动分到
+        Full_Data_2、Full_Data_3 …
+        full_data: 全量明细写到哪里
+        - "excel" (默认)：报告里的 Full_Data sheet
+        - "parquet" / "csv"：单独的 Recon_Full_Data_<日期> 文件，Excel 里只留汇总和异常明细
+        - "none"：不写全量明细
+        DuckDB 后端：异常明细和全量明细从结果表按批取出写进 Excel，不整表取进内存；
+        单独的全量明细文件由 DuckDB 直接 COPY 写出。
+        """
+        if full_data not in ("excel", "parquet", "csv", "none"):
+            raise ValueError(f"Unsupported full_data target: {full_data}")
+        duck = self.backend == "duckdb"
+
         print("📊 [Bot] Generating Excel report...")
 
         # 生成带时间戳的文件名
-        output_path = (
-            self.data_dir / f"Recon_Report_{datetime.now().strftime('%Y%m%d')}.xlsx"
-        )
+        stamp = datetime.now().strftime("%Y%m%d")
+        output_path = self.data_dir / f"Recon_Report_{stamp}.xlsx"
 
-        # 使用 ExcelWriter 可以在同一个文件里写多个 Sheet
-        with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
+        # 一个文件里写多个 Sheet
+        with StreamingExcelWriter(output_path) as writer:
             # Sheet 1: 汇总摘要
-            summary = self.df_result["Status"].value_counts().to_frame("Count")
-            summary.to_excel(writer, sheet_name="Summary")
+            summary = self.summary()
+            writer.write_frame(summary, "Summary", index=True)
 
             # Sheet 2: 异常明细 (只看有问题的)
-            exceptions = self.df_result[self.df_result["Status"] != "✅ Matched (对平)"]
-            exceptions.to_excel(writer, sheet_name="Exceptions", index=False)
+            if duck:
+                chunks, columns = self._result_chunks(self._exceptions_sql())
+                writer.write_chunks(chunks, "Exceptions", columns)
+            else:
+                writer.write_frame(self.exceptions(), "Exceptions")
 
             # Sheet 3: 全量数据
-            self.df_result.to_excel(writer, sheet_name="Full_Data", index=False)
+            if full_data == "excel":
+                if duck:
+                    chunks, columns = self._result_chunks("SELECT * FROM recon_result")
+                    sheets = writer.write_chunks(chunks, "Full_Data", columns)
+                else:
+                    sheets = writer.write_frame(self.df_result, "Full_Data")
+                if len(sheets) > 1:
+                    print(f"   Full data split across {len(sheets)} sheets")
+
+            # Sheet 4: 分区并行时各分区的耗时和失败原因
+            if self.partition_report is not None:
+                writer.write_frame(self.partition_report, "Partitions")
+
+        if full_data in ("parquet", "csv"):
+            full_path = self.data_dir / f"Recon_Full_Data_{stamp}.{full_data}"
+            if duck:
+                options = "FORMAT parquet" if full_data == "parquet" else "HEADER"
+                self.con.execute(
+                    f"COPY recon_result TO {_sql_str(full_path)} ({options})"
+                )
+            elif full_data == "parquet":
+                write_parquet(self.df_result, full_path)
+            else:
+                self.df_result.to_csv(full_path, index=False)
+            print(f"✅ Full data saved to: {full_path}")
 
         print(f"✅ Report saved to: {output_path}")
         print("\n--- Summary ---")
         print(summary)
 
+    def close(self):
+        """DuckDB 模式：关闭连接并删掉工作目录 (结果表随之删除)"""
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+        if self._work_dir is not None:
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+            self._work_dir = None
+
 
 # 封装成函数，供 main.py 调用
-def run_recon_bot():
+def run_recon_bot(
+    backend: str = "pandas",
+    memory_limit: Optional[str] = None,
+    partition_by: Optional[List[str]] = None,
+    max_workers: Optional[int] = None,
+    full_data: str = "excel",
+    match_residue: bool = False,
+):
+    """
+    match_residue: 单号没对平的再按金额容差 + 日期窗口配一次 (默认关)。
+    打开后部分漏收款 / 不明入账 / 金额不符会变成容差内 / 金额日期匹配 / 合并付款。
+    """
     print("🤖 [Service] Starting Reconciliation Bot...")
+    bot = ReconBot(backend=backend, memory_limit=memory_limit)
     try:
-        bot = ReconBot()
-        (bot.load_data().reconcile().generate_report())
+        bot.load_data().reconcile(partition_by=partition_by, max_workers=max_workers)
+        if match_residue:
+            bot.match_residue()
+        bot.generate_report(full_data=full_data)
     except Exception as e:
         print(f"❌ Error during reconciliation: {e}")
+    finally:
+        bot.close()
 
 
 if __name__ == "__main__":
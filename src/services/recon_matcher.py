@@ -0,0 +1,275 @@
+from bisect import bisect_left
+from typing import List, Tuple
+
+import numpy as np
+
+# 第二轮匹配 (按金额容差 + 日期窗口) 用的索引和搜索。
+# 输入都是对齐好的 numpy 数组：金额是整数分，日期是天数 (int64)，不关心单号和状态文字。
+
+
+class WindowIndex:
+    """
+    按 (日期, 金额) 排序的索引。
+    复合键 = 天数 * 跨度 + 金额，"某一天、金额在 [lo, hi] 之间"就是键上的一段连续区间，
+    日期窗口里的每一天对所有查询一起做一次 searchsorted，整体 O(n log n)，不做两两比较。
+    """
+
+    def __init__(self, cents: np.ndarray, days: np.ndarray):
+        self.min_cents = int(cents.min()) if len(cents) else 0
+        self._span = (int(cents.max()) - self.min_cents + 1) if len(cents) else 1
+        self.order = np.lexsort((cents, days))
+        self._keys = self._key(days[self.order], cents[self.order])
+
+    def _key(self, days: np.ndarray, cents: np.ndarray) -> np.ndarray:
+        cents = np.clip(cents, self.min_cents, self.min_cents + self._span - 1)
+        return days.astype("int64") * self._span + (cents - self.min_cents)
+
+    def ranges(
+        self, days: np.ndarray, lo: np.ndarray, hi: np.ndarray, window: int
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        每个查询在窗口内每一天的候选区间 (self.order 里的位置 [start, stop))，
+        按离查询日期由近到远排列。超出索引金额范围的查询区间为空。
+        """
+        out = []
+        empty = (hi < self.min_cents) | (lo > self.min_cents + self._span - 1)
+        for offset in sorted(range(-window, window + 1), key=abs):
+            d = days + offset
+            start = np.searchsorted(self._keys, self._key(d, lo), side="left")
+            stop = np.searchsorted(self._keys, self._key(d, hi), side="right")
+            out.append((start, np.where(empty, start, stop)))
+        return out
+
+
+class _FreeSlots:
+    """
+    索引位置上"还没被用掉"的集合：跳过已用位置找下一个/上一个空位，
+    并查集 + 路径压缩，均摊近似 O(1)，密集区间里也不会一格一格地扫已用的记录。
+    """
+
+    def __init__(self, n: int):
+        # _right[p]: 从 p 往右第一个空位 (n 是哨兵)；_left[p + 1]: 从 p 往左第一个空位 + 1 (0 是哨兵)
+        self._right = list(range(n + 1))
+        self._left = list(range(n + 1))
+
+    @staticmethod
+    def _find(parent: List[int], x: int) -> int:
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def next(self, pos: int) -> int:
+        """pos 及其右边第一个空位"""
+        return self._find(self._right, pos)
+
+    def prev(self, pos: int) -> int:
+        """pos 及其左边第一个空位 (没有时是 -1)"""
+        return self._find(self._left, pos + 1) - 1
+
+    def take(self, pos: int):
+        self._right[pos] = pos + 1
+        self._left[pos + 1] = pos
+
+
+def match_one_to_one(
+    erp_cents: np.ndarray,
+    erp_days: np.ndarray,
+    bank_cents: np.ndarray,
+    bank_days: np.ndarray,
+    allowance: np.ndarray,
+    window: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    一对一：每笔 ERP 在 ±window 天、金额差 <= allowance (分) 的未用银行流水里，
+    选金额差最小的 (再比日期差)。
+    每一天的候选按金额排好序，从 ERP 金额的位置向左右各取第一笔未用的就是这一天最接近的，
+    不用扫整个容差区间。整批 ERP 一起向量化地挑，抢同一笔流水的按分数排名，
+    第 r 名顺延到同方向的第 r 个空位，还没配上的下一轮在剩下的流水里重挑，直到没有新的配对。
+    先只配金额完全相同的，再放宽到容差，避免近似金额抢走别人的精确匹配。
+    返回配对的 (ERP 下标, 银行下标)。
+    """
+    paired = np.full(len(erp_cents), -1, dtype="int64")
+    if len(erp_cents) == 0 or len(bank_cents) == 0:
+        return np.empty(0, dtype="int64"), np.empty(0, dtype="int64")
+    index = WindowIndex(bank_cents, bank_days)
+    pos_cents, pos_days = bank_cents[index.order], bank_days[index.order]
+    free = np.ones(len(index.order), dtype=bool)
+    # 按 (日期, 金额) 的顺序查：有序的查询 searchsorted 更快
+    queue = np.lexsort((erp_cents, erp_days))
+    no_score = np.iinfo("int64").max
+    for tolerance in (np.zeros_like(allowance), allowance):
+        pending = queue[paired[queue] < 0]
+        while len(pending):
+            cents, days, tol = erp_cents[pending], erp_days[pending], tolerance[pending]
+            lower = index.ranges(days, cents - tol, cents, window)
+            upper = index.ranges(days, cents, cents + tol, window)
+            free_pos = np.flatnonzero(free)
+            if len(free_pos) == 0:
+                break
+            last = len(free_pos) - 1
+            best = np.full(len(pending), -1, dtype="int64")
+            best_score = np.full(len(pending), no_score, dtype="int64")
+            # 选中的候选来自哪个区间 [best_lo, best_hi)、从哪个方向 (右 +1 / 左 -1)
+            best_lo = np.zeros(len(pending), dtype="int64")
+            best_hi = np.zeros(len(pending), dtype="int64")
+            best_dir = np.zeros(len(pending), dtype="int64")
+            for (start, mid), (mid2, stop) in zip(lower, upper):
+                # 金额 >= ERP 的第一个空位，金额 <= ERP 的最后一个空位
+                k = np.searchsorted(free_pos, mid2)
+                right = free_pos[np.minimum(k, last)]
+                k = np.searchsorted(free_pos, mid) - 1
+                left = free_pos[np.maximum(k, 0)]
+                for pos, ok, lo, hi, direction in (
+                    (right, (right >= mid2) & (right < stop), mid2, stop, 1),
+                    (left, (k >= 0) & (left >= start), start, mid, -1),
+                ):
+                    # 先比金额差再比日期差 (日期差不超过 window)
+                    score = np.abs(pos_cents[pos] - cents) * (window + 1) + np.abs(
+                        pos_days[pos] - days
+                    )
+                    score = np.where(ok, score, no_score)
+                    better = score < best_score
+                    best = np.where(better, pos, best)
+                    best_score = np.where(better, score, best_score)
+                    best_lo = np.where(better, lo, best_lo)
+                    best_hi = np.where(better, hi, best_hi)
+                    best_dir = np.where(better, direction, best_dir)
+            found = np.flatnonzero(best >= 0)
+            if len(found) == 0:
+                break
+            # 抢同一笔流水的：分数最好的拿这一笔，第 r 名顺着自己的方向拿第 r 个空位
+            # (仍在自己的候选区间里才算)。金额、日期都相同的一大串 (手续费、订阅费) 一轮就能配完，
+            # 不用每轮只配一对
+            found = found[np.lexsort((found, best_score[found], best[found]))]
+            group_start = np.ones(len(found), dtype=bool)
+            group_start[1:] = best[found[1:]] != best[found[:-1]]
+            starts = np.flatnonzero(group_start)
+            rank = np.arange(len(found)) - np.repeat(
+                starts, np.diff(np.append(starts, len(found)))
+            )
+            slot = np.searchsorted(free_pos, best[found]) + rank * best_dir[found]
+            target = free_pos[np.clip(slot, 0, last)]
+            ok = (
+                (slot >= 0)
+                & (slot <= last)
+                & (target >= best_lo[found])
+                & (target < best_hi[found])
+            )
+            # 同一个空位被几笔认领时给名次靠前的
+            claim = found[ok]
+            target = target[ok]
+            order = np.lexsort((claim, best_score[claim], rank[ok], target))
+            claim, target = claim[order], target[order]
+            first = np.ones(len(claim), dtype=bool)
+            first[1:] = target[1:] != target[:-1]
+            winners, seats = claim[first], target[first]
+            paired[pending[winners]] = index.order[seats]
+            free[seats] = False
+            retry = best >= 0
+            retry[winners] = False
+            pending = pending[retry]
+    erp_idx = np.flatnonzero(paired >= 0)
+    return erp_idx, paired[erp_idx]
+
+
+def _find_subset(
+    amounts: List[int], lo: int, hi: int, max_size: int, max_search: int
+) -> List[int]:
+    """
+    在 amounts (从小到大排好) 里找 2..max_size 个数，和落在 [lo, hi]。
+    笔数从少到多逐层找 (笔数越少越可信)；每层深度优先选前几个，最后一个用二分直接查。
+    所有层一共最多展开 max_search 个节点，超出就放弃 (返回空列表)。
+    """
+    n = len(amounts)
+    budget = [max_search]
+
+    def search(start: int, chosen: List[int], total: int, size: int) -> List[int]:
+        slots = size - len(chosen)
+        if slots == 1:
+            # 最后一个数：金额要落在 [lo - total, hi - total]
+            p = bisect_left(amounts, lo - total, start)
+            if p < n and amounts[p] <= hi - total:
+                return chosen + [p]
+            return []
+        # 选了 k 之后还要 slots - 1 个，能凑出的最大和 / 最小和
+        reach = sum(amounts[max(start, n - (slots - 1)) :])
+        for k in range(start, n - slots + 1):
+            budget[0] -= 1
+            if budget[0] < 0:
+                return []
+            if total + sum(amounts[k : k + slots]) > hi:
+                break
+            if total + amounts[k] + reach < lo:
+                continue
+            found = search(k + 1, chosen + [k], total + amounts[k], size)
+            if found or budget[0] < 0:
+                return found
+        return []
+
+    for size in range(2, min(max_size, n) + 1):
+        found = search(0, [], 0, size)
+        if found or budget[0] < 0:
+            return found
+    return []
+
+
+def match_many_to_one(
+    erp_cents: np.ndarray,
+    erp_days: np.ndarray,
+    bank_cents: np.ndarray,
+    bank_days: np.ndarray,
+    allowance: np.ndarray,
+    window: int,
+    max_batch_size: int = 5,
+    max_candidates: int = 50,
+    max_search: int = 10_000,
+) -> List[Tuple[int, List[int]]]:
+    """
+    多对一：一笔银行流水合并支付了几笔 ERP。
+    对每笔银行流水，在 ±window 天内、金额不超过它的未用 ERP 里取最多 max_candidates 个
+    (日期近的优先)，找 2..max_batch_size 笔加起来与流水差 <= allowance (分) 的组合；
+    每笔流水的搜索最多展开 max_search 个节点，组合爆炸时直接放弃。
+    返回 [(银行下标, [ERP 下标, ...]), ...]。
+    """
+    batches = []
+    positive = np.flatnonzero(erp_cents > 0)
+    if len(positive) < 2 or len(bank_cents) == 0:
+        return batches
+    index = WindowIndex(erp_cents[positive], erp_days[positive])
+    # 逐笔流水的搜索在 Python 里做，提前转成 list 比反复取 numpy 标量快得多
+    order = index.order.tolist()
+    cents = erp_cents[positive].tolist()
+    lo = np.full(len(bank_cents), index.min_cents, dtype="int64")
+    ranges = [
+        (start.tolist(), stop.tolist())
+        for start, stop in index.ranges(bank_days, lo, bank_cents + allowance, window)
+    ]
+    free = _FreeSlots(len(order))
+    for j, (target, slack) in enumerate(zip(bank_cents.tolist(), allowance.tolist())):
+        candidates = []
+        for start, stop in ranges:
+            pos = free.next(start[j])
+            while pos < stop[j] and len(candidates) < max_candidates:
+                candidates.append(pos)
+                pos = free.next(pos + 1)
+            if len(candidates) >= max_candidates:
+                break
+        if len(candidates) < 2:
+            continue
+        candidates.sort(key=lambda pos: cents[order[pos]])
+        chosen = _find_subset(
+            [cents[order[pos]] for pos in candidates],
+            target - slack,
+            target + slack,
+            max_batch_size,
+            max_search,
+        )
+        if chosen:
+            members = [candidates[c] for c in chosen]
+            for pos in members:
+                free.take(pos)
+            batches.append((j, positive[[order[pos] for pos in members]].tolist()))
+    return batches
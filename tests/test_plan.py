@@ -0,0 +1,23 @@
+import pandas as pd
+
+from src.core.cleaner import GenericCleaner
+
+
+def _price_chain(cleaner: GenericCleaner) -> GenericCleaner:
+    # extract_numbers 在 normalize_headers 之前，引用的是原始列名 Price
+    return (
+        cleaner.extract_numbers(["Price"]).normalize_headers().select_columns(["price"])
+    )
+
+
+def test_lazy_matches_eager_with_steps_before_normalize(tmp_path):
+    source = tmp_path / "in.csv"
+    pd.DataFrame({"Price": ["$1,200.5", "$3"], "Other": [1, 2]}).to_csv(
+        source, index=False
+    )
+
+    eager = _price_chain(GenericCleaner().load_file(source)).get_data()
+    lazy = _price_chain(GenericCleaner(lazy=True).load_file(source)).get_data()
+
+    assert eager["price"].tolist() == [1200.5, 3.0]
+    pd.testing.assert_frame_equal(lazy, eager)
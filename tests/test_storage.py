@@ -0,0 +1,17 @@
+import pandas as pd
+
+from src.core.storage import ParquetAppender, read_parquet
+
+
+def test_appender_widens_schema_for_sparse_and_nullable_columns(tmp_path):
+    path = tmp_path / "out.parquet"
+    appender = ParquetAppender(path)
+    # 第一块 note 全空、qty 是整数；后面的块 note 有文本、qty 有空值
+    appender.write(pd.DataFrame({"note": [None, None], "qty": [1, 2]}))
+    appender.write(pd.DataFrame({"note": ["a", None], "qty": [3, None]}))
+    appender.close()
+
+    df = read_parquet(path)
+    assert df["note"].tolist() == [None, None, "a", None]
+    assert df["qty"].tolist()[:3] == [1.0, 2.0, 3.0]
+    assert df["qty"].isna().tolist() == [False, False, False, True]